@@ -0,0 +1,338 @@
+"""
+Micro-benchmarks for the CPU-heavy rendering code of the object detection and
+image segmentation interfaces, using synthetic images, OPEX predictions and masks.
+Reports time and peak (Python/numpy) memory per stage and compares them against
+a stored baseline.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from PIL import Image, ImageDraw
+from typing import Callable, Dict, List, Tuple
+
+from gifr.common import init_state, set_logging_level
+import gifr.image_segmentation as imgseg
+import gifr.object_detection as objdet
+from opex import ObjectPredictions
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "rendering.json")
+
+# (megapixels, number of objects)
+OBJDET_SCENARIOS = [
+    (0.3, 1),
+    (0.3, 100),
+    (2.0, 100),
+    (2.0, 1000),
+    (12.0, 1000),
+    (12.0, 10000),
+    (50.0, 10000),
+]
+
+# (megapixels, number of classes, including background)
+IMGSEG_SCENARIOS = [
+    (0.3, 2),
+    (2.0, 16),
+    (12.0, 64),
+    (50.0, 256),
+]
+
+NUM_LABELS = 20
+""" the number of different labels in the synthetic object predictions. """
+
+
+def image_size(megapixels: float) -> Tuple[int, int]:
+    """
+    Determines width and height (4:3) for the number of megapixels.
+
+    :param megapixels: the number of megapixels
+    :type megapixels: float
+    :return: the width and height
+    :rtype: tuple
+    """
+    height = int(round((megapixels * 1e6 * 3 / 4) ** 0.5))
+    return int(round(height * 4 / 3)), height
+
+
+def synthetic_image(rng: np.random.Generator, width: int, height: int) -> Image.Image:
+    """
+    Generates an RGB image with smooth random color blobs.
+
+    :param rng: the random number generator
+    :type rng: np.random.Generator
+    :param width: the width of the image
+    :type width: int
+    :param height: the height of the image
+    :type height: int
+    :return: the image
+    :rtype: Image.Image
+    """
+    small = rng.integers(0, 256, size=(max(1, height // 64), max(1, width // 64), 3), dtype=np.uint8)
+    return Image.fromarray(small, "RGB").resize((width, height), Image.BILINEAR)
+
+
+def synthetic_predictions(rng: np.random.Generator, width: int, height: int, num_objects: int) -> str:
+    """
+    Generates OPEX predictions with random boxes and polygons.
+
+    :param rng: the random number generator
+    :type rng: np.random.Generator
+    :param width: the width of the image
+    :type width: int
+    :param height: the height of the image
+    :type height: int
+    :param num_objects: the number of objects to generate
+    :type num_objects: int
+    :return: the predictions in JSON
+    :rtype: str
+    """
+    objects = []
+    for _ in range(num_objects):
+        w = int(rng.integers(8, max(9, width // 8)))
+        h = int(rng.integers(8, max(9, height // 8)))
+        left = int(rng.integers(0, max(1, width - w)))
+        top = int(rng.integers(0, max(1, height - h)))
+        num_points = int(rng.integers(4, 12))
+        angles = np.sort(rng.uniform(0, 2 * np.pi, num_points))
+        xs = (left + w / 2 + np.cos(angles) * w / 2).astype(int).tolist()
+        ys = (top + h / 2 + np.sin(angles) * h / 2).astype(int).tolist()
+        objects.append({
+            "score": float(rng.uniform()),
+            "label": "label-%d" % int(rng.integers(0, NUM_LABELS)),
+            "bbox": {"left": left, "top": top, "right": left + w - 1, "bottom": top + h - 1},
+            "polygon": {"points": [[x, y] for x, y in zip(xs, ys)]},
+        })
+    return json.dumps({"timestamp": "20240101_000000.000000", "id": "synthetic", "objects": objects})
+
+
+def synthetic_mask(rng: np.random.Generator, width: int, height: int, num_classes: int) -> Image.Image:
+    """
+    Generates a grayscale mask with blocky regions of the classes.
+
+    :param rng: the random number generator
+    :type rng: np.random.Generator
+    :param width: the width of the mask
+    :type width: int
+    :param height: the height of the mask
+    :type height: int
+    :param num_classes: the number of classes (including background)
+    :type num_classes: int
+    :return: the mask
+    :rtype: Image.Image
+    """
+    small = rng.integers(0, num_classes, size=(max(16, height // 32), max(16, width // 32)), dtype=np.uint8)
+    return Image.fromarray(small, "L").resize((width, height), Image.NEAREST)
+
+
+def measure(func: Callable, repeat: int) -> Dict[str, float]:
+    """
+    Times the function (best of the repetitions) and measures its peak memory in a separate run.
+
+    :param func: the function to measure, gets called without arguments
+    :type func: Callable
+    :param repeat: the number of timed runs
+    :type repeat: int
+    :return: the time in seconds and the peak memory in MB
+    :rtype: dict
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"time": min(times), "peak_mb": peak / 1024 / 1024}
+
+
+def benchmark_objdet(megapixels: float, num_objects: int, repeat: int, seed: int) -> Dict[str, Dict[str, float]]:
+    """
+    Benchmarks the stages of rendering object detections.
+
+    :param megapixels: the size of the image
+    :type megapixels: float
+    :param num_objects: the number of objects
+    :type num_objects: int
+    :param repeat: the number of timed runs
+    :type repeat: int
+    :param seed: the seed for the synthetic data
+    :type seed: int
+    :return: the measurements per stage
+    :rtype: dict
+    """
+    rng = np.random.default_rng(seed)
+    state = init_state(objdet.create_argparser().parse_args([]))
+    objdet.post_init_state(state)
+    width, height = image_size(megapixels)
+    img = synthetic_image(rng, width, height)
+    preds_str = synthetic_predictions(rng, width, height, num_objects)
+    preds = ObjectPredictions.from_json_string(preds_str)
+    draw = ImageDraw.Draw(Image.new("RGBA", (16, 16)))
+
+    def text_coords():
+        for obj in preds.objects:
+            objdet.text_coords(state, draw, objdet.expand_label(state, obj.label, obj.score), obj.bbox)
+
+    rendered = objdet.render(state, img.copy(), preds)
+    return {
+        "parse": measure(lambda: ObjectPredictions.from_json_string(preds_str), repeat),
+        "text_coords": measure(text_coords, repeat),
+        "render": measure(lambda: objdet.render(state, img.copy(), preds), repeat),
+        "output": measure(lambda: np.asarray(rendered), repeat),
+    }
+
+
+def benchmark_imgseg(megapixels: float, num_classes: int, repeat: int, seed: int) -> Dict[str, Dict[str, float]]:
+    """
+    Benchmarks the stages of colorizing and overlaying segmentation masks.
+
+    :param megapixels: the size of the image
+    :type megapixels: float
+    :param num_classes: the number of classes (including background)
+    :type num_classes: int
+    :param repeat: the number of timed runs
+    :type repeat: int
+    :param seed: the seed for the synthetic data
+    :type seed: int
+    :return: the measurements per stage
+    :rtype: dict
+    """
+    rng = np.random.default_rng(seed)
+    state = init_state(imgseg.create_argparser().parse_args([]))
+    imgseg.post_init_state(state)
+    set_logging_level(state.logger, "WARN")
+    width, height = image_size(megapixels)
+    img = synthetic_image(rng, width, height)
+    mask = synthetic_mask(rng, width, height, num_classes)
+    indexed, found = imgseg.to_indexed(state, mask)
+    rendered = imgseg.render(state, img, indexed.copy(), found)
+    return {
+        "to_indexed": measure(lambda: imgseg.to_indexed(state, mask), repeat),
+        "render": measure(lambda: imgseg.render(state, img, indexed.copy(), found), repeat),
+        "output": measure(lambda: np.asarray(rendered), repeat),
+    }
+
+
+def run(scenarios: List[str], quick: bool, repeat: int, seed: int) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Runs the benchmarks.
+
+    :param scenarios: the groups of scenarios to run (objdet, imgseg)
+    :type scenarios: list
+    :param quick: whether to skip the scenarios with large images
+    :type quick: bool
+    :param repeat: the number of timed runs per stage
+    :type repeat: int
+    :param seed: the seed for the synthetic data
+    :type seed: int
+    :return: the measurements per scenario and stage
+    :rtype: dict
+    """
+    result = dict()
+    if "objdet" in scenarios:
+        for megapixels, num_objects in OBJDET_SCENARIOS:
+            if quick and (megapixels > 2):
+                continue
+            key = "objdet-%gMP-%dobj" % (megapixels, num_objects)
+            print(key, flush=True)
+            result[key] = benchmark_objdet(megapixels, num_objects, repeat, seed)
+    if "imgseg" in scenarios:
+        for megapixels, num_classes in IMGSEG_SCENARIOS:
+            if quick and (megapixels > 2):
+                continue
+            key = "imgseg-%gMP-%dcls" % (megapixels, num_classes)
+            print(key, flush=True)
+            result[key] = benchmark_imgseg(megapixels, num_classes, repeat, seed)
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Compares the results with the baseline and outputs the table.
+
+    :param results: the measurements per scenario and stage
+    :type results: dict
+    :param baseline: the baseline measurements per scenario and stage
+    :type baseline: dict
+    :param tolerance: the allowed relative increase in time/memory (0.2 = 20%)
+    :type tolerance: float
+    :return: the regressions
+    :rtype: list
+    """
+    regressions = []
+    print("%-28s %-12s %10s %10s %10s %10s" % ("scenario", "stage", "time [s]", "baseline", "peak [MB]", "baseline"))
+    for key in results:
+        for stage, m in results[key].items():
+            b = baseline.get(key, dict()).get(stage, None)
+            print("%-28s %-12s %10.4f %10s %10.1f %10s" % (
+                key, stage, m["time"], "-" if b is None else "%0.4f" % b["time"],
+                m["peak_mb"], "-" if b is None else "%0.1f" % b["peak_mb"]))
+            if b is None:
+                continue
+            # ignore noise in very short timings
+            if (m["time"] > b["time"] * (1 + tolerance)) and (m["time"] - b["time"] > 0.001):
+                regressions.append("%s/%s: time %0.4fs vs %0.4fs" % (key, stage, m["time"], b["time"]))
+            if (m["peak_mb"] > b["peak_mb"] * (1 + tolerance)) and (m["peak_mb"] - b["peak_mb"] > 1.0):
+                regressions.append("%s/%s: peak memory %0.1fMB vs %0.1fMB" % (key, stage, m["peak_mb"], b["peak_mb"]))
+    return regressions
+
+
+def main(args=None) -> int:
+    """
+    Runs the benchmarks and compares them against the baseline.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    :return: 0 if no regressions, 1 otherwise
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the rendering of object detections and segmentation masks.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--scenarios", choices=["objdet", "imgseg"], nargs="+", default=["objdet", "imgseg"], help="The groups of scenarios to run.")
+    parser.add_argument("--quick", action="store_true", help="Whether to skip the scenarios with images larger than 2 megapixels.")
+    parser.add_argument("--repeat", metavar="NUM", type=int, default=3, help="The number of timed runs per stage (best gets reported).")
+    parser.add_argument("--seed", metavar="SEED", type=int, default=42, help="The seed for the synthetic data.")
+    parser.add_argument("--baseline", metavar="FILE", type=str, default=DEFAULT_BASELINE, help="The JSON file with the baseline to compare against.")
+    parser.add_argument("--save_baseline", action="store_true", help="Whether to store the results as new baseline (merged with the existing one).")
+    parser.add_argument("--tolerance", metavar="NUM", type=float, default=0.2, help="The allowed relative increase in time/memory before flagging a regression.")
+    parsed = parser.parse_args(args=args)
+
+    results = run(parsed.scenarios, parsed.quick, parsed.repeat, parsed.seed)
+    baseline = dict()
+    if os.path.exists(parsed.baseline):
+        with open(parsed.baseline, "r") as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, parsed.tolerance)
+
+    if parsed.save_baseline:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(parsed.baseline)), exist_ok=True)
+        with open(parsed.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("Baseline saved: %s" % parsed.baseline)
+        return 0
+
+    if len(regressions) > 0:
+        print("Regressions:")
+        for r in regressions:
+            print("- %s" % r)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Measures the startup time of the gifr entry points in fresh interpreters:
+importing the module and getting to the point of parsing the command-line
+(using --help). Also measures the font lookup with a cold and a warm cache.
+Compares the median times against a stored baseline.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Dict, List
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "startup.json")
+
+SETUP_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "setup.py")
+
+FONT_CODE = "from gifr.fonts import load_font, DEFAULT_FONT_FAMILY; load_font(None, DEFAULT_FONT_FAMILY, 14)"
+
+
+def entry_points() -> Dict[str, str]:
+    """
+    Determines the entry points and their modules from setup.py.
+
+    :return: the modules per entry point
+    :rtype: dict
+    """
+    with open(SETUP_PY, "r") as f:
+        content = f.read()
+    return {m[0]: m[1] for m in re.findall(r'"(gifr-[\w-]+)=([\w.]+):sys_main"', content)}
+
+
+def timed_run(cmd: List[str], env: dict = None) -> float:
+    """
+    Runs the command and returns the wall time.
+
+    :param cmd: the command to run
+    :type cmd: list
+    :param env: the environment to use, None for the current one
+    :type env: dict
+    :return: the time in seconds
+    :rtype: float
+    """
+    start = time.perf_counter()
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env, check=True)
+    return time.perf_counter() - start
+
+
+def run(repeat: int, programs: List[str] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Measures the startup times.
+
+    :param repeat: the number of runs per measurement (median gets reported)
+    :type repeat: int
+    :param programs: the entry points to measure, None for all
+    :type programs: list
+    :return: the median times per entry point and stage
+    :rtype: dict
+    """
+    result = dict()
+    for prog, module in sorted(entry_points().items()):
+        if (programs is not None) and (prog not in programs):
+            continue
+        print(prog, flush=True)
+        result[prog] = {
+            "import": statistics.median([timed_run([sys.executable, "-c", "import %s" % module]) for _ in range(repeat)]),
+            "help": statistics.median([timed_run([sys.executable, "-m", module, "--help"]) for _ in range(repeat)]),
+        }
+
+    print("fonts", flush=True)
+    cold = []
+    warm = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ)
+            env["GIFR_FONT_CACHE"] = os.path.join(tmp, "fonts.json")
+            cold.append(timed_run([sys.executable, "-c", FONT_CODE], env=env))
+            warm.append(timed_run([sys.executable, "-c", FONT_CODE], env=env))
+    result["fonts"] = {"cold": statistics.median(cold), "warm": statistics.median(warm)}
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Compares the results with the baseline and outputs the table.
+
+    :param results: the times per entry point and stage
+    :type results: dict
+    :param baseline: the baseline times per entry point and stage
+    :type baseline: dict
+    :param tolerance: the allowed relative increase in time (0.2 = 20%)
+    :type tolerance: float
+    :return: the regressions
+    :rtype: list
+    """
+    regressions = []
+    print("%-20s %-8s %10s %10s" % ("entry point", "stage", "time [s]", "baseline"))
+    for key in results:
+        for stage, t in results[key].items():
+            b = baseline.get(key, dict()).get(stage, None)
+            print("%-20s %-8s %10.3f %10s" % (key, stage, t, "-" if b is None else "%0.3f" % b))
+            # ignore noise in very short timings
+            if (b is not None) and (t > b * (1 + tolerance)) and (t - b > 0.05):
+                regressions.append("%s/%s: %0.3fs vs %0.3fs" % (key, stage, t, b))
+    return regressions
+
+
+def main(args=None) -> int:
+    """
+    Runs the benchmark and compares it against the baseline.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    :return: 0 if no regressions, 1 otherwise
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(
+        description="Measures the startup time of the gifr entry points.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--programs", metavar="PROG", nargs="+", default=None, help="The entry points to measure, e.g., gifr-objdet; all if not specified.")
+    parser.add_argument("--repeat", metavar="NUM", type=int, default=5, help="The number of runs per measurement (median gets reported).")
+    parser.add_argument("--baseline", metavar="FILE", type=str, default=DEFAULT_BASELINE, help="The JSON file with the baseline to compare against.")
+    parser.add_argument("--save_baseline", action="store_true", help="Whether to store the results as new baseline (merged with the existing one).")
+    parser.add_argument("--tolerance", metavar="NUM", type=float, default=0.2, help="The allowed relative increase in time before flagging a regression.")
+    parsed = parser.parse_args(args=args)
+
+    results = run(parsed.repeat, programs=parsed.programs)
+    baseline = dict()
+    if os.path.exists(parsed.baseline):
+        with open(parsed.baseline, "r") as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, parsed.tolerance)
+
+    if parsed.save_baseline:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(parsed.baseline)), exist_ok=True)
+        with open(parsed.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("Baseline saved: %s" % parsed.baseline)
+        return 0
+
+    if len(regressions) > 0:
+        print("Regressions:")
+        for r in regressions:
+            print("- %s" % r)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
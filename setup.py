@@ -36,6 +36,11 @@ setup(
         "opex",
         "scipy",
     ],
+    extras_require={
+        "zstd": ["zstandard"],
+        "lz4": ["lz4"],
+        "video": ["opencv-python-headless"],
+    },
     version="0.0.6",
     author='Peter Reutemann',
     author_email='fracpete@waikato.ac.nz',
@@ -43,9 +48,14 @@ setup(
         "console_scripts": [
             "gifr-asr=gifr.asr:sys_main",
             "gifr-asr-textgen=gifr.asr_text_generation:sys_main",
+            "gifr-chain=gifr.chain:sys_main",
+            "gifr-eval=gifr.evaluate:sys_main",
+            "gifr-hub=gifr.hub:sys_main",
             "gifr-imgcls=gifr.image_classification:sys_main",
             "gifr-imgseg=gifr.image_segmentation:sys_main",
             "gifr-objdet=gifr.object_detection:sys_main",
+            "gifr-objdet-video=gifr.object_detection_video:sys_main",
+            "gifr-replay=gifr.replay:sys_main",
             "gifr-textclass=gifr.text_classification:sys_main",
             "gifr-textgen=gifr.text_generation:sys_main",
         ],
@@ -0,0 +1,163 @@
+import sys
+import threading
+
+from collections import deque
+from typing import Dict
+
+from gifr.priority import PRIORITIES, PRIORITY_INTERACTIVE
+
+
+class Rejected(Exception):
+    """
+    Raised when a request does not get admitted, as the model is overloaded.
+    """
+    pass
+
+
+_gradio_rejected = None
+""" the subclass of Rejected that is also a gradio error, created on demand. """
+
+
+def rejection(message: str) -> Rejected:
+    """
+    Creates the exception for a rejected request. If gradio is in use, the
+    exception is also a gradio error, so that the message gets displayed in the
+    interface (without having to import gradio for non-interface use).
+
+    :param message: the message of the exception
+    :type message: str
+    :return: the exception
+    :rtype: Rejected
+    """
+    global _gradio_rejected
+    gradio = sys.modules.get("gradio", None)
+    if gradio is None:
+        return Rejected(message)
+    if _gradio_rejected is None:
+        _gradio_rejected = type("Rejected", (Rejected, gradio.Error), {})
+    return _gradio_rejected(message)
+
+
+class AdmissionController:
+    """
+    Limits the number of requests in flight. Requests that exceed the limit wait
+    in a bounded queue per priority class for a limited amount of time.
+    Requests get rejected immediately if the queue is full and after waiting
+    too long in the queue. Within a class, requests are first come, first served;
+    across classes, freed slots get handed out according to the class weights
+    (smooth weighted round-robin).
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int = 0, max_queue_time: float = 1.0,
+                 weights: Dict[str, int] = None):
+        """
+        Initializes the controller.
+
+        :param max_in_flight: the maximum number of requests in flight
+        :type max_in_flight: int
+        :param max_queue: the maximum number of requests per priority class waiting to be admitted, 0 to reject immediately
+        :type max_queue: int
+        :param max_queue_time: the maximum number of seconds a request waits to be admitted
+        :type max_queue_time: float
+        :param weights: the scheduling weight per priority class, defaults to 1
+        :type weights: dict
+        """
+        if max_in_flight < 1:
+            raise Exception("Maximum number of requests in flight must be at least 1: %d" % max_in_flight)
+        self.max_in_flight = max_in_flight
+        self.max_queue = max(0, max_queue)
+        self.max_queue_time = max_queue_time
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.weights = {x: 1 for x in PRIORITIES}
+        if weights is not None:
+            self.weights.update(weights)
+        self._credits = {x: 0 for x in PRIORITIES}
+        self._waiting = {x: deque() for x in PRIORITIES}
+        self._lock = threading.Lock()
+
+    def _reject(self, reason: str):
+        """
+        Records the rejection and raises the Rejected exception.
+
+        :param reason: the reason for the rejection
+        :type reason: str
+        """
+        self.rejected += 1
+        raise rejection("Model is overloaded (%s), please try again later." % reason)
+
+    def acquire(self, priority: str = PRIORITY_INTERACTIVE):
+        """
+        Waits for the request to be admitted. Call release once the request is done.
+
+        :param priority: the priority class of the request, see PRIORITIES
+        :type priority: str
+        :raises Rejected: if the request did not get admitted
+        """
+        with self._lock:
+            waiting = self._waiting[priority]
+            if (self.in_flight < self.max_in_flight) and (self.depth == 0):
+                self.in_flight += 1
+                self.admitted += 1
+                return
+            if len(waiting) >= self.max_queue:
+                self._reject("%d request(s) in flight, %d waiting" % (self.in_flight, self.depth))
+            waiter = threading.Event()
+            waiting.append(waiter)
+
+        # the slot gets handed over by release
+        if waiter.wait(timeout=self.max_queue_time):
+            return
+        with self._lock:
+            if waiter.is_set():
+                return
+            waiting.remove(waiter)
+            self._reject("waited %0.1f seconds" % self.max_queue_time)
+
+    def release(self):
+        """
+        Marks the request as done, handing its slot to the next waiting request.
+        """
+        with self._lock:
+            self._hand_over()
+
+    def _hand_over(self):
+        """
+        Hands the slot of a finished request to the next waiting one, if any.
+        Must be called while holding the lock.
+        """
+        candidates = [x for x in PRIORITIES if len(self._waiting[x]) > 0]
+        if len(candidates) == 0:
+            self.in_flight -= 1
+            return
+        total = 0
+        for priority in candidates:
+            self._credits[priority] += self.weights[priority]
+            total += self.weights[priority]
+        priority = max(candidates, key=lambda x: self._credits[x])
+        self._credits[priority] -= total
+        self.admitted += 1
+        self._waiting[priority].popleft().set()
+
+    @property
+    def depth(self) -> int:
+        """
+        Returns the number of requests waiting to be admitted.
+
+        :return: the queue depth
+        :rtype: int
+        """
+        return sum([len(x) for x in self._waiting.values()])
+
+    def stats(self) -> str:
+        """
+        Returns the statistics.
+
+        :return: the statistics
+        :rtype: str
+        """
+        with self._lock:
+            waiting = ", ".join(["%s=%d" % (x, len(self._waiting[x])) for x in PRIORITIES])
+            return "in-flight=%d/%d, waiting: %s (max %d), admitted=%d, rejected=%d" % (
+                self.in_flight, self.max_in_flight, waiting, self.max_queue, self.admitted, self.rejected)
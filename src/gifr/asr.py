@@ -1,13 +1,18 @@
+import argparse
 import io
 import logging
 import numpy as np
 import sys
 import traceback
 
-import gradio as gr
-from scipy.io.wavfile import write
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 
-from gifr.common import init_logging, set_logging_level, create_parser, init_state, State, make_prediction
+from gifr.common import init_logging, set_logging_level, create_parser, init_state, State, make_prediction, \
+    stream_prediction, ordered_chunks, add_stream_arguments, uses_envelope
+from gifr.priority import current_priority, request_priority
+from gifr.trace import traced, span
+from gifr.vad import speech_segments, DEFAULT_THRESHOLD, DEFAULT_FRAME_LENGTH, DEFAULT_PADDING
 
 PROG: str = "gifr-asr"
 
@@ -15,7 +20,227 @@ _logger = logging.getLogger(PROG)
 
 state: State = None
 
+MAX_CONCURRENT_SEGMENTS = 8
+""" the maximum number of segments to transcribe at the same time (requires envelopes). """
 
+
+def encode_audio(sr: int, y: np.ndarray) -> bytes:
+    """
+    Turns the audio samples into WAV bytes.
+
+    :param sr: the sample rate
+    :type sr: int
+    :param y: the (normalized) audio samples
+    :type y: np.ndarray
+    :return: the WAV data
+    :rtype: bytes
+    """
+    from scipy.io.wavfile import write
+    with span("encode audio"):
+        buf = io.BytesIO()
+        write(buf, sr, y)
+        return buf.getvalue()
+
+
+def prepare_audio(state: State, audio) -> Tuple[int, np.ndarray, List[Tuple[int, int]]]:
+    """
+    Normalizes the audio and determines the segments to transcribe (using voice
+    activity detection if enabled).
+
+    :param state: the state
+    :type state: State
+    :param audio: the tuple of sample rate and samples
+    :return: the tuple of sample rate, normalized samples and list of (start, end) segments (empty if no speech)
+    :rtype: tuple
+    """
+    sr, y = audio
+    y = y.astype(np.float32)
+    peak = np.max(np.abs(y)) if len(y) > 0 else 0.0
+    if peak > 0:
+        y /= peak
+
+    if state.params["vad"]:
+        segments = speech_segments(y, sr,
+                                   threshold=state.params["vad_threshold"],
+                                   frame_length=state.params["vad_frame_length"],
+                                   padding=state.params["vad_padding"],
+                                   min_pause=state.params["vad_split_pause"])
+        if len(segments) == 0:
+            state.logger.info("No speech detected")
+        else:
+            kept = sum([end - start for start, end in segments])
+            state.logger.info("VAD: %d segment(s), keeping %0.1f%% of %d samples" % (len(segments), 100.0 * kept / len(y), len(y)))
+    else:
+        segments = [(0, len(y))]
+
+    return sr, y, segments
+
+
+def transcribe(state: State, data: bytes, channel_out: str = None, channel_in: str = None) -> str:
+    """
+    Sends the WAV data to the model and returns the transcribed text.
+
+    :param state: the state
+    :type state: State
+    :param data: the WAV data to send
+    :type data: bytes
+    :param channel_out: for overriding the state's out channel
+    :type channel_out: str
+    :param channel_in: for overriding the state's in channel
+    :type channel_in: str
+    :return: the transcription, None if no result
+    :rtype: str
+    """
+    # perform query
+    result = make_prediction(state, data, channel_in=channel_in, channel_out=channel_out)
+
+    # parse response
+    if result is not None:
+        try:
+            result = result.decode()
+        except:
+            result = "Failed to parse: %s" % str(result)
+
+    return result
+
+
+def transcribe_stream(state: State, data: bytes, channel_out: str = None, channel_in: str = None) -> Iterator[str]:
+    """
+    Sends the WAV data to the model and yields the growing transcript as the model
+    streams its response.
+
+    :param state: the state
+    :type state: State
+    :param data: the WAV data to send
+    :type data: bytes
+    :param channel_out: for overriding the state's out channel
+    :type channel_out: str
+    :param channel_in: for overriding the state's in channel
+    :type channel_in: str
+    :return: the iterator over the transcript so far
+    """
+    result = ""
+    messages = stream_prediction(state, data, channel_in=channel_in, channel_out=channel_out)
+    for d in ordered_chunks(state, messages, seq_field=state.params["receive_seq"], end_field=state.params["receive_end"]):
+        result += d.get(state.params["receive_text"], "")
+        yield result
+
+
+def transcribe_segments(state: State, sr: int, y: np.ndarray, segments: List[Tuple[int, int]],
+                        channel_out: str = None, channel_in: str = None) -> List[Optional[str]]:
+    """
+    Transcribes the segments of the audio. With envelopes, the segments get sent to the
+    model concurrently, otherwise one after the other (only one request can be in flight
+    per channel pair).
+
+    :param state: the state
+    :type state: State
+    :param sr: the sample rate
+    :type sr: int
+    :param y: the normalized samples
+    :type y: np.ndarray
+    :param segments: the list of (start, end) segments
+    :type segments: list
+    :param channel_out: for overriding the state's out channel
+    :type channel_out: str
+    :param channel_in: for overriding the state's in channel
+    :type channel_in: str
+    :return: the transcripts, in the order of the segments (None if no result)
+    :rtype: list
+    """
+    if (len(segments) == 1) or not uses_envelope(state):
+        return [transcribe(state, encode_audio(sr, y[start:end]), channel_in=channel_in, channel_out=channel_out)
+                for start, end in segments]
+
+    priority = current_priority()
+
+    def anon_transcribe(segment):
+        with request_priority(priority):
+            return transcribe(state, encode_audio(sr, y[segment[0]:segment[1]]), channel_in=channel_in, channel_out=channel_out)
+
+    with ThreadPoolExecutor(max_workers=min(len(segments), MAX_CONCURRENT_SEGMENTS)) as executor:
+        return list(executor.map(anon_transcribe, segments))
+
+
+def transcribe_audio(state: State, audio, channel_out: str = None, channel_in: str = None) -> str:
+    """
+    Sends the audio to the model and returns the transcribed text.
+    If voice activity detection is enabled, leading/trailing silence gets
+    removed and the audio optionally split on long pauses, with the segments
+    being transcribed separately (concurrently when using envelopes).
+
+    :param state: the state
+    :type state: State
+    :param audio: the tuple of sample rate and samples
+    :param channel_out: for overriding the state's out channel
+    :type channel_out: str
+    :param channel_in: for overriding the state's in channel
+    :type channel_in: str
+    :return: the transcription result
+    :rtype: str
+    """
+    with span("prepare audio"):
+        sr, y, segments = prepare_audio(state, audio)
+    if len(segments) == 0:
+        return "no speech detected"
+
+    state.logger.info("Transcribing...")
+
+    transcripts = []
+    for transcript in transcribe_segments(state, sr, y, segments, channel_out=channel_out, channel_in=channel_in):
+        if transcript is not None:
+            transcripts.append(transcript.strip() if len(segments) > 1 else transcript)
+
+    if len(transcripts) == 0:
+        result = "no result"
+    else:
+        result = " ".join(transcripts)
+
+    state.logger.info("Transcription: %s" % result)
+
+    return result
+
+
+def transcribe_audio_stream(state: State, audio, channel_out: str = None, channel_in: str = None) -> Iterator[str]:
+    """
+    Sends the audio to the model and yields the growing transcript while the model
+    streams its response. Segments (see transcribe_audio) get transcribed one after the other.
+
+    :param state: the state
+    :type state: State
+    :param audio: the tuple of sample rate and samples
+    :param channel_out: for overriding the state's out channel
+    :type channel_out: str
+    :param channel_in: for overriding the state's in channel
+    :type channel_in: str
+    :return: the iterator over the transcription so far
+    """
+    with span("prepare audio"):
+        sr, y, segments = prepare_audio(state, audio)
+    if len(segments) == 0:
+        yield "no speech detected"
+        return
+
+    state.logger.info("Transcribing (streaming)...")
+
+    transcripts = []
+    for start, end in segments:
+        transcript = None
+        for transcript in transcribe_stream(state, encode_audio(sr, y[start:end]), channel_in=channel_in, channel_out=channel_out):
+            yield " ".join(transcripts + [transcript.strip()])
+        if transcript is not None:
+            transcripts.append(transcript.strip())
+
+    if len(transcripts) == 0:
+        result = "no result"
+        yield result
+    else:
+        result = " ".join(transcripts)
+
+    state.logger.info("Transcription: %s" % result)
+
+
+@traced(PROG)
 def predict(audio, channel_out: str = None, channel_in: str = None) -> str:
     """
     Sends the audio file to the model and returns the transcribed text.
@@ -30,43 +255,65 @@ def predict(audio, channel_out: str = None, channel_in: str = None) -> str:
     :rtype: str
     """
     global state
+    return transcribe_audio(state, audio, channel_out=channel_out, channel_in=channel_in)
 
-    sr, y = audio
-    y = y.astype(np.float32)
-    y /= np.max(np.abs(y))
-    buf = io.BytesIO()
-    write(buf, sr, y)
 
-    state.logger.info("Transcribing...")
+@traced(PROG)
+def predict_stream(audio, channel_out: str = None, channel_in: str = None) -> Iterator[str]:
+    """
+    Sends the audio file to the model and yields the growing transcript that the model streams.
 
-    # perform query
-    result = make_prediction(state, buf.getvalue(), channel_in=channel_in, channel_out=channel_out)
+    :param audio: the audio file to send
+    :type audio: str
+    :param channel_out: for overriding the state's out channel
+    :type channel_out: str
+    :param channel_in: for overriding the state's in channel
+    :type channel_in: str
+    :return: the iterator over the transcription so far
+    """
+    global state
+    yield from transcribe_audio_stream(state, audio, channel_out=channel_out, channel_in=channel_in)
 
-    # parse response
-    if result is None:
-        result = "no result"
-    else:
-        try:
-            result = result.decode()
-        except:
-            result = "Failed to parse: %s" % str(result)
 
-    state.logger.info("Transcription: %s" % result)
+def add_vad_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the options for the voice activity detection to the parser.
+
+    :param parser: the parser to extend
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--vad", action="store_true", help="Whether to use voice activity detection to remove leading/trailing silence before transcribing.")
+    parser.add_argument("--vad_threshold", metavar="DB", help="The energy threshold in dB, relative to the loudest frame, below which a frame is considered silence.", default=DEFAULT_THRESHOLD, type=float, required=False)
+    parser.add_argument("--vad_frame_length", metavar="MSEC", help="The length of the frames in milliseconds to compute the energy for.", default=DEFAULT_FRAME_LENGTH, type=int, required=False)
+    parser.add_argument("--vad_padding", metavar="MSEC", help="The amount of silence in milliseconds to keep around the detected speech.", default=DEFAULT_PADDING, type=int, required=False)
+    parser.add_argument("--vad_split_pause", metavar="SECONDS", help="The minimum length of a pause for splitting the audio into segments that get transcribed separately, <=0 to turn off.", default=0.0, type=float, required=False)
 
-    return result
 
+def add_asr_stream_arguments(parser: argparse.ArgumentParser, prefix: str = ""):
+    """
+    Adds the options for streamed transcriptions to the parser.
 
-def create_interface(state: State) -> gr.Interface:
+    :param parser: the parser to extend
+    :type parser: argparse.ArgumentParser
+    :param prefix: the prefix for the option names, eg "audio_"
+    :type prefix: str
+    """
+    add_stream_arguments(parser, prefix=prefix, what="ASR model")
+    parser.add_argument("--%sreceive_text" % prefix, metavar="FIELD", help="The field name in the streamed JSON messages of the ASR model containing the transcribed text.", default="text", type=str, required=False)
+
+
+def create_interface(state: State) -> "gr.Interface":
     """
     Generates the interface.
 
     :param state: the state to use
     :type state: State
     """
+    import gradio as gr
     return gr.Interface(
         title=state.title,
         description=state.description,
-        fn=predict,
+        fn=predict_stream if state.params["stream"] else predict,
         inputs=[
             gr.Audio(label="Input", waveform_options={"show_recording_waveform": True}),
         ],
@@ -86,6 +333,23 @@ def post_init_state(state: State):
     state.logger = _logger
 
 
+def create_argparser() -> argparse.ArgumentParser:
+    """
+    Creates the parser for the command-line options.
+
+    :return: the parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = create_parser("Automatic Speech Recognition (ASR) interface. Allows the user to record/upload audio "
+                           + "and display the text transcribed by the model.",
+                           PROG, model_channel_in="audio", model_channel_out="transcription",
+                           timeout=2.0, ui_title="Automatic Speech Recognition (ASR)",
+                           ui_desc="Sends the recorded/uploaded audio to the model to transcribe and displays the result.")
+    add_vad_arguments(parser)
+    add_asr_stream_arguments(parser)
+    return parser
+
+
 def main(args=None):
     """
     The main method for parsing command-line arguments.
@@ -95,11 +359,7 @@ def main(args=None):
     """
     global state
     init_logging()
-    parser = create_parser("Automatic Speech Recognition (ASR) interface. Allows the user to record/upload audio "
-                           + "and display the text transcribed by the model.",
-                           PROG, model_channel_in="audio", model_channel_out="transcription",
-                           timeout=2.0, ui_title="Automatic Speech Recognition (ASR)",
-                           ui_desc="Sends the recorded/uploaded audio to the model to transcribe and displays the result.")
+    parser = create_argparser()
     parsed = parser.parse_args(args=args)
     set_logging_level(_logger, parsed.logging_level)
     state = init_state(parsed)
@@ -1,15 +1,21 @@
+import argparse
+import contextvars
 import logging
+import queue
 import sys
+import threading
 import traceback
-from typing import Tuple
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Iterator, Tuple
 
 import gradio as gr
-import gifr.asr
-import gifr.text_generation
 
-from gifr.asr import predict as predict_asr
-from gifr.common import init_logging, set_logging_level, create_parser, init_state, State
-from gifr.text_generation import predict as predict_text_generation
+from gifr.asr import transcribe_audio, transcribe_audio_stream, add_vad_arguments, add_asr_stream_arguments
+from gifr.common import init_logging, set_logging_level, create_parser, init_state, State, add_stream_arguments
+from gifr.text_generation import generate, generate_stream, add_text_generation_arguments
+from gifr.text_generation import post_init_state as post_init_state_text_generation
+from gifr.trace import traced
 
 PROG: str = "gifr-asr-textgen"
 
@@ -18,20 +24,185 @@ _logger = logging.getLogger(PROG)
 state: State = None
 
 
-def predict(audio) -> Tuple[str, str]:
+@dataclass
+class StageMetrics:
+    name: str
+    count: int = 0
+    total_time: float = 0.0
+    last_time: float = 0.0
+    max_time: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def add(self, seconds: float):
+        """
+        Records the time of a stage execution.
+
+        :param seconds: the time in seconds
+        :type seconds: float
+        """
+        with self._lock:
+            self.count += 1
+            self.total_time += seconds
+            self.last_time = seconds
+            self.max_time = max(self.max_time, seconds)
+
+    def __str__(self) -> str:
+        """
+        Returns a short summary of the metrics.
+
+        :return: the summary
+        :rtype: str
+        """
+        with self._lock:
+            avg = self.total_time / self.count if self.count > 0 else 0.0
+            return "%s: n=%d, last=%0.3fs, avg=%0.3fs, max=%0.3fs" % (self.name, self.count, self.last_time, avg, self.max_time)
+
+
+def stage_state(state: State, prefix: str) -> State:
+    """
+    Creates the state for a stage of the pipeline, using the channels, timeout
+    and streaming options with the specified prefix. Everything else (connection,
+    logger, etc) gets shared with the interface.
+
+    :param state: the state of the interface to derive the stage state from
+    :type state: State
+    :param prefix: the prefix of the stage options, eg "audio_"
+    :type prefix: str
+    :return: the stage state
+    :rtype: State
+    """
+    timeout = state.params[prefix + "timeout"]
+    result = replace(
+        state,
+        channel_in=state.params[prefix + "channel_in"],
+        channel_out=state.params[prefix + "channel_out"],
+        timeout=state.timeout if timeout is None else timeout,
+        params=dict(state.params),
+    )
+    for param in ["stream", "receive_seq", "receive_end", "receive_text"]:
+        if (prefix + param) in state.params:
+            result.params[param] = state.params[prefix + param]
+    return result
+
+
+class Pipeline:
+    """
+    Two-stage pipeline that first transcribes the audio and then feeds the transcript
+    into the text generation model. Each stage uses its own channels and timeout.
+    The stages run in a worker thread, so the text generation starts as soon as the
+    transcript is complete, while the interface is still displaying it.
+    """
+
+    def __init__(self, state: State):
+        """
+        Initializes the pipeline.
+
+        :param state: the state of the interface
+        :type state: State
+        """
+        self.logger = state.logger
+        self.asr_state = stage_state(state, "audio_")
+        self.text_state = stage_state(state, "text_")
+        self.asr_metrics = StageMetrics("ASR")
+        self.text_metrics = StageMetrics("text generation")
+
+    def transcribe(self, audio) -> Iterator[str]:
+        """
+        Runs the ASR stage.
+
+        :param audio: the audio to transcribe
+        :return: the iterator over the transcript (so far)
+        """
+        start = datetime.now()
+        if self.asr_state.params["stream"]:
+            yield from transcribe_audio_stream(self.asr_state, audio)
+        else:
+            yield transcribe_audio(self.asr_state, audio)
+        self.asr_metrics.add((datetime.now() - start).total_seconds())
+
+    def generate(self, transcript: str, request: gr.Request = None) -> Iterator[str]:
+        """
+        Runs the text generation stage.
+
+        :param transcript: the transcript to complete
+        :type transcript: str
+        :param request: the gradio request, used for determining the session
+        :type request: gr.Request
+        :return: the iterator over the generated text (so far)
+        """
+        start = datetime.now()
+        if self.text_state.params["stream"]:
+            yield from generate_stream(self.text_state, transcript, request=request)
+        else:
+            yield generate(self.text_state, transcript, request=request)
+        self.text_metrics.add((datetime.now() - start).total_seconds())
+
+    def _run_stages(self, audio, request: gr.Request, outputs: queue.Queue, stopped: threading.Event):
+        """
+        Runs both stages, putting the outputs in the queue, followed by None once finished
+        (or the exception that occurred).
+
+        :param audio: the audio to transcribe
+        :param request: the gradio request, used for determining the session
+        :type request: gr.Request
+        :param outputs: the queue for the (transcript, text) tuples
+        :type outputs: queue.Queue
+        :param stopped: set when the caller stopped listening
+        :type stopped: threading.Event
+        """
+        try:
+            transcript = ""
+            for transcript in self.transcribe(audio):
+                if stopped.is_set():
+                    return
+                outputs.put((transcript, ""))
+            for text in self.generate(transcript, request=request):
+                if stopped.is_set():
+                    return
+                outputs.put((transcript, text))
+            outputs.put(None)
+        except Exception as e:
+            outputs.put(e)
+
+    def run(self, audio, request: gr.Request = None) -> Iterator[Tuple[str, str]]:
+        """
+        Transcribes the audio and generates text from it.
+
+        :param audio: the audio to transcribe
+        :param request: the gradio request, used for determining the session
+        :type request: gr.Request
+        :return: the iterator over the transcript and the generated text (so far)
+        """
+        outputs = queue.Queue()
+        stopped = threading.Event()
+        # the worker inherits the request's priority and trace spans
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._run_stages, audio, request, outputs, stopped), daemon=True).start()
+        try:
+            while True:
+                output = outputs.get()
+                if output is None:
+                    break
+                if isinstance(output, Exception):
+                    raise output
+                yield output
+        finally:
+            stopped.set()
+        self.logger.info("%s | %s" % (str(self.asr_metrics), str(self.text_metrics)))
+
+
+@traced(PROG)
+def predict(audio, request: gr.Request = None) -> Iterator[Tuple[str, str]]:
     """
     Transcribes the audio and generates text from it.
 
     :param audio: the audio to transcribe
-    :return: the transcribed audio and the generated text
-    :rtype: tuple
+    :param request: the gradio request, used for determining the session
+    :type request: gr.Request
+    :return: the iterator over the transcribed audio and the generated text
     """
     global state
-    gifr.asr.state = state
-    gifr.text_generation.state = state
-    transcript = predict_asr(audio, channel_in=state.params["audio_channel_in"], channel_out=state.params["audio_channel_out"])
-    text = predict_text_generation(transcript, channel_in=state.params["text_channel_in"], channel_out=state.params["text_channel_out"])
-    return transcript, text
+    yield from state.params["pipeline"].run(audio, request=request)
 
 
 def create_interface(state: State) -> gr.Interface:
@@ -62,37 +233,51 @@ def post_init_state(state: State):
     :param state: the state to update
     :type state: State
     """
+    post_init_state_text_generation(state)
     state.logger = _logger
-    state.history = ""
-    state.turns = 0
+    if state.replicas is not None:
+        raise Exception("Replicas are not supported, as the stages use different models!")
+    if state.params.get("bulk_channel_in", None) is not None:
+        raise Exception("Bulk channels are not supported, as the stages use different models!")
+    if state.params["text_stream"] and not state.params["json_response"]:
+        raise Exception("Streaming the text generation requires --json_response!")
+    state.params["pipeline"] = Pipeline(state)
 
 
-def main(args=None):
+def create_argparser() -> argparse.ArgumentParser:
     """
-    The main method for parsing command-line arguments.
+    Creates the parser for the command-line options.
 
-    :param args: the commandline arguments, uses sys.argv if not supplied
-    :type args: list
+    :return: the parser
+    :rtype: argparse.ArgumentParser
     """
-    global state
-    init_logging()
     parser = create_parser("Combined Automatic Speech Recognition (ASR) and text generation interface. Allows the user to record/upload audio, "
                            + "which gets transcribed and the transcription fed into the text generation model. The generated text is then displayed.",
                            PROG, timeout=1.0, ui_title="ASR+Text generation",
                            ui_desc="First transcribes the recorded/uploaded audio and then sends the transcript to the model to complete and displays the result.")
     parser.add_argument("--audio_channel_in", metavar="CHANNEL", help="The channel to send the audio to for transcribing.", default="audio", type=str, required=False)
     parser.add_argument("--audio_channel_out", metavar="CHANNEL", help="The channel to receive the transcriptions on.", default="transcription", type=str, required=False)
+    parser.add_argument("--audio_timeout", metavar="SECONDS", help="The number of seconds to wait for a transcription, uses --timeout if not provided.", default=None, type=float, required=False)
     parser.add_argument("--text_channel_in", metavar="CHANNEL", help="The channel to send the text to for making predictions.", default="text", type=str, required=False)
     parser.add_argument("--text_channel_out", metavar="CHANNEL", help="The channel to receive the text predictions on.", default="prediction", type=str, required=False)
-    parser.add_argument("--send_text", metavar="FIELD", help="The field name in the JSON prompt used for sending the text, ignored if not provided.", default="prompt", type=str, required=False)
-    parser.add_argument("--json_response", action="store_true", help="Whether the reponse is a JSON object.")
-    parser.add_argument("--receive_prediction", metavar="FIELD", help="The field name in the JSON response used for receiving the predicted text, ignored if not provided.", default="text", type=str, required=False)
-    parser.add_argument("--history_on", action="store_true", help="Whether to keep track of the interactions.")
-    parser.add_argument("--send_history", metavar="FIELD", help="The field name in the JSON query to use for sending the input history, ignored if not provided.", default=None, type=str, required=False)
-    parser.add_argument("--send_turns", metavar="FIELD", help="The field name in the JSON query to use for sending the number of turns in the interaction, ignored if not provided.", default=None, type=str, required=False)
-    parser.add_argument("--receive_history", metavar="FIELD", help="The field name in the JSON response used for receiving the input history, ignored if not provided.", default=None, type=str, required=False)
-    parser.add_argument("--receive_turns", metavar="FIELD", help="The field name in the JSON response used for receiving the number of turns in the interaction, ignored if not provided.", default=None, type=str, required=False)
-    parser.add_argument("--clean_response", action="store_true", help="Whether to clean up the response.")
+    parser.add_argument("--text_timeout", metavar="SECONDS", help="The number of seconds to wait for a text prediction, uses --timeout if not provided.", default=None, type=float, required=False)
+    add_text_generation_arguments(parser)
+    add_vad_arguments(parser)
+    add_asr_stream_arguments(parser, prefix="audio_")
+    add_stream_arguments(parser, prefix="text_", what="text generation model")
+    return parser
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    global state
+    init_logging()
+    parser = create_argparser()
     parsed = parser.parse_args(args=args)
     set_logging_level(_logger, parsed.logging_level)
     state = init_state(parsed)
@@ -0,0 +1,481 @@
+import argparse
+import io
+import json
+import logging
+import numpy as np
+import sys
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from PIL import Image
+from opex import ObjectPredictions
+
+import gifr.asr
+import gifr.image_classification
+import gifr.image_segmentation
+import gifr.object_detection
+import gifr.text_classification
+import gifr.text_generation
+from gifr.common import init_logging, set_logging_level, create_parser, init_state, State
+from gifr.priority import current_priority, request_priority
+from gifr.trace import traced
+
+PROG: str = "gifr-chain"
+
+_logger = logging.getLogger(PROG)
+
+state: State = None
+
+STAGE_ASR = "asr"
+STAGE_IMGCLS = "imgcls"
+STAGE_IMGSEG = "imgseg"
+STAGE_OBJDET = "objdet"
+STAGE_TEXTCLASS = "textclass"
+STAGE_TEXTGEN = "textgen"
+STAGE_MODULES = {
+    STAGE_ASR: gifr.asr,
+    STAGE_IMGCLS: gifr.image_classification,
+    STAGE_IMGSEG: gifr.image_segmentation,
+    STAGE_OBJDET: gifr.object_detection,
+    STAGE_TEXTCLASS: gifr.text_classification,
+    STAGE_TEXTGEN: gifr.text_generation,
+}
+
+KIND_AUDIO = "audio"
+KIND_IMAGE = "image"
+KIND_TEXT = "text"
+KIND_LABELS = "labels"
+KIND_OBJECTS = "objects"
+KIND_MASK = "mask"
+STAGE_INPUT_KINDS = {
+    STAGE_ASR: KIND_AUDIO,
+    STAGE_IMGCLS: KIND_IMAGE,
+    STAGE_IMGSEG: KIND_IMAGE,
+    STAGE_OBJDET: KIND_IMAGE,
+    STAGE_TEXTCLASS: KIND_TEXT,
+    STAGE_TEXTGEN: KIND_TEXT,
+}
+STAGE_OUTPUT_KINDS = {
+    STAGE_ASR: KIND_TEXT,
+    STAGE_IMGCLS: KIND_LABELS,
+    STAGE_IMGSEG: KIND_MASK,
+    STAGE_OBJDET: KIND_OBJECTS,
+    STAGE_TEXTCLASS: KIND_LABELS,
+    STAGE_TEXTGEN: KIND_TEXT,
+}
+
+CONVERSIONS = {
+    (KIND_TEXT, KIND_TEXT): False,
+    (KIND_LABELS, KIND_TEXT): False,
+    (KIND_OBJECTS, KIND_IMAGE): True,
+    (KIND_MASK, KIND_IMAGE): True,
+}
+""" the supported conversions (output kind, input kind) and whether they fan out. """
+
+INPUT = "$input"
+""" the name to use for referencing the input of the chain. """
+
+
+@dataclass
+class Stage:
+    name: str
+    stage_type: str
+    input: str
+    state: State
+    fan_out: bool = False
+
+
+def load_chain(path: str, shared: State, logger: logging.Logger) -> List[Stage]:
+    """
+    Loads the chain definition from the JSON file and initializes the stages.
+    Each stage has a "name", a "type" (asr|imgcls|imgseg|objdet|textclass|textgen),
+    an optional "input" (name of an earlier stage or "$input"; default is the
+    previous stage or "$input" for the first one) and optional "args", the
+    command-line options of the corresponding gifr interface (channels, timeout, etc).
+
+    :param path: the JSON file to load
+    :type path: str
+    :param shared: the state to share the redis connection, listener etc with
+    :type shared: State
+    :param logger: the logger to use
+    :type logger: logging.Logger
+    :return: the stages
+    :rtype: list
+    """
+    with open(path, "r") as fp:
+        config = json.load(fp)
+
+    result = []
+    names = dict()
+    for i, d in enumerate(config["stages"]):
+        name = d.get("name", "stage-%d" % i)
+        stage_type = d["type"]
+        if stage_type not in STAGE_MODULES:
+            raise Exception("Unknown stage type for stage '%s' (%s): %s" % (name, "|".join(STAGE_MODULES.keys()), stage_type))
+        if name in names:
+            raise Exception("Duplicate stage name: %s" % name)
+        source = d.get("input", INPUT if len(result) == 0 else result[-1].name)
+
+        # check compatibility
+        fan_out = False
+        if source != INPUT:
+            if source not in names:
+                raise Exception("Stage '%s' uses unknown or later stage as input: %s" % (name, source))
+            parent = names[source]
+            if parent.fan_out:
+                raise Exception("Stage '%s' cannot use output of stage '%s', as it processes multiple inputs" % (name, source))
+            conversion = (STAGE_OUTPUT_KINDS[parent.stage_type], STAGE_INPUT_KINDS[stage_type])
+            if conversion not in CONVERSIONS:
+                raise Exception("Stage '%s' (%s) cannot use output of stage '%s' (%s)" % (name, stage_type, source, parent.stage_type))
+            fan_out = CONVERSIONS[conversion]
+            if fan_out and (parent.input != INPUT):
+                raise Exception("Stage '%s' can only process regions of stages that use the chain's input: %s" % (name, source))
+
+        # initialize state
+        module = STAGE_MODULES[stage_type]
+        ns = module.create_argparser().parse_args(args=d.get("args", []))
+        stage_state = init_state(ns, shared=shared)
+        module.post_init_state(stage_state)
+        set_logging_level(stage_state.logger, ns.logging_level)
+
+        stage = Stage(name=name, stage_type=stage_type, input=source, state=stage_state, fan_out=fan_out)
+        result.append(stage)
+        names[name] = stage
+        logger.info("Stage '%s': type=%s, input=%s, channels=%s/%s" % (name, stage_type, source, stage_state.channel_in, stage_state.channel_out))
+
+    if len(result) == 0:
+        raise Exception("No stages defined in: %s" % path)
+    kinds = set([STAGE_INPUT_KINDS[x.stage_type] for x in result if x.input == INPUT])
+    if len(kinds) > 1:
+        raise Exception("Stages using the chain's input require different types of input: %s" % ", ".join(sorted(kinds)))
+
+    return result
+
+
+def input_kind(stages: List[Stage]) -> str:
+    """
+    Returns the kind of input the chain requires.
+
+    :param stages: the stages of the chain
+    :type stages: list
+    :return: the kind of input (audio|image|text)
+    :rtype: str
+    """
+    for stage in stages:
+        if stage.input == INPUT:
+            return STAGE_INPUT_KINDS[stage.stage_type]
+    raise Exception("No stage uses the chain's input!")
+
+
+def to_json(output: Any) -> Any:
+    """
+    Turns the output of a stage into a JSON-serializable representation.
+
+    :param output: the output to convert
+    :return: the JSON representation
+    """
+    if isinstance(output, ObjectPredictions):
+        return json.loads(output.to_json_string())
+    if isinstance(output, np.ndarray):
+        values, counts = np.unique(output, return_counts=True)
+        return {"classes": {str(v): int(c) for v, c in zip(values.tolist(), counts.tolist())}}
+    return output
+
+
+def crop(img: Image.Image, box: Tuple[int, int, int, int]) -> bytes:
+    """
+    Crops the region from the image and returns it as PNG.
+
+    :param img: the image to crop
+    :type img: Image.Image
+    :param box: the left, top, right, bottom coordinates (inclusive)
+    :type box: tuple
+    :return: the PNG data
+    :rtype: bytes
+    """
+    left, top, right, bottom = box
+    buf = io.BytesIO()
+    img.crop((left, top, right + 1, bottom + 1)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def stage_inputs(stage: Stage, chain_input: Any, outputs: Dict[str, Any]) -> List[Tuple[dict, Any]]:
+    """
+    Generates the input(s) for the stage from the chain input or the output of its input stage.
+
+    :param stage: the stage to generate the input(s) for
+    :type stage: Stage
+    :param chain_input: the input of the chain
+    :param outputs: the outputs of the stages so far
+    :type outputs: dict
+    :return: the list of tuples of info (None unless fanning out) and input
+    :rtype: list
+    """
+    if stage.input == INPUT:
+        return [(None, chain_input)]
+    output = outputs[stage.input]
+
+    # text
+    if isinstance(output, str):
+        return [(None, output)]
+    if isinstance(output, dict):
+        return [(None, max(output, key=output.get))]
+
+    # regions
+    result = []
+    img = Image.open(io.BytesIO(chain_input))
+    if isinstance(output, ObjectPredictions):
+        for i, obj in enumerate(output.objects):
+            box = (obj.bbox.left, obj.bbox.top, obj.bbox.right, obj.bbox.bottom)
+            result.append(({"object": i, "label": obj.label, "bbox": list(box)}, crop(img, box)))
+    elif isinstance(output, np.ndarray):
+        for value in np.unique(output):
+            if value == 0:
+                continue
+            ys, xs = np.nonzero(output == value)
+            box = (int(xs.min()), int(ys.min()), int(xs.max()), int(ys.max()))
+            result.append(({"region": int(value), "bbox": list(box), "pixels": len(xs)}, crop(img, box)))
+    else:
+        raise Exception("Unhandled output of stage '%s': %s" % (stage.input, str(type(output))))
+    return result
+
+
+def execute(stage: Stage, data: Any) -> Any:
+    """
+    Sends the data to the model of the stage and returns the output.
+
+    :param stage: the stage to execute
+    :type stage: Stage
+    :param data: the input for the stage (bytes for images, tuple of sample rate/samples for audio, str for text)
+    :return: the output, None if no result
+    """
+    st = stage.state
+    if stage.stage_type == STAGE_ASR:
+        return gifr.asr.transcribe_audio(st, data)
+    elif stage.stage_type == STAGE_IMGCLS:
+        return gifr.image_classification.classify(st, data)
+    elif stage.stage_type == STAGE_IMGSEG:
+        mask = gifr.image_segmentation.request_mask(st, data)
+        if mask is None:
+            return None
+        mask, _ = gifr.image_segmentation.to_indexed(st, mask)
+        return np.asarray(mask)
+    elif stage.stage_type == STAGE_OBJDET:
+        return gifr.object_detection.detect(st, data, stage.name)
+    elif stage.stage_type == STAGE_TEXTCLASS:
+        label, score = gifr.text_classification.classify(st, data)
+        return {label: score}
+    elif stage.stage_type == STAGE_TEXTGEN:
+        return gifr.text_generation.generate(st, data)
+    else:
+        raise Exception("Unhandled stage type: %s" % stage.stage_type)
+
+
+def run_stage(stage: Stage, chain_input: Any, outputs: Dict[str, Any], max_workers: int) -> Tuple[Any, dict]:
+    """
+    Runs the stage, dispatching the requests concurrently when processing multiple regions.
+
+    :param stage: the stage to run
+    :type stage: Stage
+    :param chain_input: the input of the chain
+    :param outputs: the outputs of the stages so far
+    :type outputs: dict
+    :param max_workers: the maximum number of concurrent requests
+    :type max_workers: int
+    :return: the tuple of output and result dictionary (with latency)
+    :rtype: tuple
+    """
+    start = datetime.now()
+    if (stage.input != INPUT) and (outputs[stage.input] is None):
+        output = None
+        result = None
+        requests = 0
+    else:
+        inputs = stage_inputs(stage, chain_input, outputs)
+        requests = len(inputs)
+        if stage.fan_out:
+            priority = current_priority()
+
+            def anon_execute(x):
+                with request_priority(priority):
+                    return execute(stage, x[1])
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                output = list(executor.map(anon_execute, inputs))
+            result = []
+            for (info, _), out in zip(inputs, output):
+                info = dict(info)
+                info["result"] = to_json(out)
+                result.append(info)
+        else:
+            output = execute(stage, inputs[0][1])
+            result = to_json(output)
+    latency = (datetime.now() - start).total_seconds()
+    return output, {
+        "type": stage.stage_type,
+        "input": stage.input,
+        "requests": requests,
+        "latency": latency,
+        "result": result,
+    }
+
+
+def run_chain(stages: List[Stage], chain_input: Any, max_workers: int = 4, logger: logging.Logger = None) -> dict:
+    """
+    Runs the chain on the input. Stages get started as soon as their input is available,
+    i.e., independent stages run concurrently.
+
+    :param stages: the stages of the chain
+    :type stages: list
+    :param chain_input: the input of the chain (bytes for images, tuple of sample rate/samples for audio, str for text)
+    :param max_workers: the maximum number of concurrent requests
+    :type max_workers: int
+    :param logger: the logger for outputting the latencies, ignored if None
+    :type logger: logging.Logger
+    :return: the results and latencies per stage
+    :rtype: dict
+    """
+    start = datetime.now()
+    outputs = dict()
+    results = dict()
+    pending = list(stages)
+    running = dict()
+    priority = current_priority()
+
+    def anon_run_stage(stage):
+        with request_priority(priority):
+            return run_stage(stage, chain_input, outputs, max_workers)
+
+    with ThreadPoolExecutor(max_workers=max(1, len(stages))) as executor:
+        while (len(pending) > 0) or (len(running) > 0):
+            for stage in list(pending):
+                if (stage.input == INPUT) or (stage.input in outputs):
+                    pending.remove(stage)
+                    running[executor.submit(anon_run_stage, stage)] = stage
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                outputs[stage.name], results[stage.name] = future.result()
+                if logger is not None:
+                    logger.info("Stage '%s': %0.3f seconds (%d request(s))" % (stage.name, results[stage.name]["latency"], results[stage.name]["requests"]))
+
+    return {
+        "stages": {stage.name: results[stage.name] for stage in stages},
+        "latency": (datetime.now() - start).total_seconds(),
+    }
+
+
+@traced(PROG)
+def predict(data) -> dict:
+    """
+    Runs the chain on the input.
+
+    :param data: the input (image file, audio tuple or text)
+    :return: the results and latencies per stage
+    :rtype: dict
+    """
+    global state
+    if state.params["input_kind"] == KIND_IMAGE:
+        state.logger.info("Loading: %s" % data)
+        with open(data, "rb") as f:
+            data = f.read()
+    return run_chain(state.params["stages"], data, max_workers=state.params["max_workers"], logger=state.logger)
+
+
+def create_interface(state: State) -> "gr.Interface":
+    """
+    Generates the interface.
+
+    :param state: the state to use
+    :type state: State
+    """
+    import gradio as gr
+    kind = state.params["input_kind"]
+    if kind == KIND_IMAGE:
+        component = gr.Image(type="filepath", label="Input")
+    elif kind == KIND_AUDIO:
+        component = gr.Audio(label="Input", waveform_options={"show_recording_waveform": True})
+    else:
+        component = gr.Textbox(label="Input")
+    return gr.Interface(
+        title=state.title,
+        description=state.description,
+        fn=predict,
+        inputs=[
+            component,
+        ],
+        outputs=[
+            gr.JSON(label="Results"),
+        ],
+        allow_flagging="never")
+
+
+def post_init_state(state: State):
+    """
+    Finalizes the initialization of the state.
+
+    :param state: the state to update
+    :type state: State
+    """
+    state.logger = _logger
+    state.params["stages"] = load_chain(state.params["chain"], state, _logger)
+    state.params["input_kind"] = input_kind(state.params["stages"])
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """
+    Creates the parser for the command-line options.
+
+    :return: the parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = create_parser("Chains gifr interfaces, with the output of one stage being used as input for the next one. "
+                           + "Object detections and segmented regions get processed concurrently.",
+                           PROG, model_channel_in=None, model_channel_out=None,
+                           timeout=1.0, ui_title="Chain",
+                           ui_desc="Sends the input through the chain of models and displays the results and latencies of the stages.")
+    parser.add_argument("--chain", metavar="FILE", help="The JSON file with the definition of the stages.", type=str, required=True)
+    parser.add_argument("--max_workers", metavar="NUM", help="The maximum number of concurrent requests per stage.", default=4, type=int, required=False)
+    return parser
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    global state
+    init_logging()
+    parser = create_argparser()
+    parsed = parser.parse_args(args=args)
+    set_logging_level(_logger, parsed.logging_level)
+    state = init_state(parsed)
+    post_init_state(state)
+    ui = create_interface(state)
+    ui.launch(show_api=False, share=parsed.share_interface, inbrowser=parsed.launch_browser)
+
+
+def sys_main() -> int:
+    """
+    Runs the main function using the system cli arguments, and
+    returns a system error code.
+
+    :return: 0 for success, 1 for failure.
+    """
+    try:
+        main()
+        return 0
+    except Exception:
+        traceback.print_exc()
+        print("options: %s" % str(sys.argv[1:]), file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    main()
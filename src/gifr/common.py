@@ -1,11 +1,30 @@
 import argparse
+import json
 import logging
 import os
+import queue
 import redis
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import datetime
-from time import sleep
+from typing import Any, Iterator, List, Optional, Tuple
+
+from gifr.admission import AdmissionController, Rejected
+from gifr.listener import SharedListener
+from gifr.envelope import pack, unpack, request_header, cancel_notice, cancel_channel, HEADER_ID, HEADER_END, HEADER_SHM, \
+    HEADER_CODEC, HEADER_ACCEPT
+from gifr.compression import Compressor, CODECS, decompress
+from gifr.offload import Offloader, resolve
+from gifr.record import TrafficRecorder
+from gifr.profiler import SamplingProfiler, init_profiling, ENV_GIFR_PROFILE
+from gifr.priority import PriorityLanes, current_priority, request_priority, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from gifr.shm import SharedMemoryTransport
+from gifr.replicas import ReplicaPool, Replica, STRATEGIES, STRATEGY_ROUND_ROBIN
+from gifr.timeouts import ChannelLatencies, AdaptiveTimeout
+from gifr.trace import Tracer, init_tracing, span
 
 
 LOGGING_DEBUG = "DEBUG"
@@ -24,6 +43,11 @@ LOGGING_LEVELS = [
 ENV_GIFR_LOGLEVEL = "GIFR_LOGLEVEL"
 """ environment variable for the global default logging level. """
 
+_channel_locks = dict()
+""" the locks per channel pair, as responses cannot be told apart. """
+
+_channel_locks_lock = threading.Lock()
+
 
 @dataclass
 class State:
@@ -38,6 +62,18 @@ class State:
     data = None
     logger: logging.Logger = None
     params: dict = field(default_factory=dict)
+    replicas: ReplicaPool = None
+    admission: AdmissionController = None
+    lanes: PriorityLanes = None
+    latencies: ChannelLatencies = None
+    adaptive_timeout: AdaptiveTimeout = None
+    offloader: Offloader = None
+    shm: SharedMemoryTransport = None
+    compressor: Compressor = None
+    tracer: Tracer = None
+    profiler: SamplingProfiler = None
+    recorder: TrafficRecorder = None
+    listener: SharedListener = None
 
 
 def str_to_logging_level(level: str) -> int:
@@ -125,6 +161,43 @@ def create_parser(description: str, prog: str, host: str = "localhost", port: in
         parser.add_argument("--model_channel_in", metavar="CHANNEL", help="The channel to send the data to for making predictions.", default=model_channel_in, type=str, required=False)
     if model_channel_out is not None:
         parser.add_argument("--model_channel_out", metavar="CHANNEL", help="The channel to receive the predictions on.", default=model_channel_out, type=str, required=False)
+    if (model_channel_in is not None) and (model_channel_out is not None):
+        parser.add_argument("--envelope", action="store_true", help="Whether to wrap the messages in envelopes with request ID and deadline (requires support by the model, see gifr.worker). Allows concurrent requests on the same channels and cancelling abandoned requests.")
+        parser.add_argument("--compression", choices=CODECS, default=None, help="The codec for compressing large payloads (requires --envelope); the model may compress its replies with it as well.")
+        parser.add_argument("--compression_threshold", metavar="BYTES", help="The size above which payloads get compressed.", default=16384, type=int, required=False)
+        parser.add_argument("--compression_level", metavar="LEVEL", help="The compression level, uses the codec's default if not provided.", default=None, type=int, required=False)
+        parser.add_argument("--offload_threshold", metavar="BYTES", help="The size above which payloads get stored under a content-hash key and only a reference gets published (requires --envelope); <1 to turn off.", default=0, type=int, required=False)
+        parser.add_argument("--offload_ttl", metavar="SECONDS", help="The number of seconds to keep offloaded payloads.", default=300, type=int, required=False)
+        parser.add_argument("--shm_dir", metavar="DIR", help="The directory shared with the model (ideally a tmpfs like /dev/shm) for handing over large payloads via memory-mapped files (requires --envelope).", default=None, type=str, required=False)
+        parser.add_argument("--shm_threshold", metavar="BYTES", help="The size above which payloads get handed over via --shm_dir.", default=65536, type=int, required=False)
+        parser.add_argument("--replicas", metavar="IN:OUT", help="The channel pairs (in:out) of the model replicas to spread the requests across, instead of using the model channels.", default=None, type=str, required=False, nargs="+")
+        parser.add_argument("--balancing", choices=STRATEGIES, default=STRATEGY_ROUND_ROBIN, help="How to pick the replica for a request.")
+        parser.add_argument("--eject_time", metavar="SECONDS", help="The number of seconds to skip a replica after it failed to respond, <=0 to never skip.", default=30.0, type=float, required=False)
+        parser.add_argument("--hedge", action="store_true", help="Whether to send a duplicate request to another replica if the first one has not responded within the --hedge_percentile of its latencies (requires --replicas).")
+        parser.add_argument("--hedge_percentile", metavar="PERCENTILE", help="The percentile of the latencies after which to send a duplicate request.", default=95.0, type=float, required=False)
+        parser.add_argument("--adaptive_timeout", action="store_true", help="Whether to derive the timeout from the observed latencies per channel pair instead of using --timeout (which gets used until enough latencies have been observed).")
+        parser.add_argument("--timeout_percentile", metavar="PERCENTILE", help="The percentile of the latencies to base the adaptive timeout on.", default=99.0, type=float, required=False)
+        parser.add_argument("--timeout_factor", metavar="FACTOR", help="The factor to multiply the percentile with for the adaptive timeout.", default=1.5, type=float, required=False)
+        parser.add_argument("--timeout_min", metavar="SECONDS", help="The smallest adaptive timeout.", default=0.1, type=float, required=False)
+        parser.add_argument("--timeout_max", metavar="SECONDS", help="The largest adaptive timeout.", default=60.0, type=float, required=False)
+        parser.add_argument("--timeout_scale_size", action="store_true", help="Whether to scale the latencies by payload size (linear fit) for adaptive timeout and hedging.")
+    if (model_channel_in is not None) and (model_channel_out is not None):
+        parser.add_argument("--bulk_channel_in", metavar="CHANNEL", help="The channel to send bulk requests to, uses the model channels if not provided.", default=None, type=str, required=False)
+        parser.add_argument("--bulk_channel_out", metavar="CHANNEL", help="The channel to receive the predictions of bulk requests on, uses the model channels if not provided.", default=None, type=str, required=False)
+    parser.add_argument("--interactive_weight", metavar="NUM", help="How many waiting interactive requests get sent for every waiting bulk request (see --max_in_flight).", default=4, type=int, required=False)
+    parser.add_argument("--interactive_slo", metavar="SECONDS", help="The latency objective for interactive requests to report on, <=0 for none.", default=0.0, type=float, required=False)
+    parser.add_argument("--max_in_flight", metavar="NUM", help="The maximum number of requests in flight, further requests have to wait; <1 for unlimited.", default=0, type=int, required=False)
+    parser.add_argument("--max_queue", metavar="NUM", help="The maximum number of requests waiting for being sent, further requests get rejected.", default=0, type=int, required=False)
+    parser.add_argument("--max_queue_time", metavar="SECONDS", help="The maximum number of seconds a request waits for being sent before getting rejected.", default=1.0, type=float, required=False)
+    parser.add_argument("--trace_file", metavar="FILE", help="The file to write the timing spans of the requests to, in Chrome trace-event JSON format.", default=None, type=str, required=False)
+    parser.add_argument("--trace_summary", metavar="NUM", help="The number of requests after which to log the per-stage timing summary, <1 for never.", default=0, type=int, required=False)
+    parser.add_argument("--record_dir", metavar="DIR", help="The directory to record the requests and responses in, for replaying them with gifr-replay.", default=None, type=str, required=False)
+    parser.add_argument("--record_max_size", metavar="BYTES", help="The size of a traffic file after which to start a new one.", default=100 * 1024 * 1024, type=int, required=False)
+    parser.add_argument("--profile_dir", metavar="DIR", help="Enables the sampling profiler: sending SIGUSR1 to the process (or setting the %s environment variable) starts a session, sending it again ends it; the collapsed stacks for flame graphs get written to this directory." % ENV_GIFR_PROFILE, default=None, type=str, required=False)
+    parser.add_argument("--profile_seconds", metavar="SECONDS", help="The maximum duration of a profiling session, <=0 for no limit.", default=30.0, type=float, required=False)
+    parser.add_argument("--profile_requests", metavar="NUM", help="The number of requests after which to end a profiling session, <1 for no limit.", default=0, type=int, required=False)
+    parser.add_argument("--profile_slow", metavar="SECONDS", help="Only keeps the samples of requests taking at least this many seconds, <=0 to keep all samples.", default=0.0, type=float, required=False)
+    parser.add_argument("--profile_interval", metavar="SECONDS", help="The sampling interval of the profiler.", default=0.005, type=float, required=False)
     parser.add_argument("--sleep_time", metavar="SECONDS", help="The sleep time in seconds for the pub-sub thread.", default=sleep_time, type=float, required=False)
     parser.add_argument("--timeout", metavar="SECONDS", help="The number of seconds to wait for a response.", default=timeout, type=float, required=False)
     parser.add_argument("--title", metavar="TITLE", help="The title to use for interface.", default=ui_title, type=str, required=False)
@@ -135,17 +208,36 @@ def create_parser(description: str, prog: str, host: str = "localhost", port: in
     return parser
 
 
-def init_state(ns: argparse.Namespace) -> State:
+def add_stream_arguments(parser: argparse.ArgumentParser, prefix: str = "", what: str = "model"):
+    """
+    Adds the options for receiving streamed responses to the parser.
+
+    :param parser: the parser to extend
+    :type parser: argparse.ArgumentParser
+    :param prefix: the prefix for the option names, eg "audio_"
+    :type prefix: str
+    :param what: the name of the model for the help strings
+    :type what: str
+    """
+    parser.add_argument("--%sstream" % prefix, action="store_true", help="Whether the %s streams the response as a sequence of JSON messages; the timeout then applies to the gap between messages." % what)
+    parser.add_argument("--%sreceive_seq" % prefix, metavar="FIELD", help="The field name in the streamed JSON messages of the %s containing the sequence number (0-based)." % what, default="seq", type=str, required=False)
+    parser.add_argument("--%sreceive_end" % prefix, metavar="FIELD", help="The field name in the streamed JSON messages of the %s that flags the last message." % what, default="end", type=str, required=False)
+
+
+def init_state(ns: argparse.Namespace, shared: State = None) -> State:
     """
     Initializes the redis state container with the supplied parsed parameters.
 
     :param ns: the parsed options
     :type ns: argparse.Namespace
+    :param shared: the state to share the redis connection, listener, tracer, profiler and
+                   traffic recorder with (the corresponding options get ignored), None to create them
+    :type shared: State
     :return: the state container
     :rtype: State
     """
     result = State(
-        connection=redis.Redis(host=ns.redis_host, port=ns.redis_port, db=ns.redis_db),
+        connection=redis.Redis(host=ns.redis_host, port=ns.redis_port, db=ns.redis_db) if shared is None else shared.connection,
         timeout=ns.timeout,
         title=ns.title,
         description=ns.description,
@@ -158,18 +250,572 @@ def init_state(ns: argparse.Namespace) -> State:
         if att == "model_channel_in":
             result.channel_in = ns.model_channel_in
         if att == "model_channel_out":
-            result.channel_in = ns.model_channel_out
+            result.channel_out = ns.model_channel_out
         if att in ["redis_host", "redis_port", "redis_db", "timeout", "title", "description", "sleep_time", "model_channel_in", "model_channel_out"]:
             continue
         result.params[att] = getattr(ns, att)
 
+    if getattr(ns, "replicas", None) is not None:
+        result.replicas = ReplicaPool(parse_channel_pairs(ns.replicas), strategy=ns.balancing, eject_time=ns.eject_time)
+    if getattr(ns, "compression", None) is not None:
+        if not ns.envelope:
+            raise Exception("Compression requires --envelope!")
+        result.compressor = Compressor(ns.compression, threshold=ns.compression_threshold, level=ns.compression_level)
+    if getattr(ns, "offload_threshold", 0) > 0:
+        if not ns.envelope:
+            raise Exception("Offloading payloads requires --envelope!")
+        result.offloader = Offloader(result.connection, ns.offload_threshold, ttl=ns.offload_ttl)
+    if getattr(ns, "shm_dir", None) is not None:
+        if not ns.envelope:
+            raise Exception("Shared memory transport requires --envelope!")
+        if not os.path.isdir(ns.shm_dir):
+            raise Exception("Shared memory directory does not exist: %s" % ns.shm_dir)
+        result.shm = SharedMemoryTransport(ns.shm_dir, threshold=ns.shm_threshold)
+    if getattr(ns, "hedge", False) and (result.replicas is None):
+        raise Exception("Hedging requires --replicas!")
+    if getattr(ns, "adaptive_timeout", False) or getattr(ns, "hedge", False):
+        result.latencies = ChannelLatencies(scale_by_size=ns.timeout_scale_size)
+    if getattr(ns, "adaptive_timeout", False):
+        result.adaptive_timeout = AdaptiveTimeout(result.latencies, percentile=ns.timeout_percentile, factor=ns.timeout_factor,
+                                                  min_timeout=ns.timeout_min, max_timeout=ns.timeout_max)
+
+    if shared is not None:
+        result.listener = shared.listener
+        result.tracer = shared.tracer
+        result.recorder = shared.recorder
+        result.profiler = shared.profiler
+    else:
+        result.tracer = init_tracing(getattr(ns, "trace_file", None), getattr(ns, "trace_summary", 0))
+        if getattr(ns, "record_dir", None) is not None:
+            result.recorder = TrafficRecorder(ns.record_dir, max_size=ns.record_max_size)
+        if getattr(ns, "profile_dir", None) is not None:
+            profiler_logger = logging.getLogger("gifr-profiler")
+            set_logging_level(profiler_logger, ns.logging_level)
+            result.profiler = init_profiling(ns.profile_dir, seconds=ns.profile_seconds, requests=ns.profile_requests,
+                                             slow=ns.profile_slow, interval=ns.profile_interval, logger=profiler_logger)
+
+    channels = dict()
+    if (getattr(ns, "bulk_channel_in", None) is not None) or (getattr(ns, "bulk_channel_out", None) is not None):
+        if (ns.bulk_channel_in is None) or (ns.bulk_channel_out is None):
+            raise Exception("Both --bulk_channel_in and --bulk_channel_out are required!")
+        channels[PRIORITY_BULK] = (ns.bulk_channel_in, ns.bulk_channel_out)
+    result.lanes = PriorityLanes(weights={PRIORITY_INTERACTIVE: getattr(ns, "interactive_weight", 1)}, channels=channels,
+                                 slo=getattr(ns, "interactive_slo", 0.0))
+    if getattr(ns, "max_in_flight", 0) > 0:
+        result.admission = AdmissionController(ns.max_in_flight, max_queue=ns.max_queue, max_queue_time=ns.max_queue_time,
+                                               weights=result.lanes.weights)
+
+    return result
+
+
+def log_message(state: State, msg: str, error: bool = False):
+    """
+    Outputs the message via the state's logger or stdout if no logger available.
+
+    :param state: the state with the logger
+    :type state: State
+    :param msg: the message to output
+    :type msg: str
+    :param error: whether it is an error message or just an info one
+    :type error: bool
+    """
+    if state.logger is None:
+        print(msg)
+    elif error:
+        state.logger.error(msg)
+    else:
+        state.logger.info(msg)
+
+
+def subscribe(state: State, channel_out: str, request_id: str = None, messages: queue.Queue = None,
+              tag: Any = None) -> Tuple[Any, Any, queue.Queue]:
+    """
+    Subscribes to the specified channel and collects all incoming messages in a queue.
+    Uses the shared listener of the state if available, otherwise a new pub-sub
+    connection and thread. Use unsubscribe to stop listening.
+
+    :param state: the state with the redis connection
+    :type state: State
+    :param channel_out: the channel to listen to
+    :type channel_out: str
+    :param request_id: if not None, only envelopes with this ID get collected, as (header, payload) tuples
+    :type request_id: str
+    :param messages: the queue to collect the messages in, creates a new one if None
+    :type messages: queue.Queue
+    :param tag: if not None, the messages get collected as (tag, message) tuples, e.g., when sharing a queue
+    :return: the tuple of pubsub (or shared listener), listener thread (or token) and queue with the message data
+    :rtype: tuple
+    """
+    if messages is None:
+        messages = queue.Queue()
+
+    def anon_put(item):
+        messages.put(item if tag is None else (tag, item))
+
+    def anon_handler(message):
+        if request_id is None:
+            anon_put(message['data'])
+            return
+        envelope = unpack(message['data'])
+        if (envelope is not None) and (envelope[0].get(HEADER_ID) == request_id):
+            anon_put(envelope)
+
+    if state.listener is not None:
+        return state.listener, state.listener.subscribe(channel_out, anon_handler), messages
+
+    pubsub = state.connection.pubsub(ignore_subscribe_messages=True)
+    pubsub.psubscribe(**{channel_out: anon_handler})
+    thread = pubsub.run_in_thread(sleep_time=state.sleep_time, daemon=True)
+    return pubsub, thread, messages
+
+
+def unsubscribe(pubsub: Any, thread: Any):
+    """
+    Stops listening.
+
+    :param pubsub: the pubsub instance to close or the shared listener
+    :param thread: the listener thread to stop or the token of the shared listener
+    """
+    if isinstance(pubsub, SharedListener):
+        pubsub.unsubscribe(thread)
+        return
+    thread.stop()
+    pubsub.close()
+
+
+def channel_lock(channel_in: str, channel_out: str) -> threading.Lock:
+    """
+    Returns the lock for the channel pair. Responses on the out channel carry no
+    information about the request they belong to, so there must only be one
+    request in flight per channel pair.
+
+    :param channel_in: the channel the data gets sent to
+    :type channel_in: str
+    :param channel_out: the channel the response gets received on
+    :type channel_out: str
+    :return: the lock
+    :rtype: threading.Lock
+    """
+    key = (channel_in, channel_out)
+    with _channel_locks_lock:
+        if key not in _channel_locks:
+            _channel_locks[key] = threading.Lock()
+        return _channel_locks[key]
+
+
+def remaining_time(start: datetime, timeout: float) -> Optional[float]:
+    """
+    Returns the number of seconds left until the timeout is reached.
+
+    :param start: the start of the wait
+    :type start: datetime
+    :param timeout: the timeout in seconds, <=0 for no timeout
+    :type timeout: float
+    :return: the remaining seconds (>=0), None if no timeout
+    :rtype: float
+    """
+    if timeout <= 0:
+        return None
+    return max(0.0, timeout - (datetime.now() - start).total_seconds())
+
+
+def uses_envelope(state: State) -> bool:
+    """
+    Checks whether the messages get wrapped in envelopes (see gifr.envelope).
+
+    :param state: the state to check
+    :type state: State
+    :return: whether envelopes are used
+    :rtype: bool
+    """
+    return bool(state.params.get("envelope", False))
+
+
+def cancel_request(state: State, channel_in: str, request_id: str):
+    """
+    Publishes the cancel notice for the request, as no one is waiting for the result anymore.
+
+    :param state: the state with the redis connection
+    :type state: State
+    :param channel_in: the channel the request was sent to
+    :type channel_in: str
+    :param request_id: the ID of the request
+    :type request_id: str
+    """
+    try:
+        state.connection.publish(cancel_channel(channel_in), cancel_notice(request_id))
+    except Exception:
+        log_message(state, "Failed to cancel request %s" % request_id, error=True)
+
+
+def stage_payload(state: State, header: dict, data) -> Tuple[dict, Any]:
+    """
+    Compresses large payloads if the state has a compressor and then moves large payloads
+    into shared memory if the state has a shared memory transport. Falls back on sending
+    the payload via redis if the latter fails. Call release_payload once the request is done.
+
+    :param state: the state with the compressor/shared memory transport
+    :type state: State
+    :param header: the header of the envelope
+    :type header: dict
+    :param data: the data to send
+    :return: the tuple of header and data to publish
+    :rtype: tuple
+    """
+    if state.compressor is not None:
+        header = dict(header)
+        header[HEADER_ACCEPT] = [state.compressor.codec]
+        codec, data = state.compressor.compress(data)
+        if codec is not None:
+            header[HEADER_CODEC] = codec
+        if state.logger is not None:
+            state.logger.debug("Compression: %s" % state.compressor.stats())
+    if (state.shm is None) or not state.shm.applies(data):
+        return header, data
+    try:
+        info = state.shm.write(data)
+    except Exception as e:
+        log_message(state, "Failed to use shared memory, sending via redis: %s" % str(e), error=True)
+        return header, data
+    header = dict(header)
+    header[HEADER_SHM] = info
+    return header, b""
+
+
+def release_payload(state: State, header: dict):
+    """
+    Removes the shared memory file of the request, if any.
+
+    :param state: the state with the shared memory transport
+    :type state: State
+    :param header: the header of the envelope that was published
+    :type header: dict
+    """
+    if (state.shm is not None) and (HEADER_SHM in header):
+        state.shm.remove(header[HEADER_SHM])
+
+
+def publish_envelope(state: State, channel_in: str, header: dict, data):
+    """
+    Publishes the data wrapped in an envelope, offloading large payloads if the state has an offloader.
+
+    :param state: the state with the redis connection
+    :type state: State
+    :param channel_in: the channel to publish on
+    :type channel_in: str
+    :param header: the header of the envelope
+    :type header: dict
+    :param data: the data to send
+    """
+    if state.offloader is None:
+        state.connection.publish(channel_in, pack(header, data))
+    else:
+        state.offloader.publish(channel_in, header, data)
+        if state.logger is not None:
+            state.logger.debug("Offloading: %s" % state.offloader.stats())
+
+
+def open_envelope(state: State, envelope: Tuple[dict, bytes]) -> Optional[bytes]:
+    """
+    Returns the payload of the envelope received from the model, retrieving offloaded payloads,
+    reading (and removing) shared memory files and decompressing the payload.
+
+    :param state: the state with the redis connection
+    :type state: State
+    :param envelope: the tuple of header and payload
+    :type envelope: tuple
+    :return: the payload, None if the offloaded payload is no longer available
+    :rtype: bytes
+    """
+    header, payload = envelope
+    if HEADER_SHM in header:
+        if state.shm is None:
+            log_message(state, "Received payload via shared memory, but no --shm_dir specified: %s" % str(header), error=True)
+            return None
+        try:
+            result = state.shm.read(header[HEADER_SHM], remove=True)
+        except Exception as e:
+            log_message(state, "Failed to read payload from shared memory: %s" % str(e), error=True)
+            return None
+    else:
+        result = resolve(state.connection, header, payload)
+        if result is None:
+            log_message(state, "Offloaded payload no longer available: %s" % str(header), error=True)
+            return None
+    if HEADER_CODEC in header:
+        if state.compressor is not None:
+            result = state.compressor.decompress(header[HEADER_CODEC], result)
+        else:
+            result = decompress(header[HEADER_CODEC], result)
+    return result
+
+
+@contextmanager
+def admitted(state: State, priority: str = PRIORITY_INTERACTIVE):
+    """
+    Context manager that admits the request if the state uses admission control.
+
+    :param state: the state with the admission controller
+    :type state: State
+    :param priority: the priority class of the request
+    :type priority: str
+    :raises Rejected: if the request did not get admitted
+    """
+    if state.admission is None:
+        yield
+        return
+    try:
+        state.admission.acquire(priority)
+    except Rejected:
+        log_message(state, "Rejected request: %s" % state.admission.stats(), error=True)
+        raise
+    try:
+        yield
+    finally:
+        state.admission.release()
+        if state.logger is not None:
+            state.logger.debug("Admission: %s" % state.admission.stats())
+
+
+def record_latency(state: State, priority: str, start: datetime, success: bool):
+    """
+    Records the latency of the request for its priority class.
+
+    :param state: the state with the priority lanes
+    :type state: State
+    :param priority: the priority class of the request
+    :type priority: str
+    :param start: the start time of the request (before admission)
+    :type start: datetime
+    :param success: whether a response was received
+    :type success: bool
+    """
+    if state.lanes is None:
+        return
+    state.lanes.record(priority, (datetime.now() - start).total_seconds() if success else None)
+    if state.logger is not None:
+        state.logger.debug("Latencies: %s" % state.lanes.stats())
+
+
+def record_traffic(state: State, priority: str, channel_in: str, channel_out: str, data, result, start: datetime):
+    """
+    Records the request and its response, if the state has a traffic recorder.
+
+    :param state: the state with the traffic recorder
+    :type state: State
+    :param priority: the priority class of the request
+    :type priority: str
+    :param channel_in: the channel the request was sent to
+    :type channel_in: str
+    :param channel_out: the channel the response was received on
+    :type channel_out: str
+    :param data: the data that was sent
+    :param result: the received data, None if failed or timeout
+    :param start: the start time of the request (before admission)
+    :type start: datetime
+    """
+    if state.recorder is None:
+        return
+    try:
+        state.recorder.record(channel_in, channel_out, priority, data, result, start.timestamp(),
+                              (datetime.now() - start).total_seconds())
+    except Exception:
+        log_message(state, "Failed to record traffic!", error=True)
+
+
+def lane_channels(state: State, priority: str) -> Optional[Tuple[str, str]]:
+    """
+    Returns the dedicated channels of the priority class.
+
+    :param state: the state with the priority lanes
+    :type state: State
+    :param priority: the priority class
+    :type priority: str
+    :return: the (channel_in, channel_out) tuple, None if the model channels/replicas are to be used
+    :rtype: tuple
+    """
+    if state.lanes is None:
+        return None
+    return state.lanes.channels_for(priority)
+
+
+def payload_size(data) -> int:
+    """
+    Returns the size of the data to send.
+
+    :param data: the data
+    :return: the size in bytes (characters for strings)
+    :rtype: int
+    """
+    if isinstance(data, (bytes, str)):
+        return len(data)
+    return 0
+
+
+def record_channel_latency(state: State, channel_in: str, channel_out: str, data, sent: datetime):
+    """
+    Records the latency of the model for adaptive timeouts and hedging.
+
+    :param state: the state with the latencies
+    :type state: State
+    :param channel_in: the channel the request was sent to
+    :type channel_in: str
+    :param channel_out: the channel the reply was received on
+    :type channel_out: str
+    :param data: the data that was sent
+    :param sent: when the data was sent
+    :type sent: datetime
+    """
+    if state.latencies is not None:
+        state.latencies.record(channel_in, channel_out, payload_size(data), (datetime.now() - sent).total_seconds())
+
+
+def request_timeout(state: State, channel_in: str, channel_out: str, data) -> float:
+    """
+    Determines the timeout for the request, either the state's timeout or the adaptive one.
+
+    :param state: the state to use
+    :type state: State
+    :param channel_in: the channel the request gets sent to
+    :type channel_in: str
+    :param channel_out: the channel the reply gets received on
+    :type channel_out: str
+    :param data: the data to send
+    :return: the timeout in seconds
+    :rtype: float
+    """
+    if state.adaptive_timeout is None:
+        return state.timeout
+    result = state.adaptive_timeout.timeout(channel_in, channel_out, payload_size(data), state.timeout)
+    if state.logger is not None:
+        state.logger.debug("Timeout for %s:%s: %0.3f seconds" % (channel_in, channel_out, result))
     return result
 
 
-def make_prediction(state: State, data, channel_out: str = None, channel_in: str = None):
+def release_replica(state: State, replica, start: datetime, success: bool):
+    """
+    Releases the replica after a request, updating its statistics.
+
+    :param state: the state with the replicas
+    :type state: State
+    :param replica: the replica to release
+    :type replica: Replica
+    :param start: the start time of the request
+    :type start: datetime
+    :param success: whether the replica responded
+    :type success: bool
+    """
+    latency = (datetime.now() - start).total_seconds() if success else None
+    if state.replicas.release(replica, latency):
+        log_message(state, "Ejected replica %s:%s for %0.1f seconds" % (replica.channel_in, replica.channel_out, state.replicas.eject_time), error=True)
+    if state.logger is not None:
+        state.logger.debug("Replicas: %s" % state.replicas.stats())
+
+
+def _make_prediction(state: State, data, channel_out: str, channel_in: str, timeout: float):
     """
     Makes a prediction by broadcasting the data and waiting for a result coming through.
 
+    :param state: the state to use to broadcasting/listening
+    :type state: State
+    :param data: the data to send
+    :param channel_out: the channel to receive the result on
+    :type channel_out: str
+    :param channel_in: the channel to send the data to
+    :type channel_in: str
+    :param timeout: the timeout in seconds
+    :type timeout: float
+    :return: the received data, None if failed or timeout
+    """
+    start = datetime.now()
+    if uses_envelope(state):
+        return _make_enveloped_prediction(state, data, channel_out, channel_in, timeout)
+    lock = channel_lock(channel_in, channel_out)
+    with span("wait for channel"):
+        acquired = lock.acquire(timeout=-1 if timeout <= 0 else timeout)
+    if not acquired:
+        log_message(state, "Timeout reached waiting for channel %s!" % channel_in, error=True)
+        return None
+    try:
+        pubsub, thread, messages = subscribe(state, channel_out)
+        try:
+            with span("publish", size=payload_size(data)):
+                state.connection.publish(channel_in, data)
+
+            # wait for data to show up
+            sent = datetime.now()
+            try:
+                with span("model", channel=channel_in):
+                    result = messages.get(timeout=remaining_time(start, timeout))
+            except queue.Empty:
+                log_message(state, "Timeout reached!", error=True)
+                return None
+            end = datetime.now()
+        finally:
+            unsubscribe(pubsub, thread)
+    finally:
+        lock.release()
+
+    record_channel_latency(state, channel_in, channel_out, data, sent)
+    log_message(state, "Time for prediction: %0.3f seconds" % (end - sent).total_seconds())
+    return result
+
+
+def _make_enveloped_prediction(state: State, data, channel_out: str, channel_in: str, timeout: float):
+    """
+    Makes a prediction by broadcasting the data wrapped in an envelope and waiting for the
+    reply with the same request ID. Publishes a cancel notice if the timeout is reached.
+    No locking is required, as the replies can be told apart.
+
+    :param state: the state to use to broadcasting/listening
+    :type state: State
+    :param data: the data to send
+    :param channel_out: the channel to receive the result on
+    :type channel_out: str
+    :param channel_in: the channel to send the data to
+    :type channel_in: str
+    :param timeout: the timeout in seconds
+    :type timeout: float
+    :return: the received data, None if failed or timeout
+    """
+    header = request_header(timeout)
+    with span("encode"):
+        staged_header, staged_data = stage_payload(state, header, data)
+    pubsub, thread, messages = subscribe(state, channel_out, request_id=header[HEADER_ID])
+    try:
+        sent = datetime.now()
+        with span("publish", size=payload_size(staged_data)):
+            publish_envelope(state, channel_in, staged_header, staged_data)
+        try:
+            with span("model", channel=channel_in):
+                envelope = messages.get(timeout=remaining_time(sent, timeout))
+        except queue.Empty:
+            log_message(state, "Timeout reached!", error=True)
+            cancel_request(state, channel_in, header[HEADER_ID])
+            return None
+        end = datetime.now()
+    finally:
+        unsubscribe(pubsub, thread)
+        release_payload(state, staged_header)
+
+    with span("decode"):
+        result = open_envelope(state, envelope)
+    if result is None:
+        return None
+    record_channel_latency(state, channel_in, channel_out, data, sent)
+    log_message(state, "Time for prediction: %0.3f seconds" % (end - sent).total_seconds())
+    return result
+
+
+def make_prediction(state: State, data, channel_out: str = None, channel_in: str = None, timeout: float = None):
+    """
+    Makes a prediction by broadcasting the data and waiting for a result coming through.
+    The timeout includes waiting for other requests on the same channels to finish.
+    If no channels are specified, the channels of the request's priority class get used
+    (see request_priority), otherwise a replica gets picked if the state has replicas
+    (with hedging, if enabled). Without timeout, the state's (adaptive) timeout gets used.
+    Raises Rejected if the state uses admission control and the request did not get admitted.
+
     :param state: the state to use to broadcasting/listening
     :type state: State
     :param data: the data to send
@@ -177,48 +823,348 @@ def make_prediction(state: State, data, channel_out: str = None, channel_in: str
     :type channel_out: str
     :param channel_in: for overriding the state's in channel
     :type channel_in: str
+    :param timeout: for overriding the state's timeout
+    :type timeout: float
+    :return: the received data, None if failed or timeout
+    """
+    priority = current_priority()
+    start = datetime.now()
+    result = None
+    with admitted(state, priority):
+        try:
+            replica = None
+            if (channel_out is None) and (channel_in is None):
+                lane = lane_channels(state, priority)
+                if lane is not None:
+                    channel_in, channel_out = lane
+                elif state.replicas is not None:
+                    replica = state.replicas.acquire()
+                    channel_in, channel_out = replica.channel_in, replica.channel_out
+            if channel_out is None:
+                channel_out = state.channel_out
+            if channel_in is None:
+                channel_in = state.channel_in
+            if timeout is None:
+                timeout = request_timeout(state, channel_in, channel_out, data)
+
+            if replica is None:
+                result = _make_prediction(state, data, channel_out, channel_in, timeout)
+                return result
+            if state.params.get("hedge", False):
+                # releases the replica(s) itself, crediting only the one that won
+                result = _make_hedged_prediction(state, data, replica, timeout)
+                return result
+            replica_start = datetime.now()
+            try:
+                result = _make_prediction(state, data, channel_out, channel_in, timeout)
+            finally:
+                release_replica(state, replica, replica_start, result is not None)
+            return result
+        finally:
+            record_latency(state, priority, start, result is not None)
+            record_traffic(state, priority, channel_in, channel_out, data, result, start)
+
+
+def _make_hedged_prediction(state: State, data, replica: Replica, timeout: float):
+    """
+    Makes a prediction by broadcasting the data to the replica. If the replica has not
+    responded within the hedging percentile of its latencies, a duplicate request gets
+    sent to another replica, using whichever response arrives first.
+    Releases the replicas, with only the one whose response got used counting as successful.
+
+    :param state: the state to use to broadcasting/listening
+    :type state: State
+    :param data: the data to send
+    :param replica: the replica to send the data to first (acquired by the caller)
+    :type replica: Replica
+    :param timeout: the timeout in seconds
+    :type timeout: float
     :return: the received data, None if failed or timeout
     """
+    start = datetime.now()
+    delay = state.latencies.estimate(replica.channel_in, replica.channel_out, payload_size(data), state.params["hedge_percentile"])
+    if (delay is None) or ((timeout > 0) and (delay >= timeout)):
+        result = None
+        try:
+            result = _make_prediction(state, data, replica.channel_out, replica.channel_in, timeout)
+        finally:
+            release_replica(state, replica, start, result is not None)
+        return result
+
+    envelope = uses_envelope(state)
+    header = request_header(timeout) if envelope else None
+    request_id = None if header is None else header[HEADER_ID]
+    staged_header, staged_data = stage_payload(state, header, data) if envelope else (None, data)
+    messages = queue.Queue()
+    subscriptions = []
+    locks = []
+    sent = dict()
+    hedge = None
+    winner = None
+
+    def anon_send(target: Replica) -> bool:
+        if not envelope:
+            lock = channel_lock(target.channel_in, target.channel_out)
+            # the duplicate request only gets sent if the replica is idle
+            if target is replica:
+                acquired = lock.acquire(timeout=-1 if timeout <= 0 else timeout)
+            else:
+                acquired = lock.acquire(blocking=False)
+            if not acquired:
+                return False
+            locks.append(lock)
+        subscriptions.append(subscribe(state, target.channel_out, request_id=request_id, messages=messages, tag=target))
+        if envelope:
+            publish_envelope(state, target.channel_in, staged_header, staged_data)
+        else:
+            state.connection.publish(target.channel_in, data)
+        sent[target] = datetime.now()
+        return True
+
+    try:
+        if not anon_send(replica):
+            log_message(state, "Timeout reached waiting for channel %s!" % replica.channel_in, error=True)
+            return None
+        try:
+            remaining = remaining_time(start, timeout)
+            winner, result = messages.get(timeout=delay if remaining is None else min(delay, remaining))
+        except queue.Empty:
+            hedge = state.replicas.acquire(exclude=[replica])
+            if hedge is not None:
+                if anon_send(hedge):
+                    log_message(state, "Sent duplicate request to %s:%s after %0.3f seconds" % (hedge.channel_in, hedge.channel_out, delay))
+                else:
+                    state.replicas.discard(hedge)
+                    hedge = None
+            try:
+                winner, result = messages.get(timeout=remaining_time(start, timeout))
+            except queue.Empty:
+                log_message(state, "Timeout reached!", error=True)
+                return None
+    finally:
+        for pubsub, thread, _ in subscriptions:
+            unsubscribe(pubsub, thread)
+        for lock in locks:
+            lock.release()
+        if envelope:
+            release_payload(state, staged_header)
+        release_replica(state, replica, sent.get(replica, start), winner is replica)
+        if hedge is not None:
+            # sending the duplicate may have failed before it got recorded
+            if hedge in sent:
+                release_replica(state, hedge, sent[hedge], winner is hedge)
+            else:
+                state.replicas.discard(hedge)
+        if envelope:
+            for target in sent:
+                if target is not winner:
+                    cancel_request(state, target.channel_in, request_id)
+
+    if envelope:
+        result = open_envelope(state, result)
+        if result is None:
+            return None
+    record_channel_latency(state, winner.channel_in, winner.channel_out, data, sent[winner])
+    log_message(state, "Time for prediction (%s:%s): %0.3f seconds" % (winner.channel_in, winner.channel_out, (datetime.now() - sent[winner]).total_seconds()))
+    return result
+
+
+def parse_channel_pairs(pairs: List[str]) -> List[Tuple[str, str]]:
+    """
+    Parses the channel pairs of format "in:out".
+
+    :param pairs: the channel pairs to parse
+    :type pairs: list
+    :return: the list of (channel_in, channel_out) tuples
+    :rtype: list
+    """
+    result = []
+    for pair in pairs:
+        parts = pair.split(":")
+        if (len(parts) != 2) or (len(parts[0]) == 0) or (len(parts[1]) == 0):
+            raise Exception("Invalid channel pair, expected format 'in:out': %s" % pair)
+        result.append((parts[0], parts[1]))
+    return result
+
+
+def make_predictions(state: State, data, channels: List[Tuple[str, str]]) -> List[Tuple[Any, float]]:
+    """
+    Makes predictions by broadcasting the data to several models concurrently and waiting
+    for their results, using a shared deadline (the state's timeout).
+
+    :param state: the state to use to broadcasting/listening
+    :type state: State
+    :param data: the data to send
+    :param channels: the list of (channel_in, channel_out) tuples of the models
+    :type channels: list
+    :return: the list of received data (None if failed or timeout) and the time in seconds, one tuple per model
+    :rtype: list
+    """
+    start = datetime.now()
+    priority = current_priority()
+
+    def anon_predict(channel):
+        timeout = remaining_time(start, state.timeout)
+        with request_priority(priority):
+            result = make_prediction(state, data, channel_in=channel[0], channel_out=channel[1], timeout=0.0 if timeout is None else max(timeout, 0.001))
+        return result, (datetime.now() - start).total_seconds()
+
+    with ThreadPoolExecutor(max_workers=len(channels)) as executor:
+        return list(executor.map(anon_predict, channels))
+
+
+def stream_prediction(state: State, data, channel_out: str = None, channel_in: str = None) -> Iterator:
+    """
+    Makes a prediction by broadcasting the data and then yields the messages coming through,
+    until the caller stops iterating or no message arrived within the timeout.
+    The timeout applies to the gap between consecutive messages rather than the whole response,
+    hence streamed responses always use the state's timeout rather than an adaptive one and
+    do not contribute to the latencies; they do not get recorded either (see gifr.record).
+    If no channels are specified, the channels of the request's priority class get used
+    (see request_priority), otherwise a replica gets picked if the state has replicas.
+    Raises Rejected if the state uses admission control and the request did not get admitted.
+
+    :param state: the state to use to broadcasting/listening
+    :type state: State
+    :param data: the data to send
+    :param channel_out: for overriding the state's out channel
+    :type channel_out: str
+    :param channel_in: for overriding the state's in channel
+    :type channel_in: str
+    :return: the iterator over the received data
+    """
+    priority = current_priority()
+    start = datetime.now()
+    count = 0
+    with admitted(state, priority):
+        try:
+            if (channel_out is None) and (channel_in is None):
+                lane = lane_channels(state, priority)
+                if lane is not None:
+                    channel_in, channel_out = lane
+            for result in _stream_prediction(state, data, channel_out=channel_out, channel_in=channel_in):
+                count += 1
+                yield result
+        finally:
+            record_latency(state, priority, start, count > 0)
+
+
+def _stream_prediction(state: State, data, channel_out: str = None, channel_in: str = None) -> Iterator:
+    """
+    Makes a prediction by broadcasting the data and then yields the messages coming through.
+
+    :param state: the state to use to broadcasting/listening
+    :type state: State
+    :param data: the data to send
+    :param channel_out: for overriding the state's out channel
+    :type channel_out: str
+    :param channel_in: for overriding the state's in channel
+    :type channel_in: str
+    :return: the iterator over the received data
+    """
+    replica = None
+    if (channel_out is None) and (channel_in is None) and (state.replicas is not None):
+        replica = state.replicas.acquire()
+        channel_in = replica.channel_in
+        channel_out = replica.channel_out
     if channel_out is None:
         channel_out = state.channel_out
     if channel_in is None:
         channel_in = state.channel_in
 
-    def anon_handler(message):
-        data = message['data']
-        state.data = data
-        state.pubsub_thread.stop()
-        state.pubsub.close()
-        state.pubsub = None
-
-    state.pubsub = state.connection.pubsub()
-    state.pubsub.psubscribe(**{channel_out: anon_handler})
-    state.pubsub_thread = state.pubsub.run_in_thread(sleep_time=state.sleep_time)
-    state.connection.publish(channel_in, data)
-
-    # wait for data to show up
+    envelope = uses_envelope(state)
+    header = None
+    completed = False
+    if envelope:
+        lock = None
+        header = request_header(state.timeout)
+        staged_header, staged_data = stage_payload(state, header, data)
+    else:
+        lock = channel_lock(channel_in, channel_out)
+        with span("wait for channel"):
+            acquired = lock.acquire(timeout=-1 if state.timeout <= 0 else state.timeout)
+        if not acquired:
+            if replica is not None:
+                state.replicas.discard(replica)
+            log_message(state, "Timeout reached waiting for channel %s!" % channel_in, error=True)
+            raise Exception("Timeout reached waiting for channel %s!" % channel_in)
+    pubsub, thread, messages = subscribe(state, channel_out, request_id=None if header is None else header[HEADER_ID])
     start = datetime.now()
-    end = start
-    no_data = False
-    while state.pubsub is not None:
-        sleep(0.01)
-        end = datetime.now()
-        if state.timeout > 0:
-            if (end - start).total_seconds() >= state.timeout:
-                msg = "Timeout reached!"
-                if state.logger is None:
-                    print(msg)
-                else:
-                    state.logger.error(msg)
-                no_data = True
-                break
+    count = 0
+    try:
+        with span("publish", size=payload_size(data)):
+            if envelope:
+                publish_envelope(state, channel_in, staged_header, staged_data)
+            else:
+                state.connection.publish(channel_in, data)
+        while not completed:
+            try:
+                with span("model", channel=channel_in, message=count):
+                    result = messages.get(timeout=state.timeout if state.timeout > 0 else None)
+            except queue.Empty:
+                log_message(state, "Timeout reached after %d message(s)!" % count, error=True)
+                return
+            count += 1
+            if envelope:
+                completed = result[0].get(HEADER_END, False)
+                result = open_envelope(state, result)
+                if result is None:
+                    return
+                if completed and (len(result) == 0):
+                    break
+            yield result
+    finally:
+        unsubscribe(pubsub, thread)
+        if lock is not None:
+            lock.release()
+        if envelope:
+            release_payload(state, staged_header)
+        # the caller stopped listening or timed out before the model flagged the end
+        if envelope and not completed:
+            cancel_request(state, channel_in, header[HEADER_ID])
+        if replica is not None:
+            release_replica(state, replica, start, count > 0)
+        log_message(state, "Time for streamed prediction (%d message(s)): %0.3f seconds" % (count, (datetime.now() - start).total_seconds()))
 
-    if no_data:
-        return None
-    else:
-        msg = "Time for prediction: %0.3f seconds" % (end - start).total_seconds()
-        if state.logger is None:
-            print(msg)
-        else:
-            state.logger.info(msg)
-        return state.data
+
+def ordered_chunks(state: State, messages: Iterator, seq_field: str = "seq", end_field: str = "end") -> Iterator[dict]:
+    """
+    Parses the JSON messages of a streamed response (see stream_prediction) and yields
+    them in the order of their sequence numbers, stopping after the message that is flagged
+    as the last one. Out-of-order messages get buffered, duplicates and unparseable ones
+    are skipped. Messages without sequence number are used in order of arrival.
+
+    :param state: the state with the logger
+    :type state: State
+    :param messages: the iterator over the raw messages
+    :param seq_field: the name of the field with the sequence number
+    :type seq_field: str
+    :param end_field: the name of the field that flags the last message
+    :type end_field: str
+    :return: the iterator over the parsed messages
+    """
+    chunks = dict()
+    next_seq = 0
+    try:
+        for data in messages:
+            try:
+                d = json.loads(data.decode())
+            except:
+                log_message(state, "Failed to parse chunk: %s" % str(data), error=True)
+                continue
+            seq = d.get(seq_field, next_seq)
+            if seq < next_seq:
+                log_message(state, "Ignoring duplicate chunk #%d" % seq)
+                continue
+            chunks[seq] = d
+            while next_seq in chunks:
+                d = chunks.pop(next_seq)
+                next_seq += 1
+                yield d
+                if d.get(end_field, False):
+                    return
+        if next_seq > 0:
+            log_message(state, "Stream incomplete, received %d chunk(s), buffered: %s" % (next_seq, str(sorted(chunks.keys()))), error=True)
+    finally:
+        if hasattr(messages, "close"):
+            messages.close()
@@ -0,0 +1,160 @@
+import threading
+import time
+import zlib
+
+from typing import Optional, Tuple, Union
+
+
+CODEC_ZSTD = "zstd"
+CODEC_LZ4 = "lz4"
+CODEC_ZLIB = "zlib"
+CODECS = [
+    CODEC_ZSTD,
+    CODEC_LZ4,
+    CODEC_ZLIB,
+]
+
+
+def compress(codec: str, data: bytes, level: int = None) -> bytes:
+    """
+    Compresses the data.
+
+    :param codec: the codec to use, see CODECS
+    :type codec: str
+    :param data: the data to compress
+    :type data: bytes
+    :param level: the compression level, uses the codec's default if None
+    :type level: int
+    :return: the compressed data
+    :rtype: bytes
+    """
+    if codec == CODEC_ZSTD:
+        import zstandard
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    elif codec == CODEC_LZ4:
+        import lz4.frame
+        return lz4.frame.compress(data, compression_level=0 if level is None else level)
+    elif codec == CODEC_ZLIB:
+        return zlib.compress(data, -1 if level is None else level)
+    else:
+        raise Exception("Unhandled codec: %s" % codec)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    """
+    Decompresses the data.
+
+    :param codec: the codec that was used, see CODECS
+    :type codec: str
+    :param data: the data to decompress
+    :type data: bytes
+    :return: the decompressed data
+    :rtype: bytes
+    """
+    if codec == CODEC_ZSTD:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec == CODEC_LZ4:
+        import lz4.frame
+        return lz4.frame.decompress(data)
+    elif codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    else:
+        raise Exception("Unhandled codec: %s" % codec)
+
+
+def check_codec(codec: str):
+    """
+    Ensures that the library for the codec is available.
+
+    :param codec: the codec to check, see CODECS
+    :type codec: str
+    """
+    if codec not in CODECS:
+        raise Exception("Invalid codec (%s): %s" % ("|".join(CODECS), codec))
+    try:
+        compress(codec, b"")
+    except ImportError:
+        raise Exception("Library for codec '%s' not installed, e.g., use: pip install gifr[%s]" % (codec, codec))
+
+
+class Compressor:
+    """
+    Compresses payloads above a size threshold and keeps track of the compression
+    ratio and the CPU time spent on compression and decompression.
+    """
+
+    def __init__(self, codec: str, threshold: int = 16384, level: int = None):
+        """
+        Initializes the compressor.
+
+        :param codec: the codec to use, see CODECS
+        :type codec: str
+        :param threshold: the size in bytes above which to compress payloads
+        :type threshold: int
+        :param level: the compression level, uses the codec's default if None
+        :type level: int
+        """
+        check_codec(codec)
+        self.codec = codec
+        self.threshold = threshold
+        self.level = level
+        self.compressed = 0
+        self.decompressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_time = 0.0
+        self._lock = threading.Lock()
+
+    def compress(self, payload: Union[bytes, str]) -> Tuple[Optional[str], bytes]:
+        """
+        Compresses the payload if it exceeds the threshold and compression actually reduces its size.
+
+        :param payload: the payload to compress
+        :return: the tuple of codec (None if not compressed) and payload
+        :rtype: tuple
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if len(payload) <= self.threshold:
+            return None, payload
+        start = time.thread_time()
+        result = compress(self.codec, payload, level=self.level)
+        with self._lock:
+            self.cpu_time += time.thread_time() - start
+            if len(result) >= len(payload):
+                return None, payload
+            self.compressed += 1
+            self.bytes_in += len(payload)
+            self.bytes_out += len(result)
+        return self.codec, result
+
+    def decompress(self, codec: str, payload: bytes) -> bytes:
+        """
+        Decompresses the payload.
+
+        :param codec: the codec that was used, see CODECS
+        :type codec: str
+        :param payload: the payload to decompress
+        :type payload: bytes
+        :return: the decompressed payload
+        :rtype: bytes
+        """
+        start = time.thread_time()
+        result = decompress(codec, payload)
+        with self._lock:
+            self.cpu_time += time.thread_time() - start
+            self.decompressed += 1
+        return result
+
+    def stats(self) -> str:
+        """
+        Returns the statistics.
+
+        :return: the statistics
+        :rtype: str
+        """
+        with self._lock:
+            ratio = self.bytes_in / self.bytes_out if self.bytes_out > 0 else 1.0
+            return "%s: compressed=%d (%d -> %d bytes, ratio=%0.2f), decompressed=%d, cpu=%0.3fs" % (
+                self.codec, self.compressed, self.bytes_in, self.bytes_out, ratio, self.decompressed, self.cpu_time)
@@ -0,0 +1,138 @@
+import json
+import struct
+import time
+import uuid
+
+from typing import Optional, Tuple, Union
+
+
+MAGIC = b"GIFR\x01"
+""" the bytes that every envelope starts with. """
+
+CANCEL_SUFFIX = "_cancel"
+""" the suffix of the in channel that cancel notices get published on. """
+
+HEADER_ID = "id"
+""" the request ID, replies carry the ID of the request. """
+
+HEADER_DEADLINE = "deadline"
+""" the absolute deadline (seconds since the epoch) after which no one waits for the reply anymore. """
+
+HEADER_CANCEL = "cancel"
+""" flags a cancel notice for the request with the ID. """
+
+HEADER_END = "end"
+""" flags the last reply of a streamed response. """
+
+HEADER_REF = "ref"
+""" the redis key that the actual payload is stored under (claim check), see gifr.offload. """
+
+HEADER_SHM = "shm"
+""" the path, size and checksum of the shared memory file containing the actual payload, see gifr.shm. """
+
+HEADER_CODEC = "codec"
+""" the codec the payload is compressed with, see gifr.compression. """
+
+HEADER_ACCEPT = "accept"
+""" the list of codecs that the replies can be compressed with. """
+
+_LENGTH = struct.Struct(">I")
+
+
+def pack(header: dict, payload: Union[bytes, str] = b"") -> bytes:
+    """
+    Wraps the payload in an envelope: the magic bytes, the length of the header
+    (4 bytes, big endian), the header as JSON and then the payload.
+
+    :param header: the header to use
+    :type header: dict
+    :param payload: the payload to wrap, strings get encoded as UTF-8
+    :return: the envelope
+    :rtype: bytes
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    header = json.dumps(header).encode()
+    return MAGIC + _LENGTH.pack(len(header)) + header + payload
+
+
+def unpack(data: bytes) -> Optional[Tuple[dict, bytes]]:
+    """
+    Unwraps the envelope.
+
+    :param data: the data to unwrap
+    :type data: bytes
+    :return: the tuple of header and payload, None if not an envelope
+    :rtype: tuple
+    """
+    if not isinstance(data, bytes) or not data.startswith(MAGIC):
+        return None
+    start = len(MAGIC) + _LENGTH.size
+    if len(data) < start:
+        return None
+    length = _LENGTH.unpack_from(data, len(MAGIC))[0]
+    try:
+        header = json.loads(data[start:start + length].decode())
+    except Exception:
+        return None
+    if not isinstance(header, dict):
+        return None
+    return header, data[start + length:]
+
+
+def request_header(timeout: Optional[float]) -> dict:
+    """
+    Creates the header for a new request.
+
+    :param timeout: the number of seconds the caller waits for the reply, None or <=0 for no deadline
+    :type timeout: float
+    :return: the header with a new ID and the deadline (if any)
+    :rtype: dict
+    """
+    result = {HEADER_ID: uuid.uuid4().hex}
+    if (timeout is not None) and (timeout > 0):
+        result[HEADER_DEADLINE] = time.time() + timeout
+    return result
+
+
+def cancel_notice(request_id: str) -> bytes:
+    """
+    Creates the cancel notice for the request.
+
+    :param request_id: the ID of the request to cancel
+    :type request_id: str
+    :return: the envelope with the notice
+    :rtype: bytes
+    """
+    return pack({HEADER_ID: request_id, HEADER_CANCEL: True})
+
+
+def cancel_channel(channel_in: str) -> str:
+    """
+    Returns the channel that the cancel notices for requests sent to the specified channel get published on.
+
+    :param channel_in: the channel the requests get sent to
+    :type channel_in: str
+    :return: the cancel channel
+    :rtype: str
+    """
+    return channel_in + CANCEL_SUFFIX
+
+
+def is_expired(header: dict, now: float = None) -> bool:
+    """
+    Checks whether the deadline of the request has passed.
+
+    :param header: the header of the request
+    :type header: dict
+    :param now: the current time (seconds since the epoch), uses time.time() if None
+    :type now: float
+    :return: whether expired
+    :rtype: bool
+    """
+    deadline = header.get(HEADER_DEADLINE, None)
+    if deadline is None:
+        return False
+    if now is None:
+        now = time.time()
+    return now > deadline
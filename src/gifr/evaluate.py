@@ -0,0 +1,621 @@
+import argparse
+import csv
+import importlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from gifr.common import init_logging, set_logging_level, init_state, State, LOGGING_LEVELS, LOGGING_WARN
+
+PROG: str = "gifr-eval"
+
+_logger = logging.getLogger(PROG)
+
+TASK_OBJDET = "objdet"
+TASK_IMGSEG = "imgseg"
+TASK_IMGCLS = "imgcls"
+TASK_TEXTCLASS = "textclass"
+TASK_ASR = "asr"
+TASKS = {
+    TASK_OBJDET: "gifr.object_detection",
+    TASK_IMGSEG: "gifr.image_segmentation",
+    TASK_IMGCLS: "gifr.image_classification",
+    TASK_TEXTCLASS: "gifr.text_classification",
+    TASK_ASR: "gifr.asr",
+}
+""" the tasks and the modules of the interfaces that get used for sending the requests. """
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+AUDIO_EXTENSIONS = (".wav",)
+
+COCO_IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+""" the IoU thresholds that the COCO-style mAP gets averaged over. """
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Computes the IoU between all pairs of boxes.
+
+    :param a: the first set of boxes, (N, 4) with left, top, right, bottom
+    :type a: np.ndarray
+    :param b: the second set of boxes, (M, 4) with left, top, right, bottom
+    :type b: np.ndarray
+    :return: the IoU matrix, (N, M)
+    :rtype: np.ndarray
+    """
+    a = a[:, None, :]
+    b = b[None, :, :]
+    w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = w * h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
+
+
+def match_detections(pred_boxes: np.ndarray, pred_scores: np.ndarray, gt_boxes: np.ndarray, iou_thresholds: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Greedily matches the predictions (highest score first) with the ground truth boxes of one class in one image.
+
+    :param pred_boxes: the predicted boxes, (N, 4)
+    :type pred_boxes: np.ndarray
+    :param pred_scores: the scores of the predictions, (N,)
+    :type pred_scores: np.ndarray
+    :param gt_boxes: the ground truth boxes, (M, 4)
+    :type gt_boxes: np.ndarray
+    :param iou_thresholds: the IoU thresholds to match at, (T,)
+    :type iou_thresholds: np.ndarray
+    :return: the true positive flags (T, N) and the IoU of each prediction with its best ground truth box (N,)
+    :rtype: tuple
+    """
+    tp = np.zeros((len(iou_thresholds), len(pred_boxes)), dtype=bool)
+    if (len(pred_boxes) == 0) or (len(gt_boxes) == 0):
+        return tp, np.zeros(len(pred_boxes))
+    order = np.argsort(-pred_scores, kind="stable")
+    ious = box_iou(pred_boxes, gt_boxes)
+    taken = np.zeros((len(iou_thresholds), len(gt_boxes)), dtype=bool)
+    for i in order:
+        # best untaken ground truth box per threshold
+        candidates = np.where(taken, -1.0, ious[i][None, :])
+        best = np.argmax(candidates, axis=1)
+        best_iou = candidates[np.arange(len(iou_thresholds)), best]
+        hit = best_iou >= iou_thresholds
+        tp[hit, i] = True
+        taken[hit, best[hit]] = True
+    return tp, ious.max(axis=1)
+
+
+def average_precision(scores: np.ndarray, tp: np.ndarray, num_gt: int) -> np.ndarray:
+    """
+    Computes the average precision (area under the interpolated precision/recall curve).
+
+    :param scores: the scores of all predictions of the class, (N,)
+    :type scores: np.ndarray
+    :param tp: the true positive flags per IoU threshold, (T, N)
+    :type tp: np.ndarray
+    :param num_gt: the number of ground truth objects of the class
+    :type num_gt: int
+    :return: the average precision per IoU threshold, (T,)
+    :rtype: np.ndarray
+    """
+    if num_gt == 0:
+        return np.full(tp.shape[0], np.nan)
+    if len(scores) == 0:
+        return np.zeros(tp.shape[0])
+    order = np.argsort(-scores, kind="stable")
+    tp = tp[:, order]
+    tp_cum = np.cumsum(tp, axis=1)
+    fp_cum = np.cumsum(~tp, axis=1)
+    recall = tp_cum / num_gt
+    precision = tp_cum / (tp_cum + fp_cum)
+    # precision envelope, then area under the step function
+    precision = np.flip(np.maximum.accumulate(np.flip(precision, axis=1), axis=1), axis=1)
+    recall = np.concatenate([np.zeros((tp.shape[0], 1)), recall], axis=1)
+    return np.sum((recall[:, 1:] - recall[:, :-1]) * precision, axis=1)
+
+
+def detection_metrics(records: List[dict], iou_threshold: float) -> Dict[str, float]:
+    """
+    Computes mAP at the IoU threshold, COCO-style mAP (0.5:0.95) and the mean IoU of the true positives.
+
+    :param records: the records with predictions and ground truth per image
+    :type records: list
+    :param iou_threshold: the IoU threshold for the mAP
+    :type iou_threshold: float
+    :return: the metrics
+    :rtype: dict
+    """
+    thresholds = np.concatenate([[iou_threshold], COCO_IOU_THRESHOLDS])
+    scores = dict()
+    tps = dict()
+    num_gt = dict()
+    matched_ious = []
+    for record in records:
+        pred = record["pred"]
+        gt = record["gt"]
+        labels = set([x[0] for x in pred]) | set([x[0] for x in gt])
+        for label in labels:
+            pred_boxes = np.array([x[2:] for x in pred if x[0] == label], dtype=float).reshape((-1, 4))
+            pred_scores = np.array([x[1] for x in pred if x[0] == label], dtype=float)
+            gt_boxes = np.array([x[1:] for x in gt if x[0] == label], dtype=float).reshape((-1, 4))
+            tp, ious = match_detections(pred_boxes, pred_scores, gt_boxes, thresholds)
+            matched_ious.append(ious[tp[0]])
+            scores.setdefault(label, []).append(pred_scores)
+            tps.setdefault(label, []).append(tp)
+            num_gt[label] = num_gt.get(label, 0) + len(gt_boxes)
+    aps = []
+    for label in sorted(num_gt.keys()):
+        aps.append(average_precision(np.concatenate(scores[label]), np.concatenate(tps[label], axis=1), num_gt[label]))
+    if len(aps) == 0:
+        return {"mAP@%0.2f" % iou_threshold: 0.0, "mAP@[0.50:0.95]": 0.0, "mean IoU (TP)": 0.0}
+    aps = np.array(aps)
+    matched_ious = np.concatenate(matched_ious) if len(matched_ious) > 0 else np.zeros(0)
+    return {
+        "mAP@%0.2f" % iou_threshold: float(np.nanmean(aps[:, 0])),
+        "mAP@[0.50:0.95]": float(np.nanmean(aps[:, 1:])),
+        "mean IoU (TP)": float(matched_ious.mean()) if len(matched_ious) > 0 else 0.0,
+    }
+
+
+def confusion_counts(gt: np.ndarray, pred: np.ndarray, ignore_index: int = None) -> List[List[int]]:
+    """
+    Counts the (ground truth, predicted) class pairs of the pixels.
+
+    :param gt: the ground truth class indices
+    :type gt: np.ndarray
+    :param pred: the predicted class indices
+    :type pred: np.ndarray
+    :param ignore_index: the ground truth index to ignore, None to use all pixels
+    :type ignore_index: int
+    :return: the list of (ground truth, predicted, count) triplets
+    :rtype: list
+    """
+    gt = gt.astype(np.int64).ravel()
+    pred = pred.astype(np.int64).ravel()
+    if ignore_index is not None:
+        keep = gt != ignore_index
+        gt = gt[keep]
+        pred = pred[keep]
+    n = int(max(gt.max(initial=0), pred.max(initial=0))) + 1
+    counts = np.bincount(gt * n + pred, minlength=n * n)
+    nonzero = np.nonzero(counts)[0]
+    return [[int(i // n), int(i % n), int(counts[i])] for i in nonzero]
+
+
+def segmentation_metrics(records: List[dict]) -> Dict[str, float]:
+    """
+    Computes mean IoU and pixel accuracy from the confusion counts.
+
+    :param records: the records with the confusion counts per image
+    :type records: list
+    :return: the metrics
+    :rtype: dict
+    """
+    triplets = [np.array(r["counts"], dtype=np.int64).reshape((-1, 3)) for r in records]
+    triplets = np.concatenate(triplets) if len(triplets) > 0 else np.zeros((0, 3), dtype=np.int64)
+    if len(triplets) == 0:
+        return {"mean IoU": 0.0, "pixel accuracy": 0.0}
+    n = int(triplets[:, :2].max()) + 1
+    matrix = np.zeros((n, n), dtype=np.int64)
+    np.add.at(matrix, (triplets[:, 0], triplets[:, 1]), triplets[:, 2])
+    inter = np.diag(matrix)
+    union = matrix.sum(axis=0) + matrix.sum(axis=1) - inter
+    present = union > 0
+    return {
+        "mean IoU": float(np.mean(inter[present] / union[present])),
+        "pixel accuracy": float(inter.sum() / matrix.sum()),
+    }
+
+
+def classification_metrics(records: List[dict]) -> Dict[str, float]:
+    """
+    Computes accuracy and macro-averaged F1.
+
+    :param records: the records with actual and predicted label per sample
+    :type records: list
+    :return: the metrics
+    :rtype: dict
+    """
+    if len(records) == 0:
+        return {"accuracy": 0.0, "macro F1": 0.0}
+    labels = sorted(set([r["label"] for r in records]) | set([r["prediction"] for r in records]))
+    index = {label: i for i, label in enumerate(labels)}
+    actual = np.array([index[r["label"]] for r in records])
+    predicted = np.array([index[r["prediction"]] for r in records])
+    matrix = np.bincount(actual * len(labels) + predicted, minlength=len(labels) ** 2).reshape((len(labels), len(labels)))
+    tp = np.diag(matrix)
+    support = matrix.sum(axis=1)
+    predicted_count = matrix.sum(axis=0)
+    f1 = np.where(support + predicted_count > 0, 2 * tp / np.maximum(support + predicted_count, 1), 0.0)
+    # macro average over the actual labels
+    return {
+        "accuracy": float(tp.sum() / len(records)),
+        "macro F1": float(f1[support > 0].mean()),
+    }
+
+
+def normalize_text(text: str) -> List[str]:
+    """
+    Lower-cases the text, removes punctuation and splits it into words.
+
+    :param text: the text to normalize
+    :type text: str
+    :return: the words
+    :rtype: list
+    """
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_errors(reference: List[str], hypothesis: List[str]) -> int:
+    """
+    Computes the word-level edit distance (substitutions, deletions and insertions).
+
+    :param reference: the reference words
+    :type reference: list
+    :param hypothesis: the recognized words
+    :type hypothesis: list
+    :return: the number of errors
+    :rtype: int
+    """
+    if len(reference) == 0:
+        return len(hypothesis)
+    ref = np.array(reference, dtype=object)
+    offsets = np.arange(len(ref) + 1)
+    row = offsets.copy()
+    for i, word in enumerate(hypothesis, start=1):
+        cost = (ref != word).astype(np.int64)
+        new = np.empty_like(row)
+        new[0] = i
+        new[1:] = np.minimum(row[1:] + 1, row[:-1] + cost)
+        # insertions along the row: new[j] = min(new[k] + j - k) for k <= j
+        row = np.minimum.accumulate(new - offsets) + offsets
+    return int(row[-1])
+
+
+def wer_metrics(records: List[dict]) -> Dict[str, float]:
+    """
+    Computes the corpus-level word error rate.
+
+    :param records: the records with errors and reference words per sample
+    :type records: list
+    :return: the metrics
+    :rtype: dict
+    """
+    errors = np.array([r["errors"] for r in records], dtype=np.int64)
+    words = np.array([r["words"] for r in records], dtype=np.int64)
+    return {
+        "WER": float(errors.sum() / max(words.sum(), 1)),
+        "sentence error rate": float(np.mean(errors > 0)) if len(records) > 0 else 0.0,
+    }
+
+
+def load_samples(task: str, dataset: str, annotations: str, text_column: str = "text", label_column: str = "label") -> List[Tuple[str, str, str]]:
+    """
+    Determines the samples of the dataset.
+
+    :param task: the task, see TASKS
+    :type task: str
+    :param dataset: the directory with the images/audio files (or sub-directories per label for imgcls), the CSV file for textclass
+    :type dataset: str
+    :param annotations: the directory with the OPEX JSON files (objdet), masks (imgseg) or transcripts (asr)
+    :type annotations: str
+    :param text_column: the column with the texts (textclass)
+    :type text_column: str
+    :param label_column: the column with the labels (textclass)
+    :type label_column: str
+    :return: the list of (ID, input, target) tuples
+    :rtype: list
+    """
+    result = []
+    if task == TASK_TEXTCLASS:
+        with open(dataset, "r", newline="") as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                result.append((str(i), row[text_column], row[label_column]))
+        return result
+
+    if task == TASK_IMGCLS:
+        for label in sorted(os.listdir(dataset)):
+            path = os.path.join(dataset, label)
+            if not os.path.isdir(path):
+                continue
+            for f in sorted(os.listdir(path)):
+                if f.lower().endswith(IMAGE_EXTENSIONS):
+                    result.append((label + "/" + f, os.path.join(path, f), label))
+        return result
+
+    extensions = AUDIO_EXTENSIONS if (task == TASK_ASR) else IMAGE_EXTENSIONS
+    target_ext = {TASK_OBJDET: ".json", TASK_IMGSEG: ".png", TASK_ASR: ".txt"}[task]
+    for f in sorted(os.listdir(dataset)):
+        if not f.lower().endswith(extensions):
+            continue
+        path = os.path.join(dataset, f)
+        target = os.path.join(annotations, os.path.splitext(f)[0] + target_ext)
+        if os.path.abspath(target) == os.path.abspath(path):
+            continue
+        if not os.path.exists(target):
+            _logger.warning("No annotation for %s, skipping: %s" % (f, target))
+            continue
+        result.append((f, path, target))
+    return result
+
+
+def evaluate_sample(task: str, module, state: State, sample: Tuple[str, str, str], ignore_index: int = None) -> dict:
+    """
+    Sends the sample through the client code of the task's interface and turns
+    the prediction and the target into the record that the metrics get computed from.
+
+    :param task: the task, see TASKS
+    :type task: str
+    :param module: the module of the task's interface
+    :param state: the state to use for the requests
+    :type state: State
+    :param sample: the (ID, input, target) tuple
+    :type sample: tuple
+    :param ignore_index: the ground truth index to ignore in the masks (imgseg), None to use all pixels
+    :type ignore_index: int
+    :return: the record
+    :rtype: dict
+    """
+    sample_id, source, target = sample
+    result = {"id": sample_id}
+    start = time.perf_counter()
+    if task == TASK_TEXTCLASS:
+        label, score = module.classify(state, source)
+        result["label"] = target
+        result["prediction"] = label
+    elif task == TASK_IMGCLS:
+        with open(source, "rb") as f:
+            probs = module.classify(state, f.read())
+        result["label"] = target
+        result["prediction"] = max(probs.keys(), key=lambda x: probs[x])
+    elif task == TASK_OBJDET:
+        from opex import ObjectPredictions
+        with open(source, "rb") as f:
+            preds = module.detect(state, f.read(), os.path.basename(source))
+        with open(target, "r") as f:
+            gt = ObjectPredictions.from_json_string(f.read())
+        result["pred"] = [[o.label, o.score if isinstance(o.score, (int, float)) else 1.0,
+                           o.bbox.left, o.bbox.top, o.bbox.right, o.bbox.bottom] for o in preds.objects]
+        result["gt"] = [[o.label, o.bbox.left, o.bbox.top, o.bbox.right, o.bbox.bottom] for o in gt.objects]
+    elif task == TASK_IMGSEG:
+        from PIL import Image
+        with open(source, "rb") as f:
+            mask = module.request_mask(state, f.read())
+        gt = np.asarray(Image.open(target))
+        if mask is None:
+            pred = np.zeros(gt.shape, dtype=np.int64)
+        else:
+            pred = np.asarray(module.to_indexed(state, mask)[0])
+        if pred.shape != gt.shape:
+            raise Exception("Predicted mask has shape %s, but ground truth %s: %s" % (str(pred.shape), str(gt.shape), sample_id))
+        result["counts"] = confusion_counts(gt, pred, ignore_index=ignore_index)
+    elif task == TASK_ASR:
+        from scipy.io.wavfile import read
+        with open(target, "r") as f:
+            reference = normalize_text(f.read())
+        transcript = module.transcribe_audio(state, read(source))
+        hypothesis = normalize_text(transcript if transcript is not None else "")
+        result["errors"] = word_errors(reference, hypothesis)
+        result["words"] = len(reference)
+    else:
+        raise Exception("Unhandled task: %s" % task)
+    result["latency"] = time.perf_counter() - start
+    return result
+
+
+def compute_metrics(task: str, records: List[dict], iou_threshold: float = 0.5) -> Dict[str, float]:
+    """
+    Computes the quality metrics of the task.
+
+    :param task: the task, see TASKS
+    :type task: str
+    :param records: the records of the samples
+    :type records: list
+    :param iou_threshold: the IoU threshold for the mAP (objdet)
+    :type iou_threshold: float
+    :return: the metrics
+    :rtype: dict
+    """
+    if task == TASK_OBJDET:
+        return detection_metrics(records, iou_threshold)
+    elif task == TASK_IMGSEG:
+        return segmentation_metrics(records)
+    elif task in [TASK_IMGCLS, TASK_TEXTCLASS]:
+        return classification_metrics(records)
+    elif task == TASK_ASR:
+        return wer_metrics(records)
+    else:
+        raise Exception("Unhandled task: %s" % task)
+
+
+def load_checkpoint(path: str) -> List[dict]:
+    """
+    Loads the records of the samples that have already been evaluated.
+
+    :param path: the checkpoint file (JSON lines)
+    :type path: str
+    :return: the records
+    :rtype: list
+    """
+    result = []
+    if not os.path.exists(path):
+        return result
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                result.append(json.loads(line))
+            except Exception:
+                # incomplete last line of an interrupted run
+                continue
+    return result
+
+
+def evaluate(task: str, state: State, samples: List[Tuple[str, str, str]], workers: int = 8,
+             checkpoint: str = None, ignore_index: int = None, progress: int = 100) -> Tuple[List[dict], int, float]:
+    """
+    Evaluates the samples concurrently, skipping the ones already in the checkpoint.
+
+    :param task: the task, see TASKS
+    :type task: str
+    :param state: the state to use for the requests
+    :type state: State
+    :param samples: the (ID, input, target) tuples
+    :type samples: list
+    :param workers: the maximum number of requests in flight
+    :type workers: int
+    :param checkpoint: the file to append the records to and to resume from, None for no checkpointing
+    :type checkpoint: str
+    :param ignore_index: the ground truth index to ignore in the masks (imgseg), None to use all pixels
+    :type ignore_index: int
+    :param progress: the number of samples after which to log the progress
+    :type progress: int
+    :return: the records of all samples, the number of samples evaluated in this run and the duration
+    :rtype: tuple
+    """
+    module = importlib.import_module(TASKS[task])
+    records = load_checkpoint(checkpoint) if checkpoint is not None else []
+    done = set([r["id"] for r in records])
+    if len(done) > 0:
+        _logger.info("Resuming from checkpoint with %d sample(s)" % len(done))
+    todo = [s for s in samples if s[0] not in done]
+    lock = threading.Lock()
+    out = open(checkpoint, "a") if checkpoint is not None else None
+    evaluated = [0]
+
+    def process(sample: Tuple[str, str, str]):
+        try:
+            record = evaluate_sample(task, module, state, sample, ignore_index=ignore_index)
+        except Exception:
+            _logger.exception("Failed to evaluate: %s" % sample[0])
+            return
+        with lock:
+            records.append(record)
+            evaluated[0] += 1
+            if out is not None:
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+            if (progress > 0) and (evaluated[0] % progress == 0):
+                _logger.info("%d/%d evaluated" % (evaluated[0], len(todo)))
+
+    start = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(process, todo))
+    finally:
+        if out is not None:
+            out.close()
+    return records, evaluated[0], time.monotonic() - start
+
+
+def add_evaluation_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the options for the evaluation to the parser.
+
+    :param parser: the parser to extend
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--task", choices=sorted(TASKS.keys()), help="The task to evaluate, determines which interface's options and client code get used.", required=True)
+    parser.add_argument("--dataset", metavar="PATH", help="The directory with the images/audio files (sub-directories per label for imgcls) or the CSV file (textclass).", type=str, required=True)
+    parser.add_argument("--annotations", metavar="DIR", help="The directory with the OPEX JSON files (objdet), the indexed PNG masks (imgseg) or the .txt transcripts (asr), named like the input files; uses the dataset directory if not provided.", default=None, type=str, required=False)
+    parser.add_argument("--text_column", metavar="COL", help="The column in the CSV file with the texts (textclass).", default="text", type=str, required=False)
+    parser.add_argument("--label_column", metavar="COL", help="The column in the CSV file with the labels (textclass).", default="label", type=str, required=False)
+    parser.add_argument("--iou_threshold", metavar="NUM", help="The IoU threshold for the mAP (objdet).", default=0.5, type=float, required=False)
+    parser.add_argument("--ignore_index", metavar="INDEX", help="The index in the ground truth masks to ignore (imgseg).", default=None, type=int, required=False)
+    parser.add_argument("--workers", metavar="NUM", help="The maximum number of requests in flight (use --envelope or --replicas for concurrent requests).", default=8, type=int, required=False)
+    parser.add_argument("--checkpoint", metavar="FILE", help="The JSON lines file to record the evaluated samples in; an interrupted evaluation resumes from it.", default=None, type=str, required=False)
+    parser.add_argument("--progress", metavar="NUM", help="The number of samples after which to log the progress.", default=100, type=int, required=False)
+    parser.add_argument("--output_file", metavar="FILE", help="The JSON file to write the metrics to.", default=None, type=str, required=False)
+
+
+def create_argparser(task: str = None) -> argparse.ArgumentParser:
+    """
+    Creates the parser for the command-line options. With a task, the options of the task's interface get included.
+
+    :param task: the task to include the interface options for, see TASKS
+    :type task: str
+    :return: the parser
+    :rtype: argparse.ArgumentParser
+    """
+    description = "Evaluates a model through the client code of the corresponding gifr interface, " \
+                  + "reporting quality (mAP, mean IoU, accuracy/F1, WER) and throughput. " \
+                  + "Also accepts the options of the interface of the task (channels, timeout, etc.)."
+    if task is None:
+        parser = argparse.ArgumentParser(description=description, prog=PROG, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        add_evaluation_arguments(parser)
+        parser.add_argument("--logging_level", choices=LOGGING_LEVELS, default=LOGGING_WARN, help="The logging level to use")
+    else:
+        parser = importlib.import_module(TASKS[task]).create_argparser()
+        parser.prog = PROG
+        parser.description = description
+        add_evaluation_arguments(parser)
+    return parser
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    init_logging()
+    task_parser = argparse.ArgumentParser(add_help=False)
+    task_parser.add_argument("--task", choices=sorted(TASKS.keys()), default=None)
+    task = task_parser.parse_known_args(args=args)[0].task
+    parser = create_argparser(task)
+    parsed = parser.parse_args(args=args)
+    set_logging_level(_logger, parsed.logging_level)
+    module = importlib.import_module(TASKS[task])
+    state = init_state(parsed)
+    module.post_init_state(state)
+
+    annotations = parsed.annotations if parsed.annotations is not None else parsed.dataset
+    samples = load_samples(task, parsed.dataset, annotations, text_column=parsed.text_column, label_column=parsed.label_column)
+    records, evaluated, seconds = evaluate(task, state, samples, workers=parsed.workers, checkpoint=parsed.checkpoint,
+                                           ignore_index=parsed.ignore_index, progress=parsed.progress)
+    ids = set([s[0] for s in samples])
+    records = [r for r in records if r["id"] in ids]
+    metrics = compute_metrics(task, records, iou_threshold=parsed.iou_threshold)
+    latencies = [r["latency"] for r in records]
+    metrics["samples"] = len(records)
+    metrics["failed"] = len(samples) - len(records)
+    metrics["throughput"] = evaluated / seconds if seconds > 0 else 0.0
+    if len(latencies) > 0:
+        for q in [50, 95, 99]:
+            metrics["latency p%d" % q] = float(np.percentile(latencies, q))
+
+    for k, v in metrics.items():
+        print("%s: %s" % (k, ("%0.4f" % v) if isinstance(v, float) else str(v)))
+    if parsed.output_file is not None:
+        with open(parsed.output_file, "w") as f:
+            json.dump(metrics, f, indent=2)
+
+
+def sys_main() -> int:
+    """
+    Runs the main function using the system cli arguments, and
+    returns a system error code.
+
+    :return: 0 for success, 1 for failure.
+    """
+    try:
+        main()
+        return 0
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == '__main__':
+    main()
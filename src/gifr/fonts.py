@@ -1,18 +1,139 @@
 # taken from:
 # https://github.com/waikato-ufdl/wai-annotations-imgvis/blob/6d7d29353311178a98cbd2df67e445a752245f8c/src/wai/annotations/imgvis/isp/annotation_overlay/component/_fonts.py
 
+import json
+import os
+import subprocess
+import threading
 import traceback
 
-from matplotlib import font_manager
+from typing import Optional
+
 from PIL import ImageFont
 
 
 DEFAULT_FONT_FAMILY = "sans\\-serif"
 
+ENV_GIFR_FONT_CACHE = "GIFR_FONT_CACHE"
+""" environment variable for the file that caches the font files per family. """
+
+_cache_lock = threading.Lock()
+
+_fonts = dict()
+""" the fonts loaded by the process, per family and size. """
+
+
+def font_cache_file() -> str:
+    """
+    Returns the file that caches the font files per family.
+
+    :return: the cache file
+    :rtype: str
+    """
+    if os.getenv(ENV_GIFR_FONT_CACHE) is not None:
+        return os.getenv(ENV_GIFR_FONT_CACHE)
+    cache_dir = os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_dir, "gifr", "fonts.json")
+
+
+def _load_cache() -> dict:
+    """
+    Loads the cached font files per family.
+
+    :return: the cache, empty if not available
+    :rtype: dict
+    """
+    try:
+        with open(font_cache_file(), "r") as f:
+            result = json.load(f)
+        return result if isinstance(result, dict) else dict()
+    except Exception:
+        return dict()
+
+
+def _store_cache(family: str, font_file: str):
+    """
+    Adds the font file of the family to the cache, ignoring any errors (e.g., read-only file system).
+
+    :param family: the font family
+    :type family: str
+    :param font_file: the font file
+    :type font_file: str
+    """
+    with _cache_lock:
+        cache = _load_cache()
+        cache[family] = font_file
+        path = font_cache_file()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp, "w") as f:
+                json.dump(cache, f, indent=2)
+            os.replace(tmp, path)
+        except Exception:
+            pass
+
+
+def _fc_match(family: str) -> Optional[str]:
+    """
+    Determines the font file for the family using fontconfig's fc-match,
+    which uses the same pattern syntax as matplotlib's font_manager.
+
+    :param family: the font family
+    :type family: str
+    :return: the font file, None if fc-match is not available or failed
+    :rtype: str
+    """
+    try:
+        result = subprocess.run(["fc-match", "--format=%{file}", family], capture_output=True, text=True, timeout=10)
+    except Exception:
+        return None
+    font_file = result.stdout.strip()
+    if (result.returncode != 0) or (len(font_file) == 0) or not os.path.exists(font_file):
+        return None
+    return font_file
+
+
+def _matplotlib_match(family: str) -> str:
+    """
+    Determines the font file for the family using matplotlib's font_manager
+    (which may have to build its font cache first).
+
+    :param family: the font family
+    :type family: str
+    :return: the font file
+    :rtype: str
+    """
+    from matplotlib import font_manager
+    mpl_font = font_manager.FontProperties(family=family)
+    return font_manager.findfont(mpl_font)
+
+
+def find_font_file(family: str) -> str:
+    """
+    Determines the font file for the family. Looks in the cache first, then
+    uses fc-match and finally matplotlib's font_manager. Successful lookups
+    get stored in the cache.
+
+    :param family: the font family
+    :type family: str
+    :return: the font file
+    :rtype: str
+    """
+    font_file = _load_cache().get(family, None)
+    if (font_file is not None) and os.path.exists(font_file):
+        return font_file
+    font_file = _fc_match(family)
+    if font_file is None:
+        font_file = _matplotlib_match(family)
+    _store_cache(family, font_file)
+    return font_file
+
 
 def load_font(logger, family, size):
     """
-    Attempts to instantiate the specified font family.
+    Attempts to instantiate the specified font family. Fonts get loaded only
+    once per process and then shared.
 
     :param logger: the logger instance to use, ignored if None
     :param family: the TTF font family
@@ -21,10 +142,12 @@ def load_font(logger, family, size):
     :type size: int
     :return: the Pillow font
     """
+    key = (family, size)
+    if key in _fonts:
+        return _fonts[key]
     try:
-        mpl_font = font_manager.FontProperties(family=family)
-        font_file = font_manager.findfont(mpl_font)
-        return ImageFont.truetype(font_file, size)
+        _fonts[key] = ImageFont.truetype(find_font_file(family), size)
+        return _fonts[key]
     except:
         msg = "Failed to instantiate font family '%s', falling back on '%s'" % (family, DEFAULT_FONT_FAMILY)
         if logger is not None:
@@ -33,6 +156,5 @@ def load_font(logger, family, size):
             print(msg)
             print(traceback.format_exc())
 
-        mpl_font = font_manager.FontProperties(family=DEFAULT_FONT_FAMILY)
-        font_file = font_manager.findfont(mpl_font)
-        return ImageFont.truetype(font_file, size)
+        _fonts[key] = ImageFont.truetype(find_font_file(DEFAULT_FONT_FAMILY), size)
+        return _fonts[key]
@@ -0,0 +1,175 @@
+import argparse
+import importlib
+import json
+import logging
+import redis
+import sys
+import traceback
+
+from dataclasses import dataclass
+from typing import Any, List
+
+from gifr.common import init_logging, set_logging_level, create_parser, init_state, State
+from gifr.listener import SharedListener
+
+PROG: str = "gifr-hub"
+
+_logger = logging.getLogger(PROG)
+
+state: State = None
+
+TAB_MODULES = {
+    "asr": "gifr.asr",
+    "asr-textgen": "gifr.asr_text_generation",
+    "chain": "gifr.chain",
+    "imgcls": "gifr.image_classification",
+    "imgseg": "gifr.image_segmentation",
+    "objdet": "gifr.object_detection",
+    "textclass": "gifr.text_classification",
+    "textgen": "gifr.text_generation",
+}
+""" the modules of the interfaces that can be mounted as tabs. """
+
+
+@dataclass
+class Tab:
+    name: str
+    tab_type: str
+    module: Any
+    state: State
+
+
+def load_tabs(path: str, shared: State, logger: logging.Logger) -> List[Tab]:
+    """
+    Loads the hub definition from the JSON file and initializes the interfaces.
+    Each tab has a "type" (asr|asr-textgen|chain|imgcls|imgseg|objdet|textclass|textgen),
+    an optional "name" (the title of the interface is used by default) and optional
+    "args", the command-line options of the corresponding gifr interface (channels,
+    timeout, etc). As the interfaces keep their state at module level, each type
+    can only be used once.
+
+    :param path: the JSON file to load
+    :type path: str
+    :param shared: the state to share the redis connection, listener etc with
+    :type shared: State
+    :param logger: the logger to use
+    :type logger: logging.Logger
+    :return: the tabs
+    :rtype: list
+    """
+    with open(path, "r") as fp:
+        config = json.load(fp)
+
+    result = []
+    types = set()
+    for d in config["tabs"]:
+        tab_type = d["type"]
+        if tab_type not in TAB_MODULES:
+            raise Exception("Unknown tab type (%s): %s" % ("|".join(TAB_MODULES.keys()), tab_type))
+        if tab_type in types:
+            raise Exception("Tab type can only be used once: %s" % tab_type)
+        types.add(tab_type)
+
+        module = importlib.import_module(TAB_MODULES[tab_type])
+        ns = module.create_argparser().parse_args(args=d.get("args", []))
+        tab_state = init_state(ns, shared=shared)
+        if (tab_state.admission is None) and (shared.admission is not None):
+            tab_state.admission = shared.admission
+        module.post_init_state(tab_state)
+        set_logging_level(tab_state.logger, ns.logging_level)
+        module.state = tab_state
+
+        tab = Tab(name=d.get("name", tab_state.title), tab_type=tab_type, module=module, state=tab_state)
+        result.append(tab)
+        logger.info("Tab '%s': type=%s, channels=%s/%s" % (tab.name, tab_type, tab_state.channel_in, tab_state.channel_out))
+
+    if len(result) == 0:
+        raise Exception("No tabs defined in: %s" % path)
+
+    return result
+
+
+def create_interface(state: State) -> "gr.TabbedInterface":
+    """
+    Generates the interface, with one tab per interface.
+
+    :param state: the state to use
+    :type state: State
+    """
+    import gradio as gr
+    tabs = state.params["tabs"]
+    return gr.TabbedInterface(
+        [x.module.create_interface(x.state) for x in tabs],
+        tab_names=[x.name for x in tabs],
+        title=state.title)
+
+
+def post_init_state(state: State):
+    """
+    Finalizes the initialization of the state.
+
+    :param state: the state to update
+    :type state: State
+    """
+    state.logger = _logger
+    if state.params["max_connections"] > 0:
+        pool = redis.BlockingConnectionPool(max_connections=state.params["max_connections"],
+                                            **state.connection.connection_pool.connection_kwargs)
+        state.connection = redis.Redis(connection_pool=pool)
+    state.listener = SharedListener(state.connection, sleep_time=state.sleep_time, logger=_logger)
+    state.params["tabs"] = load_tabs(state.params["config"], state, _logger)
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """
+    Creates the parser for the command-line options.
+
+    :return: the parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = create_parser("Serves multiple gifr interfaces as tabs from a single process. The interfaces share "
+                           + "the redis connection pool, a single pub-sub listener, the fonts, tracing, profiling and "
+                           + "traffic recording; the limit on requests in flight applies to all the interfaces that "
+                           + "do not define their own.",
+                           PROG, model_channel_in=None, model_channel_out=None, ui_title="gifr")
+    parser.add_argument("--config", metavar="FILE", help="The JSON file with the definition of the tabs.", type=str, required=True)
+    parser.add_argument("--max_connections", metavar="NUM", help="The maximum number of redis connections, requests wait for a free one; <1 for unlimited.", default=0, type=int, required=False)
+    return parser
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    global state
+    init_logging()
+    parser = create_argparser()
+    parsed = parser.parse_args(args=args)
+    set_logging_level(_logger, parsed.logging_level)
+    state = init_state(parsed)
+    post_init_state(state)
+    ui = create_interface(state)
+    ui.launch(show_api=False, share=parsed.share_interface, inbrowser=parsed.launch_browser)
+
+
+def sys_main() -> int:
+    """
+    Runs the main function using the system cli arguments, and
+    returns a system error code.
+
+    :return: 0 for success, 1 for failure.
+    """
+    try:
+        main()
+        return 0
+    except Exception:
+        traceback.print_exc()
+        print("options: %s" % str(sys.argv[1:]), file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,14 @@
+import argparse
 import json
 import logging
 import sys
 import traceback
 
-import gradio as gr
+from typing import Optional, Tuple
 
-from gifr.common import init_logging, set_logging_level, create_parser, init_state, State, make_prediction
+from gifr.common import init_logging, set_logging_level, create_parser, init_state, State, make_prediction, \
+    make_predictions, parse_channel_pairs
+from gifr.trace import traced, span
 
 PROG: str = "gifr-imgcls"
 
@@ -14,46 +17,108 @@ _logger = logging.getLogger(PROG)
 state: State = None
 
 
-def predict(img_file: str) -> str:
+def classify(state: State, content: bytes) -> dict:
     """
-    Sends the image to the model and returns the result.
+    Sends the image data to the model and returns the probabilities per label.
 
-    :param img_file: the image to send
-    :type img_file: str
+    :param state: the state
+    :type state: State
+    :param content: the image data to send
+    :type content: bytes
     :return: the prediction result
-    :rtype: str
+    :rtype: dict
     """
-    global state
-    state.logger.info("Loading: %s" % img_file)
-    with open(img_file, "rb") as f:
-        content = f.read()
+    return parse_prediction(state, make_prediction(state, content))
+
 
-    data = make_prediction(state, content)
+def parse_prediction(state: State, data: Optional[bytes]) -> dict:
+    """
+    Parses the probabilities per label received from the model.
+
+    :param state: the state
+    :type state: State
+    :param data: the received data, None if no prediction received
+    :type data: bytes
+    :return: the prediction result
+    :rtype: dict
+    """
     if data is None:
         result = {"no result": 0.0}
     else:
-        result = json.loads(data.decode())
+        with span("parse"):
+            result = json.loads(data.decode())
     state.logger.info("Prediction: %s" % result)
     return result
 
 
-def create_interface(state: State) -> gr.Interface:
+@traced(PROG)
+def predict(img_file: str) -> dict:
+    """
+    Sends the image to the model and returns the result.
+
+    :param img_file: the image to send
+    :type img_file: str
+    :return: the prediction result
+    :rtype: dict
+    """
+    global state
+    state.logger.info("Loading: %s" % img_file)
+    with span("read file"):
+        with open(img_file, "rb") as f:
+            content = f.read()
+    return classify(state, content)
+
+
+@traced(PROG)
+def predict_compare(img_file: str) -> Tuple:
+    """
+    Sends the image to all the models that are being compared and returns the results.
+
+    :param img_file: the image to send
+    :type img_file: str
+    :return: the prediction result per model and the latencies
+    :rtype: tuple
+    """
+    global state
+    state.logger.info("Loading: %s" % img_file)
+    with span("read file"):
+        with open(img_file, "rb") as f:
+            content = f.read()
+
+    result = []
+    latencies = dict()
+    channels = state.params["compare_channels"]
+    for (channel_in, channel_out), (data, latency) in zip(channels, make_predictions(state, content, channels)):
+        result.append(parse_prediction(state, data))
+        latencies["%s:%s" % (channel_in, channel_out)] = None if data is None else latency
+    result.append(latencies)
+
+    return tuple(result)
+
+
+def create_interface(state: State) -> "gr.Interface":
     """
     Generates the interface.
 
     :param state: the state to use
     :type state: State
     """
+    import gradio as gr
+    if state.params["compare_channels"] is not None:
+        fn = predict_compare
+        outputs = [gr.Label(label="%s:%s" % x) for x in state.params["compare_channels"]]
+        outputs.append(gr.JSON(label="Latencies (seconds)"))
+    else:
+        fn = predict
+        outputs = [gr.Label(label="Prediction")]
     return gr.Interface(
         title=state.title,
         description="Sends the selected image to the model and displays the generated prediction results.",
-        fn=predict,
+        fn=fn,
         inputs=[
             gr.Image(type="filepath", label="Input"),
         ],
-        outputs=[
-            gr.Label(label="Prediction"),
-        ],
+        outputs=outputs,
         allow_flagging="never")
 
 
@@ -65,6 +130,26 @@ def post_init_state(state: State):
     :type state: State
     """
     state.logger = _logger
+    if state.params["compare"] is not None:
+        state.params["compare_channels"] = parse_channel_pairs(state.params["compare"])
+    else:
+        state.params["compare_channels"] = None
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """
+    Creates the parser for the command-line options.
+
+    :return: the parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = create_parser("Image classification interface. Allows the user to select an image "
+                           + "and display the probabilities per label that the model generated.",
+                           PROG, model_channel_in="images", model_channel_out="predictions",
+                           timeout=1.0, ui_title="Image classification",
+                           ui_desc="Sends the selected image to the model and displays the generated prediction results.")
+    parser.add_argument("--compare", metavar="IN:OUT", help="The channel pairs (in:out) of the models to send the image to concurrently and display the results side by side.", default=None, type=str, required=False, nargs="+")
+    return parser
 
 
 def main(args=None):
@@ -76,11 +161,7 @@ def main(args=None):
     """
     global state
     init_logging()
-    parser = create_parser("Image classification interface. Allows the user to select an image "
-                           + "and display the probabilities per label that the model generated.",
-                           PROG, model_channel_in="images", model_channel_out="predictions",
-                           timeout=1.0, ui_title="Image classification",
-                           ui_desc="Sends the selected image to the model and displays the generated prediction results.")
+    parser = create_argparser()
     parsed = parser.parse_args(args=args)
     set_logging_level(_logger, parsed.logging_level)
     state = init_state(parsed)
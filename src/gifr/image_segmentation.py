@@ -1,13 +1,17 @@
+import argparse
 import io
 import logging
 import numpy as np
 import sys
 import traceback
 
-import gradio as gr
-
 from PIL import Image
+from typing import Optional, Tuple
+
 from gifr.common import init_logging, set_logging_level, create_parser, init_state, State, make_prediction
+from gifr.output import add_output_arguments, create_encoder, encode_images
+from gifr.rendering import RenderPool, RenderJob, image_shape
+from gifr.trace import traced, span
 from gifr.colors import default_colors
 
 PROG: str = "gifr-imgseg"
@@ -60,28 +64,38 @@ def get_color(state: State, label: str):
     return state.params["colors"][label]
 
 
-def predict(img_file: str) -> np.ndarray:
+def request_mask(state: State, content: bytes) -> Optional[Image.Image]:
     """
-    Sends the image to the model and returns the result.
+    Sends the image data to the model and returns the predicted mask.
 
-    :param img_file: the image to send
-    :type img_file: str
-    :return: the prediction result
-    :rtype: str
+    :param state: the state
+    :type state: State
+    :param content: the image data to send
+    :type content: bytes
+    :return: the mask, None if no data received
+    :rtype: Image.Image
     """
-    global state
-    state.logger.info("Loading: %s" % img_file)
-    with open(img_file, "rb") as f:
-        content = f.read()
-    img = Image.open(img_file)
-
     data = make_prediction(state, content)
     if data is None:
         state.logger.error("No data received. Timeout or error?")
         return None
+    with span("decode mask"):
+        result = Image.open(io.BytesIO(data))
+        result.load()
+    return result
 
-    # mask: num classes and turn into palette image
-    mask = Image.open(io.BytesIO(data))
+
+def to_indexed(state: State, mask: Image.Image) -> Tuple[Image.Image, int]:
+    """
+    Turns the mask into an indexed image, according to the prediction type.
+
+    :param state: the state
+    :type state: State
+    :param mask: the mask returned by the model
+    :type mask: Image.Image
+    :return: the indexed mask and the number of classes (excluding background)
+    :rtype: tuple
+    """
     pred_type = state.params["prediction_type"]
     if pred_type == PREDICTION_TYPE_AUTO:
         if mask.mode == "RGB":
@@ -108,7 +122,24 @@ def predict(img_file: str) -> np.ndarray:
     else:
         raise Exception("Unhandled prediction type: %s" % state.params["prediction_type"])
     state.logger.info("# classes: %d" % num_classes)
+    return mask, num_classes
+
 
+def render(state: State, img: Image.Image, mask: Image.Image, num_classes: int) -> Image.Image:
+    """
+    Colorizes the indexed mask and overlays it on the image (unless only the mask is to be shown).
+
+    :param state: the state
+    :type state: State
+    :param img: the image to overlay the mask on
+    :type img: Image.Image
+    :param mask: the indexed mask
+    :type mask: Image.Image
+    :param num_classes: the number of classes in the mask (excluding background)
+    :type num_classes: int
+    :return: the combined image
+    :rtype: Image.Image
+    """
     # new palette for mask
     palette = [0, 0, 0]  # background
     for i in range(num_classes):
@@ -129,13 +160,106 @@ def predict(img_file: str) -> np.ndarray:
         combined = img.convert("RGBA")
         combined.paste(mask, (0, 0), mask=mask)
 
-    return np.asarray(combined)
+    return combined
 
 
-def create_interface(state: State) -> gr.Interface:
+def render_file(state: State, img_file: str, data: bytes, colors_index: int) -> Tuple[Image.Image, int]:
+    """
+    Loads the image, decodes the mask and overlays it, used by the processes of the render pool.
+
+    :param state: the state of the worker process
+    :type state: State
+    :param img_file: the image to load
+    :type img_file: str
+    :param data: the mask returned by the model
+    :type data: bytes
+    :param colors_index: the index of the next default color to use
+    :type colors_index: int
+    :return: the combined image and the number of classes
+    :rtype: tuple
+    """
+    img = Image.open(img_file)
+    mask = Image.open(io.BytesIO(data))
+    mask.load()
+    mask, num_classes = to_indexed(state, mask)
+    state.params["default_colors_index"] = colors_index
+    return render(state, img, mask, num_classes), num_classes
+
+
+def submit_render(state: State, img_file: str, img: Image.Image, data: bytes) -> RenderJob:
+    """
+    Hands decoding and rendering of the mask to the render pool.
+
+    :param state: the state
+    :type state: State
+    :param img_file: the image to overlay the mask on
+    :type img_file: str
+    :param img: the (not necessarily loaded) image, for determining the size
+    :type img: Image.Image
+    :param data: the mask returned by the model
+    :type data: bytes
+    :return: the render job
+    :rtype: RenderJob
+    """
+    size = Image.open(io.BytesIO(data)).size if state.params["only_mask"] else img.size
+    return state.params["render_pool"].submit(image_shape(size, "RGBA"), "render_file", img_file, data,
+                                              state.params["default_colors_index"])
+
+
+@traced(PROG)
+def predict(img_file: str):
+    """
+    Sends the image to the model and returns the result.
+
+    :param img_file: the image to send
+    :type img_file: str
+    :return: the prediction result (array or encoded file), plus the full resolution file if downscaled
+    """
+    global state
+    encoder = state.params["output_encoder"]
+    no_result = (None, None) if (encoder is not None) and encoder.downscales else None
+    state.logger.info("Loading: %s" % img_file)
+    with span("read file"):
+        with open(img_file, "rb") as f:
+            content = f.read()
+        img = Image.open(img_file)
+
+    if state.params["render_pool"] is not None:
+        data = make_prediction(state, content)
+        if data is None:
+            state.logger.error("No data received. Timeout or error?")
+            return no_result
+        with span("render"):
+            combined, num_classes = submit_render(state, img_file, img, data).result()
+        # keep cycling through the colors like when rendering in this process
+        for _ in range(num_classes):
+            next_default_color(state)
+    else:
+        mask = request_mask(state, content)
+        if mask is None:
+            return no_result
+
+        # mask: num classes and turn into palette image
+        with span("index mask"):
+            mask, num_classes = to_indexed(state, mask)
+        with span("render", classes=num_classes):
+            combined = render(state, img, mask, num_classes)
+
+    with span("output"):
+        display, full = encode_images(encoder, [combined])
+    if len(full) > 0:
+        return display[0], full[0]
+    return display[0]
+
+
+def create_interface(state: State) -> "gr.Interface":
     """
     Generates the interface.
     """
+    import gradio as gr
+    outputs = [gr.Image(label="Prediction")]
+    if (state.params["output_encoder"] is not None) and state.params["output_encoder"].downscales:
+        outputs.append(gr.File(label="Full resolution"))
     return gr.Interface(
         title=state.title,
         description=state.description,
@@ -143,9 +267,7 @@ def create_interface(state: State) -> gr.Interface:
         inputs=[
             gr.Image(type="filepath", label="Input"),
         ],
-        outputs=[
-            gr.Image(label="Prediction"),
-        ],
+        outputs=outputs,
         allow_flagging="never")
 
 
@@ -156,21 +278,25 @@ def post_init_state(state: State):
     :param state: the state to update
     :type state: State
     """
+    options = dict(state.params)
     state.logger = _logger
     state.params["colors"] = dict()
     state.params["default_colors"] = default_colors()
     state.params["default_colors_index"] = 0
+    state.params["output_encoder"] = create_encoder(state.params)
+    state.params["render_pool"] = None
+    if state.params["render_workers"] > 0:
+        options["render_workers"] = 0
+        state.params["render_pool"] = RenderPool(state.params["render_workers"], "gifr.image_segmentation", options)
 
 
-def main(args=None):
+def create_argparser() -> argparse.ArgumentParser:
     """
-    The main method for parsing command-line arguments.
+    Creates the parser for the command-line options.
 
-    :param args: the commandline arguments, uses sys.argv if not supplied
-    :type args: list
+    :return: the parser
+    :rtype: argparse.ArgumentParser
     """
-    global state
-    init_logging()
     parser = create_parser("Image segmentation interface. Allows the user to select an image "
                            + "and display the generated pixel mask overlayed.",
                            PROG, model_channel_in="images", model_channel_out="predictions",
@@ -179,6 +305,21 @@ def main(args=None):
     parser.add_argument("--prediction_type", choices=PREDICTION_TYPES, default=PREDICTION_TYPE_AUTO, help="The type of image that the model returns")
     parser.add_argument("--alpha", metavar="NUM", help="The alpha value to use for the overlay (0: transparent, 255: opaque).", default=128, type=int, required=False)
     parser.add_argument("--only_mask", action="store_true", help="Whether to show only the predicted mask rather than overlaying it.")
+    add_output_arguments(parser)
+    parser.add_argument("--render_workers", metavar="NUM", help="The number of processes for loading the images, decoding the masks and rendering the overlays, allowing concurrent requests to use multiple cores; <1 to render in the interface process.", default=0, type=int, required=False)
+    return parser
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    global state
+    init_logging()
+    parser = create_argparser()
     parsed = parser.parse_args(args=args)
     set_logging_level(_logger, parsed.logging_level)
     state = init_state(parsed)
@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+
+from typing import Callable, Dict, Optional, Tuple
+
+import redis
+
+
+class SharedListener:
+    """
+    Listens to the reply channels of all the requests of the process with a single
+    pub-sub connection and thread, rather than opening a connection and starting a
+    thread per request. Channel patterns get subscribed to as long as at least one
+    handler is registered for them.
+    """
+
+    def __init__(self, connection: redis.Redis, sleep_time: float = 0.01, logger: Optional[logging.Logger] = None):
+        """
+        Initializes the listener.
+
+        :param connection: the redis connection to use
+        :type connection: redis.Redis
+        :param sleep_time: the sleep time for the pub-sub thread
+        :type sleep_time: float
+        :param logger: the logger to use, ignored if None
+        :type logger: logging.Logger
+        """
+        self.connection = connection
+        self.sleep_time = sleep_time
+        self.logger = logger
+        self._handlers: Dict[str, Dict[int, Callable]] = dict()
+        self._next_id = 0
+        self._pubsub = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _dispatch(self, pattern: str, message: dict):
+        """
+        Passes on the message to all the handlers registered for the pattern.
+
+        :param pattern: the pattern the message was received for
+        :type pattern: str
+        :param message: the pub-sub message
+        :type message: dict
+        """
+        with self._lock:
+            handlers = list(self._handlers.get(pattern, dict()).values())
+        for handler in handlers:
+            try:
+                handler(message)
+            except Exception:
+                if self.logger is not None:
+                    self.logger.exception("Failed to handle message on: %s" % pattern)
+
+    def _on_error(self, e: BaseException, pubsub: redis.client.PubSub, thread: redis.client.PubSubWorkerThread):
+        """
+        Keeps the thread alive when the connection fails, the pub-sub instance
+        reconnects and resubscribes on the next attempt.
+        """
+        if self.logger is not None:
+            self.logger.warning("Shared listener failed: %s" % str(e))
+        time.sleep(1.0)
+
+    def subscribe(self, pattern: str, handler: Callable) -> Tuple[str, int]:
+        """
+        Registers the handler for the channel pattern.
+
+        :param pattern: the channel pattern to listen to
+        :type pattern: str
+        :param handler: the function to pass on the pub-sub messages to
+        :return: the token for unsubscribing
+        :rtype: tuple
+        """
+        with self._lock:
+            self._next_id += 1
+            token = (pattern, self._next_id)
+            if pattern not in self._handlers:
+                self._handlers[pattern] = dict()
+                if self._pubsub is None:
+                    self._pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+                self._pubsub.psubscribe(**{pattern: lambda message: self._dispatch(pattern, message)})
+            self._handlers[pattern][token[1]] = handler
+            if self._thread is None:
+                self._thread = self._pubsub.run_in_thread(sleep_time=self.sleep_time, daemon=True, exception_handler=self._on_error)
+        return token
+
+    def unsubscribe(self, token: Tuple[str, int]):
+        """
+        Removes the handler again, the pattern gets unsubscribed from if no other handlers are left.
+
+        :param token: the token obtained when subscribing
+        :type token: tuple
+        """
+        pattern, handler_id = token
+        with self._lock:
+            handlers = self._handlers.get(pattern, None)
+            if handlers is None:
+                return
+            handlers.pop(handler_id, None)
+            if len(handlers) == 0:
+                self._handlers.pop(pattern)
+                self._pubsub.punsubscribe(pattern)
+
+    def close(self):
+        """
+        Stops the thread and closes the pub-sub connection.
+        """
+        with self._lock:
+            if self._thread is not None:
+                self._thread.stop()
+                self._thread = None
+            if self._pubsub is not None:
+                self._pubsub.close()
+                self._pubsub = None
+            self._handlers.clear()
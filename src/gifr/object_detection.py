@@ -1,4 +1,4 @@
-import gradio as gr
+import argparse
 import json
 import logging
 import numpy as np
@@ -8,16 +8,23 @@ import traceback
 
 from datetime import datetime
 from PIL import Image, ImageDraw
-from typing import Tuple
+from typing import Optional, Tuple
 
 from opex import ObjectPredictions, BBox
-from gifr.common import init_logging, set_logging_level, create_parser, init_state, State, make_prediction
+from gifr.common import init_logging, set_logging_level, create_parser, init_state, State, make_prediction, \
+    make_predictions, parse_channel_pairs
+from gifr.output import add_output_arguments, create_encoder, encode_images
+from gifr.rendering import RenderPool, RenderJob, image_shape
+from gifr.trace import traced, span
 from gifr.colors import default_colors, text_color
 from gifr.fonts import load_font, DEFAULT_FONT_FAMILY
 
 
 PROG: str = "gifr-objdet"
 
+RENDER_MODES = ["L", "RGB", "RGBA"]
+""" the image modes that get rendered as is in the render pool, others get converted to RGB. """
+
 _logger = logging.getLogger(PROG)
 
 state: State = None
@@ -152,33 +159,84 @@ def text_coords(state: State, draw: ImageDraw, text: str, rect: BBox) -> Tuple[i
     return x, y, w, h
 
 
-def predict(img_file: str) -> np.ndarray:
+def detect(state: State, content: bytes, img_id: str) -> ObjectPredictions:
     """
-    Sends the image to the model and returns the result.
+    Sends the image data to the model and returns the predicted objects.
 
-    :param img_file: the image to send
-    :type img_file: str
-    :return: the prediction result
-    :rtype: str
+    :param state: the state
+    :type state: State
+    :param content: the image data to send
+    :type content: bytes
+    :param img_id: the ID of the image, used if no predictions were received
+    :type img_id: str
+    :return: the predictions
+    :rtype: ObjectPredictions
     """
-    global state
-    state.logger.info("Loading: %s" % img_file)
-    with open(img_file, "rb") as f:
-        content = f.read()
-    img = Image.open(img_file)
+    return parse_predictions(state, make_prediction(state, content), img_id)
+
+
+def predictions_string(state: State, data: Optional[bytes], img_id: str) -> str:
+    """
+    Turns the predictions received from the model into a string.
 
-    data = make_prediction(state, content)
+    :param state: the state
+    :type state: State
+    :param data: the received data, None if no predictions received
+    :type data: bytes
+    :param img_id: the ID of the image, used if no predictions were received
+    :type img_id: str
+    :return: the predictions in OPEX JSON format
+    :rtype: str
+    """
     if data is None:
         preds_str = json.dumps({
             "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S.%f"),
-            "id": os.path.basename(img_file),
+            "id": img_id,
             "objects": []
         })
     else:
         preds_str = data.decode()
     state.logger.info("Prediction: %s" % preds_str)
-    preds = ObjectPredictions.from_json_string(preds_str)
-    overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
+    return preds_str
+
+
+def parse_predictions(state: State, data: Optional[bytes], img_id: str) -> ObjectPredictions:
+    """
+    Parses the predictions received from the model.
+
+    :param state: the state
+    :type state: State
+    :param data: the received data, None if no predictions received
+    :type data: bytes
+    :param img_id: the ID of the image, used if no predictions were received
+    :type img_id: str
+    :return: the predictions
+    :rtype: ObjectPredictions
+    """
+    preds_str = predictions_string(state, data, img_id)
+    with span("parse"):
+        return ObjectPredictions.from_json_string(preds_str)
+
+
+def render(state: State, img: Image.Image, preds: ObjectPredictions, overlay: Image.Image = None) -> Image.Image:
+    """
+    Overlays the predictions on the image.
+
+    :param state: the state
+    :type state: State
+    :param img: the image to overlay the predictions on (gets modified)
+    :type img: Image.Image
+    :param preds: the predictions to overlay
+    :type preds: ObjectPredictions
+    :param overlay: the RGBA buffer of the same size to draw the predictions on (gets cleared), allocates one if None
+    :type overlay: Image.Image
+    :return: the image with the overlay
+    :rtype: Image.Image
+    """
+    if overlay is None:
+        overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
+    else:
+        overlay.paste((0, 0, 0, 0), (0, 0) + overlay.size)
     draw = ImageDraw.Draw(overlay)
     for i, obj in enumerate(preds.objects):
         if state.params["vary_colors"]:
@@ -212,61 +270,211 @@ def predict(img_file: str) -> np.ndarray:
             draw.text((x, y), text, font=state.params["font"], fill=text_color(get_color(state, color_label)))
 
     img.paste(overlay, (0, 0), mask=overlay)
+    return img
+
+
+def render_file(state: State, img_file: str, mode: str, preds_str: str, colors: dict) -> Tuple[Image.Image, int]:
+    """
+    Loads the image and overlays the predictions on it, used by the processes of the render pool.
+
+    :param state: the state of the worker process
+    :type state: State
+    :param img_file: the image to load
+    :type img_file: str
+    :param mode: the image mode to convert the image to if necessary
+    :type mode: str
+    :param preds_str: the predictions in OPEX JSON format
+    :type preds_str: str
+    :param colors: the colors per label
+    :type colors: dict
+    :return: the image with the overlay and the number of objects
+    :rtype: tuple
+    """
+    img = Image.open(img_file)
+    if img.mode != mode:
+        img = img.convert(mode)
+    state.params["colors"] = colors
+    preds = ObjectPredictions.from_json_string(preds_str)
+    return render(state, img, preds), len(preds.objects)
+
+
+def submit_render(state: State, img_file: str, img: Image.Image, data: Optional[bytes], img_id: str) -> RenderJob:
+    """
+    Hands the rendering of the predictions to the render pool. The colors of the labels
+    get assigned beforehand, in the same order as when rendering in this process.
+
+    :param state: the state
+    :type state: State
+    :param img_file: the image to overlay the predictions on
+    :type img_file: str
+    :param img: the (not necessarily loaded) image, for determining size and mode
+    :type img: Image.Image
+    :param data: the received data, None if no predictions received
+    :type data: bytes
+    :param img_id: the ID of the image, used if no predictions were received
+    :type img_id: str
+    :return: the render job
+    :rtype: RenderJob
+    """
+    preds_str = predictions_string(state, data, img_id)
+    for i, obj in enumerate(json.loads(preds_str)["objects"]):
+        get_color(state, ("object-%d" % i) if state.params["vary_colors"] else obj["label"])
+    mode = img.mode if img.mode in RENDER_MODES else "RGB"
+    return state.params["render_pool"].submit(image_shape(img.size, mode), "render_file", img_file, mode, preds_str,
+                                              dict(state.params["colors"]))
+
+
+@traced(PROG)
+def predict(img_file: str):
+    """
+    Sends the image to the model and returns the result.
+
+    :param img_file: the image to send
+    :type img_file: str
+    :return: the prediction result (array or encoded file), plus the full resolution file if downscaled
+    """
+    global state
+    state.logger.info("Loading: %s" % img_file)
+    with span("read file"):
+        with open(img_file, "rb") as f:
+            content = f.read()
+        img = Image.open(img_file)
+
+    if state.params["render_pool"] is not None:
+        data = make_prediction(state, content)
+        with span("render"):
+            img, _ = submit_render(state, img_file, img, data, os.path.basename(img_file)).result()
+    else:
+        preds = detect(state, content, os.path.basename(img_file))
+        with span("render", objects=len(preds.objects)):
+            img = render(state, img, preds)
 
-    return np.asarray(img)
+    with span("output"):
+        display, full = encode_images(state.params["output_encoder"], [img])
+    if len(full) > 0:
+        return display[0], full[0]
+    return display[0]
 
 
-def create_interface(state: State) -> gr.Interface:
+@traced(PROG)
+def predict_compare(img_file: str) -> Tuple:
+    """
+    Sends the image to all the models that are being compared and returns the results.
+
+    :param img_file: the image to send
+    :type img_file: str
+    :return: the prediction result per model, the latencies and the full resolution files if downscaled
+    :rtype: tuple
+    """
+    global state
+    state.logger.info("Loading: %s" % img_file)
+    with span("read file"):
+        with open(img_file, "rb") as f:
+            content = f.read()
+        img = Image.open(img_file)
+        img.load()
+
+    images = []
+    latencies = dict()
+    channels = state.params["compare_channels"]
+    if state.params["render_pool"] is not None:
+        jobs = []
+        for (channel_in, channel_out), (data, latency) in zip(channels, make_predictions(state, content, channels)):
+            jobs.append(submit_render(state, img_file, img, data, os.path.basename(img_file)))
+            latencies["%s:%s" % (channel_in, channel_out)] = None if data is None else latency
+        with span("render"):
+            images = [job.result()[0] for job in jobs]
+    else:
+        for (channel_in, channel_out), (data, latency) in zip(channels, make_predictions(state, content, channels)):
+            preds = parse_predictions(state, data, os.path.basename(img_file))
+            with span("render", objects=len(preds.objects)):
+                images.append(render(state, img.copy(), preds))
+            latencies["%s:%s" % (channel_in, channel_out)] = None if data is None else latency
+
+    with span("output"):
+        result, full = encode_images(state.params["output_encoder"], images)
+    result.append(latencies)
+    if (state.params["output_encoder"] is not None) and state.params["output_encoder"].downscales:
+        result.append(full)
+
+    return tuple(result)
+
+
+def create_interface(state: State) -> "gr.Interface":
     """
     Generates the interface.
 
     :param state: the state to use
     :type state: State
     """
+    import gradio as gr
+    if state.params["compare_channels"] is not None:
+        fn = predict_compare
+        outputs = [gr.Image(label="%s:%s" % x) for x in state.params["compare_channels"]]
+        outputs.append(gr.JSON(label="Latencies (seconds)"))
+    else:
+        fn = predict
+        outputs = [gr.Image(label="Predictions")]
+    if (state.params["output_encoder"] is not None) and state.params["output_encoder"].downscales:
+        if state.params["compare_channels"] is not None:
+            outputs.append(gr.File(label="Full resolution", file_count="multiple"))
+        else:
+            outputs.append(gr.File(label="Full resolution"))
     return gr.Interface(
         title=state.title,
         description=state.description,
-        fn=predict,
+        fn=fn,
         inputs=[
             gr.Image(type="filepath", label="Input"),
         ],
-        outputs=[
-            gr.Image(label="Predictions"),
-        ],
+        outputs=outputs,
         allow_flagging="never")
 
 
-def post_init_state(state: State):
+def init_render_state(state: State):
     """
-    Finalizes the initialization of the state.
+    Initializes the colors, font and text placement for rendering the predictions.
 
     :param state: the state to update
     :type state: State
     """
-    state.logger = _logger
     state.params["colors"] = dict()
     state.params["default_colors"] = default_colors()
     state.params["default_colors_index"] = 0
-    state.params["font"] = load_font(_logger, state.params["font_family"], state.params["font_size"])
+    state.params["font"] = load_font(state.logger, state.params["font_family"], state.params["font_size"])
     anchors = state.params["text_placement"].split(",")
     state.params["vertical"] = anchors[0]
     state.params["horizontal"] = anchors[1]
 
 
-def main(args=None):
+def post_init_state(state: State):
     """
-    The main method for parsing command-line arguments.
+    Finalizes the initialization of the state.
 
-    :param args: the commandline arguments, uses sys.argv if not supplied
-    :type args: list
+    :param state: the state to update
+    :type state: State
+    """
+    options = dict(state.params)
+    state.logger = _logger
+    init_render_state(state)
+    if state.params["compare"] is not None:
+        state.params["compare_channels"] = parse_channel_pairs(state.params["compare"])
+    else:
+        state.params["compare_channels"] = None
+    state.params["output_encoder"] = create_encoder(state.params)
+    state.params["render_pool"] = None
+    if state.params["render_workers"] > 0:
+        options["render_workers"] = 0
+        state.params["render_pool"] = RenderPool(state.params["render_workers"], "gifr.object_detection", options)
+
+
+def add_render_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the options for rendering the predictions to the parser.
+
+    :param parser: the parser to extend
+    :type parser: argparse.ArgumentParser
     """
-    global state
-    init_logging()
-    parser = create_parser("Object detection interface. Allows the user to select an image "
-                           + "and overlay the predictions that the model generated.",
-                           PROG, model_channel_in="images", model_channel_out="predictions",
-                           timeout=1.0, ui_title="Object detection",
-                           ui_desc="Sends the selected image to the model and overlays the predicted objects on it in the output.")
     parser.add_argument("--min_score", metavar="FLOAT", help="The minimum score a prediction must have (0-1).", default=0.0, type=float, required=False)
     parser.add_argument("--text_format", metavar="FORMAT", help="The format for the text, placeholders: {label}, {score}.", default="{label}", type=str, required=False)
     parser.add_argument("--text_placement", metavar="V,H", help="Comma-separated list of vertical (T=top, C=center, B=bottom) and horizontal (L=left, C=center, R=right) anchoring.", default="T,L", type=str, required=False)
@@ -279,6 +487,37 @@ def main(args=None):
     parser.add_argument("--fill_alpha", metavar="NUM", help="The alpha value to use for the filling (0: transparent, 255: opaque).", default=128, type=int, required=False)
     parser.add_argument("--vary_colors", action="store_true", help="Whether to vary the colors of the outline/filling regardless of label", required=False)
     parser.add_argument("--force_bbox", action="store_true", help="Whether to force a bounding box even if there is a polygon available", required=False)
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """
+    Creates the parser for the command-line options.
+
+    :return: the parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = create_parser("Object detection interface. Allows the user to select an image "
+                           + "and overlay the predictions that the model generated.",
+                           PROG, model_channel_in="images", model_channel_out="predictions",
+                           timeout=1.0, ui_title="Object detection",
+                           ui_desc="Sends the selected image to the model and overlays the predicted objects on it in the output.")
+    add_render_arguments(parser)
+    parser.add_argument("--compare", metavar="IN:OUT", help="The channel pairs (in:out) of the models to send the image to concurrently and display the results side by side.", default=None, type=str, required=False, nargs="+")
+    add_output_arguments(parser)
+    parser.add_argument("--render_workers", metavar="NUM", help="The number of processes for loading the images and rendering the predictions, allowing concurrent requests to use multiple cores; <1 to render in the interface process.", default=0, type=int, required=False)
+    return parser
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    global state
+    init_logging()
+    parser = create_argparser()
     parsed = parser.parse_args(args=args)
     set_logging_level(_logger, parsed.logging_level)
     state = init_state(parsed)
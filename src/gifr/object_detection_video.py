@@ -0,0 +1,476 @@
+import argparse
+import io
+import logging
+import numpy as np
+import sys
+import threading
+import time
+import traceback
+
+from collections import deque
+from PIL import Image
+from typing import Iterator, Optional, Tuple
+
+from gifr.common import init_logging, set_logging_level, create_parser, init_state, State
+from gifr.object_detection import detect, render, init_render_state, add_render_arguments
+from gifr.trace import traced, span
+
+
+PROG: str = "gifr-objdet-video"
+
+_logger = logging.getLogger(PROG)
+
+state: State = None
+
+
+class FrameStats:
+    """
+    Keeps track of the frames that got submitted, shown, dropped or failed,
+    the achieved frame rate and the end-to-end latency (from capturing the
+    frame to having it rendered) over a sliding time window.
+    """
+
+    def __init__(self, window: float = 5.0):
+        """
+        Initializes the statistics.
+
+        :param window: the number of seconds to compute frame rate and latencies over
+        :type window: float
+        """
+        self.window = window
+        self.submitted = 0
+        self.shown = 0
+        self.dropped = 0
+        self.late = 0
+        self.failed = 0
+        self._shown = deque()
+        self._lock = threading.Lock()
+
+    def frame_shown(self, latency: float):
+        """
+        Records a frame that got rendered.
+
+        :param latency: the seconds since capturing the frame
+        :type latency: float
+        """
+        now = time.time()
+        with self._lock:
+            self.shown += 1
+            self._shown.append((now, latency))
+            while (len(self._shown) > 0) and (now - self._shown[0][0] > self.window):
+                self._shown.popleft()
+
+    def summary(self) -> dict:
+        """
+        Returns the statistics.
+
+        :return: the frame counts, the frame rate and the mean/95th percentile of the latencies (seconds)
+        :rtype: dict
+        """
+        with self._lock:
+            shown = list(self._shown)
+        result = {
+            "frames": self.submitted,
+            "shown": self.shown,
+            "dropped": self.dropped,
+            "late": self.late,
+            "failed": self.failed,
+            "fps": 0.0,
+            "latency_mean": None,
+            "latency_p95": None,
+        }
+        if len(shown) > 0:
+            latencies = np.array([x[1] for x in shown])
+            result["latency_mean"] = round(float(np.mean(latencies)), 3)
+            result["latency_p95"] = round(float(np.percentile(latencies, 95)), 3)
+        if len(shown) > 1:
+            result["fps"] = round((len(shown) - 1) / max(1e-6, shown[-1][0] - shown[0][0]), 2)
+        return result
+
+
+@traced(PROG)
+def process_frame(state: State, frame: np.ndarray, frame_id: str, overlay: Optional[Image.Image]) -> Tuple[np.ndarray, Image.Image]:
+    """
+    Sends the frame to the model and overlays the predictions.
+
+    :param state: the state
+    :type state: State
+    :param frame: the RGB frame
+    :type frame: np.ndarray
+    :param frame_id: the ID of the frame
+    :type frame_id: str
+    :param overlay: the overlay buffer to reuse, None to allocate one
+    :type overlay: Image.Image
+    :return: the rendered frame and the overlay buffer
+    :rtype: tuple
+    """
+    with span("encode frame"):
+        img = Image.fromarray(frame)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=state.params["frame_quality"])
+    preds = detect(state, buffer.getvalue(), frame_id)
+    if (overlay is None) or (overlay.size != img.size):
+        overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
+    with span("render", objects=len(preds.objects)):
+        img = render(state, img, preds, overlay=overlay)
+    with span("output"):
+        return np.asarray(img), overlay
+
+
+class FrameScheduler:
+    """
+    Keeps at most K frames in flight to the model, dropping stale frames rather than
+    queueing them: a frame arriving while all slots are busy replaces the frame that is
+    waiting (latest frame wins). Each slot encodes the frame, waits for the predictions
+    and renders them, so that inference and rendering of consecutive frames overlap.
+    Frames that finish after a newer frame got shown are discarded. The overlay
+    buffers get reused between frames.
+    """
+
+    def __init__(self, state: State, frames_in_flight: int = 1):
+        """
+        Initializes the scheduler.
+
+        :param state: the state of the interface
+        :type state: State
+        :param frames_in_flight: the maximum number of frames sent to the model at the same time
+        :type frames_in_flight: int
+        """
+        self.state = state
+        self.frames_in_flight = max(1, frames_in_flight)
+        self.stats = FrameStats()
+        self._in_flight = 0
+        self._waiting = None
+        self._seq = 0
+        self._shown_seq = 0
+        self._latest = None
+        self._overlays = []
+        self._last_log = time.time()
+        self._cond = threading.Condition()
+
+    @property
+    def idle(self) -> bool:
+        """
+        Returns whether no frames are in flight or waiting.
+
+        :return: True if idle
+        :rtype: bool
+        """
+        with self._cond:
+            return (self._in_flight == 0) and (self._waiting is None)
+
+    def submit(self, frame: np.ndarray, captured: float = None):
+        """
+        Submits the frame for processing.
+
+        :param frame: the RGB frame
+        :type frame: np.ndarray
+        :param captured: the time the frame was captured (time.time()), uses the current time if None
+        :type captured: float
+        """
+        if captured is None:
+            captured = time.time()
+        with self._cond:
+            self._seq += 1
+            self.stats.submitted += 1
+            job = (self._seq, frame, captured)
+            if self._in_flight < self.frames_in_flight:
+                self._in_flight += 1
+                threading.Thread(target=self._run, args=(job,), daemon=True).start()
+            else:
+                if self._waiting is not None:
+                    self.stats.dropped += 1
+                self._waiting = job
+
+    def _run(self, job: tuple):
+        """
+        Processes the frame and then the waiting ones, until there are no more frames waiting.
+
+        :param job: the sequence number, frame and capture time
+        :type job: tuple
+        """
+        overlay = None
+        while job is not None:
+            overlay = self._process(job, overlay)
+            with self._cond:
+                job = self._waiting
+                self._waiting = None
+                if job is None:
+                    self._in_flight -= 1
+                    if overlay is not None:
+                        self._overlays.append(overlay)
+                    self._cond.notify_all()
+
+    def _process(self, job: tuple, overlay: Optional[Image.Image]) -> Optional[Image.Image]:
+        """
+        Processes a single frame.
+
+        :param job: the sequence number, frame and capture time
+        :type job: tuple
+        :param overlay: the overlay buffer to use, takes one from the pool if None
+        :type overlay: Image.Image
+        :return: the overlay buffer
+        :rtype: Image.Image
+        """
+        seq, frame, captured = job
+        if overlay is None:
+            with self._cond:
+                if len(self._overlays) > 0:
+                    overlay = self._overlays.pop()
+        try:
+            rendered, overlay = process_frame(self.state, frame, "frame-%d" % seq, overlay)
+        except Exception:
+            self.state.logger.exception("Failed to process frame #%d" % seq)
+            with self._cond:
+                self.stats.failed += 1
+            return overlay
+
+        with self._cond:
+            if seq < self._shown_seq:
+                self.stats.late += 1
+                return overlay
+            self._shown_seq = seq
+            self._latest = rendered
+            self.stats.frame_shown(time.time() - captured)
+            self._cond.notify_all()
+            log = (self.state.params["stats_interval"] > 0) and (time.time() - self._last_log >= self.state.params["stats_interval"])
+            if log:
+                self._last_log = time.time()
+        if log:
+            self.state.logger.info("Frames: %s" % str(self.stats.summary()))
+        return overlay
+
+    def latest(self) -> Tuple[Optional[np.ndarray], int]:
+        """
+        Returns the most recently rendered frame.
+
+        :return: the frame (None if none rendered yet) and its sequence number
+        :rtype: tuple
+        """
+        with self._cond:
+            return self._latest, self._shown_seq
+
+    def wait(self, seq: int, timeout: float) -> Tuple[Optional[np.ndarray], int]:
+        """
+        Waits for a frame newer than the specified one to get rendered or for the scheduler to become idle.
+
+        :param seq: the sequence number of the last frame obtained
+        :type seq: int
+        :param timeout: the maximum number of seconds to wait
+        :type timeout: float
+        :return: the most recently rendered frame and its sequence number
+        :rtype: tuple
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: (self._shown_seq > seq) or ((self._in_flight == 0) and (self._waiting is None)), timeout=timeout)
+            return self._latest, self._shown_seq
+
+
+def open_video(path: str) -> Tuple[float, Iterator[np.ndarray]]:
+    """
+    Opens the video file for reading the frames.
+
+    :param path: the video file
+    :type path: str
+    :return: the frame rate and the iterator over the RGB frames
+    :rtype: tuple
+    """
+    try:
+        import cv2
+    except ImportError:
+        raise Exception("Reading video files requires OpenCV, e.g., use: pip install gifr[video]")
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise Exception("Failed to open video: %s" % path)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    if (fps is None) or (fps <= 0):
+        fps = 25.0
+
+    def frames():
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        finally:
+            capture.release()
+
+    return fps, frames()
+
+
+def play_video(scheduler: FrameScheduler, fps: float, frames: Iterator[np.ndarray], stop: threading.Event):
+    """
+    Decodes the frames and submits them at the frame rate of the video, like a live source.
+
+    :param scheduler: the scheduler to submit the frames to
+    :type scheduler: FrameScheduler
+    :param fps: the frame rate of the video
+    :type fps: float
+    :param frames: the frames
+    :type frames: Iterator
+    :param stop: the event to set once all frames have been submitted, playback stops if set earlier
+    :type stop: threading.Event
+    """
+    try:
+        start = time.time()
+        for i, frame in enumerate(frames):
+            if stop.is_set():
+                break
+            delay = start + i / fps - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            scheduler.submit(frame)
+    except Exception:
+        scheduler.state.logger.exception("Failed to read video")
+    finally:
+        stop.set()
+
+
+def predict_webcam(frame: np.ndarray, scheduler: Optional[FrameScheduler]) -> Tuple:
+    """
+    Submits the webcam frame and returns the most recently rendered one, without waiting.
+
+    :param frame: the webcam frame
+    :type frame: np.ndarray
+    :param scheduler: the scheduler of the session, None if not yet created
+    :type scheduler: FrameScheduler
+    :return: the rendered frame, the statistics and the scheduler
+    :rtype: tuple
+    """
+    global state
+    if scheduler is None:
+        scheduler = FrameScheduler(state, frames_in_flight=state.params["frames_in_flight"])
+    if frame is not None:
+        scheduler.submit(frame)
+    return scheduler.latest()[0], scheduler.stats.summary(), scheduler
+
+
+def predict_video(video_file: str) -> Iterator[Tuple]:
+    """
+    Plays the video, sending the frames to the model and outputting the rendered frames as they become available.
+
+    :param video_file: the video to process
+    :type video_file: str
+    :return: the rendered frames and the statistics
+    :rtype: Iterator
+    """
+    global state
+    if video_file is None:
+        return
+    state.logger.info("Loading: %s" % video_file)
+    fps, frames = open_video(video_file)
+    scheduler = FrameScheduler(state, frames_in_flight=state.params["frames_in_flight"])
+    stop = threading.Event()
+    threading.Thread(target=play_video, args=(scheduler, fps, frames, stop), daemon=True).start()
+    seq = 0
+    try:
+        while not (stop.is_set() and scheduler.idle):
+            frame, latest = scheduler.wait(seq, 0.5)
+            if latest > seq:
+                seq = latest
+                yield frame, scheduler.stats.summary()
+    finally:
+        stop.set()
+        state.logger.info("Video finished: %s" % str(scheduler.stats.summary()))
+    yield scheduler.latest()[0], scheduler.stats.summary()
+
+
+def create_interface(state: State) -> "gr.Blocks":
+    """
+    Generates the interface.
+
+    :param state: the state to use
+    :type state: State
+    """
+    import gradio as gr
+    with gr.Blocks(title=state.title) as ui:
+        gr.Markdown("# %s\n\n%s" % (state.title, state.description))
+        with gr.Tab("Webcam"):
+            with gr.Row():
+                webcam = gr.Image(sources=["webcam"], streaming=True, type="numpy", label="Webcam")
+                webcam_output = gr.Image(label="Predictions")
+            webcam_stats = gr.JSON(label="Statistics")
+            scheduler = gr.State(None)
+            webcam.stream(predict_webcam, inputs=[webcam, scheduler], outputs=[webcam_output, webcam_stats, scheduler],
+                          stream_every=state.params["stream_interval"])
+        with gr.Tab("Video"):
+            with gr.Row():
+                video = gr.Video(sources=["upload"], label="Video")
+                video_output = gr.Image(label="Predictions")
+            video_stats = gr.JSON(label="Statistics")
+            start = gr.Button("Start")
+            start.click(predict_video, inputs=[video], outputs=[video_output, video_stats])
+    return ui
+
+
+def post_init_state(state: State):
+    """
+    Finalizes the initialization of the state.
+
+    :param state: the state to update
+    :type state: State
+    """
+    state.logger = _logger
+    init_render_state(state)
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """
+    Creates the parser for the command-line options.
+
+    :return: the parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = create_parser("Object detection interface for webcam streams and video files. Sends the frames "
+                           + "to the model and overlays the predictions, dropping stale frames if the model "
+                           + "cannot keep up.",
+                           PROG, model_channel_in="images", model_channel_out="predictions",
+                           timeout=1.0, ui_title="Object detection (video)",
+                           ui_desc="Sends the frames of the webcam stream or uploaded video to the model and overlays the predicted objects on them.")
+    add_render_arguments(parser)
+    parser.add_argument("--frames_in_flight", metavar="NUM", help="The maximum number of frames sent to the model at the same time, newer frames replace the one waiting (requires --envelope or --replicas for more than one).", default=1, type=int, required=False)
+    parser.add_argument("--frame_quality", metavar="NUM", help="The JPEG quality for sending the frames to the model (1-100).", default=90, type=int, required=False)
+    parser.add_argument("--stream_interval", metavar="SECONDS", help="The interval for sending webcam frames from the browser.", default=0.1, type=float, required=False)
+    parser.add_argument("--stats_interval", metavar="SECONDS", help="The interval for logging frame rate and latencies (at INFO level), <=0 for never.", default=5.0, type=float, required=False)
+    return parser
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    global state
+    init_logging()
+    parser = create_argparser()
+    parsed = parser.parse_args(args=args)
+    set_logging_level(_logger, parsed.logging_level)
+    state = init_state(parsed)
+    post_init_state(state)
+    ui = create_interface(state)
+    ui.launch(show_api=False, share=parsed.share_interface, inbrowser=parsed.launch_browser)
+
+
+def sys_main() -> int:
+    """
+    Runs the main function using the system cli arguments, and
+    returns a system error code.
+
+    :return: 0 for success, 1 for failure.
+    """
+    try:
+        main()
+        return 0
+    except Exception:
+        traceback.print_exc()
+        print("options: %s" % str(sys.argv[1:]), file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    main()
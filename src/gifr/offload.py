@@ -0,0 +1,126 @@
+import hashlib
+import threading
+
+from typing import Optional, Union
+
+import redis
+
+from gifr.envelope import pack, HEADER_REF
+
+
+KEY_PREFIX = "gifr:blob:"
+""" the prefix for the keys that the payloads get stored under. """
+
+
+def content_key(payload: bytes) -> str:
+    """
+    Generates the key to store the payload under, based on its content.
+
+    :param payload: the payload to generate the key for
+    :type payload: bytes
+    :return: the key
+    :rtype: str
+    """
+    return KEY_PREFIX + hashlib.blake2b(payload, digest_size=20).hexdigest()
+
+
+class Offloader:
+    """
+    Stores payloads above a size threshold under a content-hash key (with expiry)
+    and publishes only an envelope with a reference to the key (claim check).
+    Identical payloads reuse the existing key (if still present), only refreshing its expiry.
+    """
+
+    def __init__(self, connection: redis.Redis, threshold: int, ttl: int = 300):
+        """
+        Initializes the offloader.
+
+        :param connection: the redis connection to use
+        :type connection: redis.Redis
+        :param threshold: the size in bytes above which to offload payloads, <1 to never offload
+        :type threshold: int
+        :param ttl: the number of seconds to keep the payloads
+        :type ttl: int
+        """
+        self.connection = connection
+        self.threshold = threshold
+        self.ttl = max(1, ttl)
+        self.offloaded = 0
+        self.deduplicated = 0
+        self.bytes_offloaded = 0
+        self._lock = threading.Lock()
+
+    def publish(self, channel: str, header: dict, payload: Union[bytes, str]):
+        """
+        Publishes the payload wrapped in an envelope, offloading it if it exceeds the threshold.
+        Storing the payload and publishing the envelope happens in a single round trip.
+        The payload always gets sent along, as the key may have been evicted in the meantime;
+        redis only stores it if the key does not exist yet.
+
+        :param channel: the channel to publish on
+        :type channel: str
+        :param header: the header of the envelope
+        :type header: dict
+        :param payload: the payload to send
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if (self.threshold < 1) or (len(payload) <= self.threshold):
+            self.connection.publish(channel, pack(header, payload))
+            return
+
+        key = content_key(payload)
+        header = dict(header)
+        header[HEADER_REF] = key
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.set(key, payload, nx=True, ex=self.ttl)
+        # refreshes the expiry in case the key already existed
+        pipe.expire(key, self.ttl)
+        pipe.publish(channel, pack(header, b""))
+        stored = pipe.execute()[0]
+        with self._lock:
+            if stored:
+                self.offloaded += 1
+                self.bytes_offloaded += len(payload)
+            else:
+                self.deduplicated += 1
+
+    def resolve(self, header: dict, payload: bytes) -> Optional[bytes]:
+        """
+        Retrieves the payload if the envelope only contains a reference.
+
+        :param header: the header of the envelope
+        :type header: dict
+        :param payload: the payload of the envelope
+        :type payload: bytes
+        :return: the actual payload, None if the referenced payload is no longer available
+        :rtype: bytes
+        """
+        return resolve(self.connection, header, payload)
+
+    def stats(self) -> str:
+        """
+        Returns the statistics.
+
+        :return: the statistics
+        :rtype: str
+        """
+        return "offloaded=%d (%d bytes), deduplicated=%d" % (self.offloaded, self.bytes_offloaded, self.deduplicated)
+
+
+def resolve(connection: redis.Redis, header: dict, payload: bytes) -> Optional[bytes]:
+    """
+    Retrieves the payload if the envelope only contains a reference.
+
+    :param connection: the redis connection to use
+    :type connection: redis.Redis
+    :param header: the header of the envelope
+    :type header: dict
+    :param payload: the payload of the envelope
+    :type payload: bytes
+    :return: the actual payload, None if the referenced payload is no longer available
+    :rtype: bytes
+    """
+    if HEADER_REF not in header:
+        return payload
+    return connection.get(header[HEADER_REF])
@@ -0,0 +1,188 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from PIL import Image
+from typing import List, Optional, Tuple, Union
+
+OUTPUT_PNG = "png"
+OUTPUT_JPEG = "jpeg"
+OUTPUT_WEBP = "webp"
+OUTPUT_FORMATS = [
+    OUTPUT_PNG,
+    OUTPUT_JPEG,
+    OUTPUT_WEBP,
+]
+
+OUTPUT_EXTENSIONS = {
+    OUTPUT_PNG: ".png",
+    OUTPUT_JPEG: ".jpg",
+    OUTPUT_WEBP: ".webp",
+}
+
+OUTPUT_TTL = 300
+""" the number of seconds to keep the encoded files around for the web interface to pick them up. """
+
+
+class OutputEncoder:
+    """
+    Encodes the rendered images before returning them to the web interface, rather than
+    letting the interface encode the arrays losslessly as PNG. Large images can get
+    downscaled for display, with the full resolution image being offered for download.
+    The files get written to a temporary directory and removed again after a while.
+    """
+
+    def __init__(self, output_format: str, quality: int = 85, compression: int = 1, max_size: int = 0,
+                 ttl: int = OUTPUT_TTL):
+        """
+        Initializes the encoder.
+
+        :param output_format: the format to use (png|jpeg|webp)
+        :type output_format: str
+        :param quality: the quality for JPEG and WebP (1-100)
+        :type quality: int
+        :param compression: the compression level for PNG (0-9)
+        :type compression: int
+        :param max_size: the maximum width/height of the image for display, <1 for no downscaling
+        :type max_size: int
+        :param ttl: the number of seconds to keep the files
+        :type ttl: int
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise Exception("Unsupported output format (%s): %s" % ("|".join(OUTPUT_FORMATS), output_format))
+        self.output_format = output_format
+        self.quality = quality
+        self.compression = compression
+        self.max_size = max_size
+        self.ttl = ttl
+        self.directory = None
+        self._last_cleanup = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def downscales(self) -> bool:
+        """
+        Returns whether images get downscaled for display.
+
+        :return: True if downscaling
+        :rtype: bool
+        """
+        return self.max_size > 0
+
+    def _cleanup(self):
+        """
+        Removes the files that are older than the TTL.
+        """
+        now = time.time()
+        if (self.directory is None) or (now - self._last_cleanup < self.ttl / 10):
+            return
+        self._last_cleanup = now
+        for f in os.listdir(self.directory):
+            path = os.path.join(self.directory, f)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except Exception:
+                pass
+
+    def _write(self, img: Image.Image, name: str) -> str:
+        """
+        Encodes the image and writes it to the output directory.
+
+        :param img: the image to encode
+        :type img: Image.Image
+        :param name: the file name (without extension)
+        :type name: str
+        :return: the file
+        :rtype: str
+        """
+        with self._lock:
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix="gifr-output-")
+        path = os.path.join(self.directory, name + OUTPUT_EXTENSIONS[self.output_format])
+        if self.output_format == OUTPUT_JPEG:
+            if img.mode not in ["L", "RGB"]:
+                img = img.convert("RGB")
+            img.save(path, format="JPEG", quality=self.quality)
+        elif self.output_format == OUTPUT_WEBP:
+            img.save(path, format="WEBP", quality=self.quality)
+        else:
+            img.save(path, format="PNG", compress_level=self.compression)
+        return path
+
+    def encode(self, img: Union[Image.Image, np.ndarray]) -> Tuple[str, Optional[str]]:
+        """
+        Encodes the image.
+
+        :param img: the image to encode
+        :return: the file for display and the full resolution file (None if not downscaled)
+        :rtype: tuple
+        """
+        self._cleanup()
+        if isinstance(img, np.ndarray):
+            img = Image.fromarray(img)
+        name = uuid.uuid4().hex
+        if (not self.downscales) or (max(img.size) <= self.max_size):
+            path = self._write(img, name)
+            return path, (path if self.downscales else None)
+        display = img.copy()
+        display.thumbnail((self.max_size, self.max_size))
+        return self._write(display, name + "-display"), self._write(img, name)
+
+
+def add_output_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the options for encoding the rendered images to the parser.
+
+    :param parser: the parser to extend
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--output_format", choices=OUTPUT_FORMATS, default=None, help="The format to encode the rendered images in before returning them, rather than letting the web interface encode them losslessly as PNG.")
+    parser.add_argument("--output_quality", metavar="NUM", help="The quality for encoding the rendered images as JPEG or WebP (1-100).", default=85, type=int, required=False)
+    parser.add_argument("--output_compression", metavar="NUM", help="The compression level for encoding the rendered images as PNG (0-9).", default=1, type=int, required=False)
+    parser.add_argument("--output_max_size", metavar="NUM", help="The maximum width/height of the displayed images (requires --output_format), larger images get downscaled and the full resolution gets offered for download; <1 for no downscaling.", default=0, type=int, required=False)
+
+
+def create_encoder(params: dict) -> Optional[OutputEncoder]:
+    """
+    Creates the encoder from the parsed options.
+
+    :param params: the parsed options
+    :type params: dict
+    :return: the encoder, None if the rendered images get returned as is
+    :rtype: OutputEncoder
+    """
+    if params["output_format"] is None:
+        if params["output_max_size"] > 0:
+            raise Exception("Downscaling the output requires --output_format!")
+        return None
+    return OutputEncoder(params["output_format"], quality=params["output_quality"],
+                         compression=params["output_compression"], max_size=params["output_max_size"])
+
+
+def encode_images(encoder: Optional[OutputEncoder], images: List[Union[Image.Image, np.ndarray]]) -> Tuple[list, list]:
+    """
+    Turns the rendered images into the outputs for the web interface.
+
+    :param encoder: the encoder to use, None to return the images as arrays
+    :type encoder: OutputEncoder
+    :param images: the rendered images
+    :type images: list
+    :return: the images for display (arrays or files) and the full resolution files (empty if not downscaling)
+    :rtype: tuple
+    """
+    if encoder is None:
+        return [np.asarray(x) for x in images], []
+    display = []
+    full = []
+    for img in images:
+        d, f = encoder.encode(img)
+        display.append(d)
+        if f is not None:
+            full.append(f)
+    return display, full
@@ -0,0 +1,201 @@
+import contextvars
+import threading
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITIES = [
+    PRIORITY_INTERACTIVE,
+    PRIORITY_BULK,
+]
+
+DEFAULT_WINDOW = 1000
+""" the default number of latencies to keep per priority class. """
+
+_priority = contextvars.ContextVar("gifr_priority", default=PRIORITY_INTERACTIVE)
+""" the priority class of the requests made in the current context. """
+
+
+def current_priority() -> str:
+    """
+    Returns the priority class of the requests made in the current context.
+    Requests are interactive unless specified otherwise via request_priority.
+
+    :return: the priority class, see PRIORITIES
+    :rtype: str
+    """
+    return _priority.get()
+
+
+@contextmanager
+def request_priority(priority: str):
+    """
+    Context manager for setting the priority class of the requests made within,
+    e.g., for scripted bulk jobs:
+
+        with request_priority(PRIORITY_BULK):
+            classify(state, content)
+
+    :param priority: the priority class, see PRIORITIES
+    :type priority: str
+    """
+    if priority not in PRIORITIES:
+        raise Exception("Invalid priority (%s): %s" % ("|".join(PRIORITIES), priority))
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class LatencyWindow:
+    """
+    Keeps the most recent latencies for computing percentiles.
+    """
+
+    def __init__(self, size: int = DEFAULT_WINDOW):
+        """
+        Initializes the window.
+
+        :param size: the maximum number of latencies to keep
+        :type size: int
+        """
+        self.count = 0
+        self.failures = 0
+        self._latencies = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: Optional[float]):
+        """
+        Records the latency of a request.
+
+        :param seconds: the latency in seconds, None if the request failed
+        :type seconds: float
+        """
+        with self._lock:
+            self.count += 1
+            if seconds is None:
+                self.failures += 1
+            else:
+                self._latencies.append(seconds)
+
+    def __len__(self) -> int:
+        """
+        Returns the number of latencies in the window.
+
+        :return: the number of latencies
+        :rtype: int
+        """
+        return len(self._latencies)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Returns the percentile of the latencies in the window.
+
+        :param q: the percentile (0-100)
+        :type q: float
+        :return: the latency in seconds, None if no latencies recorded yet
+        :rtype: float
+        """
+        with self._lock:
+            if len(self._latencies) == 0:
+                return None
+            return float(np.percentile(self._latencies, q))
+
+    def fraction_within(self, limit: float) -> Optional[float]:
+        """
+        Returns the fraction of the successful requests in the window that completed within the limit.
+
+        :param limit: the latency limit in seconds
+        :type limit: float
+        :return: the fraction (0-1), None if no latencies recorded yet
+        :rtype: float
+        """
+        with self._lock:
+            if len(self._latencies) == 0:
+                return None
+            return np.count_nonzero(np.asarray(self._latencies) <= limit) / len(self._latencies)
+
+
+class PriorityLanes:
+    """
+    Keeps track of the priority classes: their scheduling weights, the channels
+    the requests get sent to (if different from the model channels) and
+    the latency statistics.
+    """
+
+    def __init__(self, weights: Dict[str, int] = None, channels: Dict[str, Tuple[str, str]] = None,
+                 slo: float = 0.0, window: int = DEFAULT_WINDOW):
+        """
+        Initializes the lanes.
+
+        :param weights: the scheduling weight per priority class, defaults to 1
+        :type weights: dict
+        :param channels: the (channel_in, channel_out) tuple per priority class, for using dedicated channels
+        :type channels: dict
+        :param slo: the latency objective in seconds for interactive requests, <=0 for none
+        :type slo: float
+        :param window: the number of latencies to keep per priority class
+        :type window: int
+        """
+        self.weights = {x: 1 for x in PRIORITIES}
+        if weights is not None:
+            for priority, weight in weights.items():
+                if weight < 1:
+                    raise Exception("Weight for priority '%s' must be at least 1: %d" % (priority, weight))
+                self.weights[priority] = weight
+        self.channels = dict() if channels is None else dict(channels)
+        self.slo = slo
+        self.latencies = {x: LatencyWindow(window) for x in PRIORITIES}
+
+    def channels_for(self, priority: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns the dedicated channels of the priority class.
+
+        :param priority: the priority class
+        :type priority: str
+        :return: the (channel_in, channel_out) tuple, None if the class uses the model channels
+        :rtype: tuple
+        """
+        return self.channels.get(priority, None)
+
+    def record(self, priority: str, seconds: Optional[float]):
+        """
+        Records the latency of a request.
+
+        :param priority: the priority class of the request
+        :type priority: str
+        :param seconds: the latency in seconds, None if the request failed
+        :type seconds: float
+        """
+        self.latencies[priority].add(seconds)
+
+    def stats(self) -> str:
+        """
+        Returns the latency statistics per priority class.
+
+        :return: the statistics
+        :rtype: str
+        """
+        result = []
+        for priority in PRIORITIES:
+            window = self.latencies[priority]
+            if window.count == 0:
+                continue
+            p50 = window.percentile(50)
+            p95 = window.percentile(95)
+            s = "%s: n=%d, failed=%d, p50=%s, p95=%s" % (
+                priority, window.count, window.failures,
+                "-" if p50 is None else ("%0.3fs" % p50),
+                "-" if p95 is None else ("%0.3fs" % p95))
+            if (priority == PRIORITY_INTERACTIVE) and (self.slo > 0):
+                within = window.fraction_within(self.slo)
+                s += ", within %0.3fs=%s" % (self.slo, "-" if within is None else ("%0.1f%%" % (within * 100.0)))
+            result.append(s)
+        return " | ".join(result)
@@ -0,0 +1,283 @@
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from collections import Counter
+from typing import Dict, Optional
+
+
+ENV_GIFR_PROFILE = "GIFR_PROFILE"
+""" environment variable for starting a profiling session right away. """
+
+
+_profiler = None
+""" the installed profiler, None if the hook is not enabled. """
+
+_active = False
+""" whether a profiling session is running, checked by the request hooks. """
+
+
+def collapse(frame, thread_name: str) -> str:
+    """
+    Turns the stack of the frame into a line of the collapsed stack format
+    (root first, frames separated by semicolons), as used by flamegraph.pl or speedscope.
+
+    :param frame: the innermost frame of the stack
+    :param thread_name: the name of the thread, used as root of the stack
+    :type thread_name: str
+    :return: the collapsed stack
+    :rtype: str
+    """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append("%s (%s:%d)" % (code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    frames.append(thread_name)
+    frames.reverse()
+    return ";".join(frames)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads at a fixed interval while a session is running
+    and writes them in collapsed stack format for flame graphs. When profiling only
+    slow requests, the samples of a request get kept only if it exceeds the threshold.
+    """
+
+    def __init__(self, output_dir: str, seconds: float = 30.0, requests: int = 0, slow: float = 0.0,
+                 interval: float = 0.005, logger: logging.Logger = None):
+        """
+        Initializes the profiler.
+
+        :param output_dir: the directory to write the profiles to
+        :type output_dir: str
+        :param seconds: the maximum duration of a session, <=0 for no limit
+        :type seconds: float
+        :param requests: the number of requests after which to end a session, <1 for no limit
+        :type requests: int
+        :param slow: the duration in seconds above which requests get profiled, <=0 to profile everything
+        :type slow: float
+        :param interval: the sampling interval in seconds
+        :type interval: float
+        :param logger: the logger to use
+        :type logger: logging.Logger
+        """
+        self.output_dir = output_dir
+        self.seconds = seconds
+        self.requests = requests
+        self.slow = slow
+        self.interval = interval
+        self.logger = logger if logger is not None else logging.getLogger("gifr-profiler")
+        self.stacks = Counter()
+        self.samples = 0
+        self.num_requests = 0
+        self.num_slow = 0
+        self._in_request: Dict[int, Counter] = dict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def active(self) -> bool:
+        """
+        Returns whether a session is running.
+
+        :return: whether running
+        :rtype: bool
+        """
+        return (self._thread is not None) and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """
+        Starts a new session, unless one is already running.
+
+        :return: whether a session got started
+        :rtype: bool
+        """
+        global _active
+        with self._lock:
+            if self.active:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.num_requests = 0
+            self.num_slow = 0
+            self._in_request = dict()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="gifr-profiler", daemon=True)
+            self._thread.start()
+            _active = True
+        if self.slow > 0:
+            self.logger.info("Profiling requests slower than %0.3fs..." % self.slow)
+        else:
+            self.logger.info("Profiling...")
+        return True
+
+    def stop(self):
+        """
+        Ends the running session, which writes the profile.
+        """
+        self._stop.set()
+
+    def _run(self):
+        """
+        Samples the stacks until the session ends, then writes the profile.
+        """
+        global _active
+        own = threading.get_ident()
+        end = (time.monotonic() + self.seconds) if (self.seconds > 0) else None
+        while not self._stop.wait(self.interval):
+            if (end is not None) and (time.monotonic() >= end):
+                break
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    if self.slow > 0:
+                        if ident not in self._in_request:
+                            continue
+                        stacks = self._in_request[ident]
+                    else:
+                        stacks = self.stacks
+                    stacks[collapse(frame, names.get(ident, str(ident)))] += 1
+                self.samples += 1
+            del frames
+        with self._lock:
+            _active = False
+            self._in_request = dict()
+        self._write()
+
+    def _write(self):
+        """
+        Writes the collected stacks to a new file in the output directory.
+        """
+        if len(self.stacks) == 0:
+            self.logger.info("Profiling ended, no samples to write (requests: %d)" % self.num_requests)
+            return
+        path = os.path.join(self.output_dir, "gifr-profile-%d-%s.folded" % (os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("%s %d\n" % (stack, count))
+        if self.slow > 0:
+            self.logger.info("Profile of %d/%d slow request(s) written to: %s" % (self.num_slow, self.num_requests, path))
+        else:
+            self.logger.info("Profile of %d sample(s) and %d request(s) written to: %s" % (self.samples, self.num_requests, path))
+
+    def request_started(self):
+        """
+        Notes that the current thread starts processing a request.
+        """
+        if self.slow <= 0:
+            return
+        with self._lock:
+            if _active:
+                self._in_request[threading.get_ident()] = Counter()
+
+    def request_finished(self, seconds: float):
+        """
+        Notes that the current thread finished processing a request.
+
+        :param seconds: the duration of the request
+        :type seconds: float
+        """
+        with self._lock:
+            stacks = self._in_request.pop(threading.get_ident(), None)
+            if (stacks is not None) and (seconds >= self.slow):
+                self.stacks.update(stacks)
+                self.num_slow += 1
+            self.num_requests += 1
+            done = (self.requests > 0) and (self.num_requests >= self.requests)
+        if done:
+            self.stop()
+
+
+def _on_signal(signum, frame):
+    """
+    Starts a session or ends the running one.
+    """
+    if _profiler is None:
+        return
+    # not touching the profiler's lock in the signal handler
+    threading.Thread(target=_toggle, daemon=True).start()
+
+
+def _toggle():
+    """
+    Starts a session or ends the running one.
+    """
+    if not _profiler.start():
+        _profiler.stop()
+
+
+def init_profiling(output_dir: Optional[str], seconds: float = 30.0, requests: int = 0, slow: float = 0.0,
+                   interval: float = 0.005, logger: logging.Logger = None) -> Optional[SamplingProfiler]:
+    """
+    Enables the profiling hook if an output directory is specified: sending SIGUSR1 to
+    the process starts a session, sending it again ends the session early. If the
+    GIFR_PROFILE environment variable is set (to anything but 0), a session starts right away.
+
+    :param output_dir: the directory to write the profiles to, None to not enable the hook
+    :type output_dir: str
+    :param seconds: the maximum duration of a session, <=0 for no limit
+    :type seconds: float
+    :param requests: the number of requests after which to end a session, <1 for no limit
+    :type requests: int
+    :param slow: the duration in seconds above which requests get profiled, <=0 to profile everything
+    :type slow: float
+    :param interval: the sampling interval in seconds
+    :type interval: float
+    :param logger: the logger to use
+    :type logger: logging.Logger
+    :return: the profiler, None if not enabled
+    :rtype: SamplingProfiler
+    """
+    global _profiler
+    if output_dir is None:
+        return None
+    if _profiler is not None:
+        return _profiler
+    if not os.path.isdir(output_dir):
+        raise Exception("Profile directory does not exist: %s" % output_dir)
+    _profiler = SamplingProfiler(output_dir, seconds=seconds, requests=requests, slow=slow, interval=interval, logger=logger)
+    if hasattr(signal, "SIGUSR1") and (threading.current_thread() is threading.main_thread()):
+        signal.signal(signal.SIGUSR1, _on_signal)
+    else:
+        _profiler.logger.warning("Cannot install SIGUSR1 handler, use %s instead" % ENV_GIFR_PROFILE)
+    if os.getenv(ENV_GIFR_PROFILE, "0") != "0":
+        _profiler.start()
+    return _profiler
+
+
+def profiling() -> bool:
+    """
+    Returns whether a profiling session is running.
+
+    :return: whether profiling
+    :rtype: bool
+    """
+    return _active
+
+
+def request_started():
+    """
+    Notes that the current thread starts processing a request. Does nothing if not profiling.
+    """
+    if _active:
+        _profiler.request_started()
+
+
+def request_finished(seconds: float):
+    """
+    Notes that the current thread finished processing a request. Does nothing if not profiling.
+
+    :param seconds: the duration of the request
+    :type seconds: float
+    """
+    if _active:
+        _profiler.request_finished(seconds)
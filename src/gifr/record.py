@@ -0,0 +1,231 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from typing import Iterator, Optional, Union
+
+
+BLOBS_DIR = "blobs"
+""" the sub-directory that the request/response payloads get stored in. """
+
+TRAFFIC_PATTERN = "traffic-*.jsonl"
+""" the glob for the files with the request records. """
+
+MAX_KNOWN = 10000
+""" the maximum number of stored keys to remember. """
+
+RECORD_TIME = "time"
+""" when the request started (seconds since the epoch). """
+
+RECORD_CHANNEL_IN = "channel_in"
+""" the channel the request was sent to. """
+
+RECORD_CHANNEL_OUT = "channel_out"
+""" the channel the response was received on. """
+
+RECORD_PRIORITY = "priority"
+""" the priority class of the request. """
+
+RECORD_REQUEST = "request"
+""" the key of the request payload. """
+
+RECORD_REQUEST_SIZE = "request_size"
+""" the size of the request payload in bytes. """
+
+RECORD_RESPONSE = "response"
+""" the key of the response payload, None if no response. """
+
+RECORD_RESPONSE_SIZE = "response_size"
+""" the size of the response payload in bytes. """
+
+RECORD_LATENCY = "latency"
+""" the number of seconds until the response arrived (or the request failed). """
+
+
+def blob_key(payload: bytes) -> str:
+    """
+    Generates the key to store the payload under, based on its content.
+
+    :param payload: the payload to generate the key for
+    :type payload: bytes
+    :return: the key
+    :rtype: str
+    """
+    return hashlib.blake2b(payload, digest_size=20).hexdigest()
+
+
+def blob_path(directory: str, key: str) -> str:
+    """
+    Returns the path of the file that the payload with the key gets stored in.
+
+    :param directory: the recording directory
+    :type directory: str
+    :param key: the key of the payload
+    :type key: str
+    :return: the path
+    :rtype: str
+    """
+    return os.path.join(directory, BLOBS_DIR, key[:2], key)
+
+
+def load_blob(directory: str, key: Optional[str]) -> Optional[bytes]:
+    """
+    Loads the payload with the key.
+
+    :param directory: the recording directory
+    :type directory: str
+    :param key: the key of the payload, None for no payload
+    :type key: str
+    :return: the payload, None if no key
+    :rtype: bytes
+    """
+    if key is None:
+        return None
+    with open(blob_path(directory, key), "rb") as f:
+        return f.read()
+
+
+def read_traffic(directory: str) -> Iterator[dict]:
+    """
+    Reads the request records from all traffic files in the directory, ordered by start time.
+
+    :param directory: the recording directory
+    :type directory: str
+    :return: the iterator over the records
+    """
+    result = []
+    for path in sorted(glob.glob(os.path.join(directory, TRAFFIC_PATTERN))):
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                try:
+                    result.append(json.loads(line))
+                except Exception:
+                    # incomplete last line of a file that is still being written
+                    continue
+    result.sort(key=lambda x: x[RECORD_TIME])
+    return iter(result)
+
+
+class TrafficRecorder:
+    """
+    Records request/response pairs with their timings. The records get appended to
+    JSON lines files (a new file once the maximum size is reached, each process
+    writing its own files), the payloads get stored once per content in the blobs
+    sub-directory.
+    """
+
+    def __init__(self, directory: str, max_size: int = 100 * 1024 * 1024):
+        """
+        Initializes the recorder.
+
+        :param directory: the directory to record the traffic in
+        :type directory: str
+        :param max_size: the size in bytes after which to start a new traffic file
+        :type max_size: int
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.recorded = 0
+        self._prefix = "traffic-%s-%d" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+        self._index = 0
+        self._file = None
+        self._known = set()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, BLOBS_DIR), exist_ok=True)
+
+    def _store(self, payload: Union[bytes, str, None]) -> Optional[str]:
+        """
+        Stores the payload, unless already stored.
+
+        :param payload: the payload to store, ignored if None
+        :return: the key of the payload, None if no payload
+        :rtype: str
+        """
+        if payload is None:
+            return None
+        if isinstance(payload, str):
+            payload = payload.encode()
+        key = blob_key(payload)
+        if key in self._known:
+            return key
+        path = blob_path(self.directory, key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+            with open(tmp, "wb") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        if len(self._known) >= MAX_KNOWN:
+            self._known.clear()
+        self._known.add(key)
+        return key
+
+    def _append(self, record: dict):
+        """
+        Appends the record to the current traffic file, starting a new one if necessary.
+
+        :param record: the record to append
+        :type record: dict
+        """
+        if (self._file is not None) and (self._file.tell() >= self.max_size):
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            self._index += 1
+            path = os.path.join(self.directory, "%s-%04d.jsonl" % (self._prefix, self._index))
+            self._file = open(path, "a")
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def record(self, channel_in: str, channel_out: str, priority: str, request: Union[bytes, str],
+               response: Optional[bytes], start: float, latency: float):
+        """
+        Records the request/response pair.
+
+        :param channel_in: the channel the request was sent to
+        :type channel_in: str
+        :param channel_out: the channel the response was received on
+        :type channel_out: str
+        :param priority: the priority class of the request
+        :type priority: str
+        :param request: the request payload
+        :param response: the response payload, None if no response
+        :type response: bytes
+        :param start: when the request started (seconds since the epoch)
+        :type start: float
+        :param latency: the number of seconds until the response arrived (or the request failed)
+        :type latency: float
+        """
+        if isinstance(request, str):
+            request = request.encode()
+        with self._lock:
+            request_key = self._store(request)
+            response_key = self._store(response)
+            self._append({
+                RECORD_TIME: start,
+                RECORD_CHANNEL_IN: channel_in,
+                RECORD_CHANNEL_OUT: channel_out,
+                RECORD_PRIORITY: priority,
+                RECORD_REQUEST: request_key,
+                RECORD_REQUEST_SIZE: len(request),
+                RECORD_RESPONSE: response_key,
+                RECORD_RESPONSE_SIZE: None if response is None else len(response),
+                RECORD_LATENCY: latency,
+            })
+            self.recorded += 1
+
+    def close(self):
+        """
+        Closes the current traffic file.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
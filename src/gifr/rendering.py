@@ -0,0 +1,188 @@
+import importlib
+import multiprocessing
+
+import numpy as np
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Tuple
+
+_module = None
+""" the interface module of the worker process. """
+
+_state = None
+""" the state of the worker process. """
+
+
+def _init_worker(module_name: str, options: dict):
+    """
+    Initializes the worker process with its own state, using the options of the interface.
+
+    :param module_name: the interface module, e.g., gifr.object_detection
+    :type module_name: str
+    :param options: the parsed options of the interface
+    :type options: dict
+    """
+    global _module, _state
+    from gifr.common import State
+    _module = importlib.import_module(module_name)
+    _state = State(params=dict(options))
+    _module.post_init_state(_state)
+
+
+def _ready() -> bool:
+    """
+    Does nothing, used for starting up the worker processes.
+    """
+    return True
+
+
+def _render(func_name: str, shm_name: str, shape: Tuple[int, ...], args: tuple) -> Any:
+    """
+    Calls the render function of the interface module and copies the image into the shared memory.
+
+    :param func_name: the name of the function in the interface module, returns the image and additional information
+    :type func_name: str
+    :param shm_name: the name of the shared memory block to copy the image into
+    :type shm_name: str
+    :param shape: the expected shape of the image array
+    :type shape: tuple
+    :param args: the arguments for the function (after the state)
+    :type args: tuple
+    :return: the additional information returned by the function
+    """
+    img, info = getattr(_module, func_name)(_state, *args)
+    arr = np.asarray(img)
+    if arr.shape != tuple(shape):
+        raise Exception("Rendered image has shape %s instead of %s!" % (str(arr.shape), str(tuple(shape))))
+    shm = SharedMemory(name=shm_name)
+    try:
+        np.ndarray(arr.shape, dtype=np.uint8, buffer=shm.buf)[:] = arr
+    finally:
+        shm.close()
+    return info
+
+
+class RenderJob:
+    """
+    An image being rendered in the pool.
+    """
+
+    def __init__(self, future: Future, shm: SharedMemory, shape: Tuple[int, ...]):
+        """
+        Initializes the job.
+
+        :param future: the future of the worker call
+        :type future: Future
+        :param shm: the shared memory block receiving the image
+        :type shm: SharedMemory
+        :param shape: the shape of the image array
+        :type shape: tuple
+        """
+        self.future = future
+        self.shm = shm
+        self.shape = shape
+
+    def result(self) -> Tuple[np.ndarray, Any]:
+        """
+        Waits for the rendering to finish and releases the shared memory.
+
+        :return: the image array and the additional information returned by the render function
+        :rtype: tuple
+        """
+        try:
+            info = self.future.result()
+            return np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf).copy(), info
+        finally:
+            self.shm.close()
+            self.shm.unlink()
+
+
+class RenderPool:
+    """
+    Offloads decoding and rendering of images to a pool of processes, so that the CPU-bound
+    rendering of concurrent requests can use multiple cores and does not block the interface
+    process. Each worker process initializes its own state from the options of the interface.
+    The rendered images get handed back via shared memory rather than getting pickled, only
+    file names, model responses and colors get sent to the workers.
+    """
+
+    def __init__(self, workers: int, module_name: str, options: dict):
+        """
+        Initializes the pool and starts the worker processes.
+
+        :param workers: the number of worker processes
+        :type workers: int
+        :param module_name: the interface module providing the render functions, e.g., gifr.object_detection
+        :type module_name: str
+        :param options: the parsed options of the interface for initializing the state of the workers
+        :type options: dict
+        """
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker, initargs=(module_name, options))
+        for future in [self._executor.submit(_ready) for _ in range(workers)]:
+            future.result()
+
+    def submit(self, shape: Tuple[int, ...], func_name: str, *args) -> RenderJob:
+        """
+        Renders an image in one of the worker processes.
+
+        :param shape: the shape of the uint8 array of the rendered image
+        :type shape: tuple
+        :param func_name: the name of the function in the interface module, gets called with the worker's state
+                          and the arguments and returns the image and additional information
+        :type func_name: str
+        :param args: the arguments for the function, need to be picklable
+        :return: the job to obtain the result from
+        :rtype: RenderJob
+        """
+        shm = SharedMemory(create=True, size=max(1, int(np.prod(shape))))
+        try:
+            future = self._executor.submit(_render, func_name, shm.name, shape, args)
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+        return RenderJob(future, shm, shape)
+
+    def render(self, shape: Tuple[int, ...], func_name: str, *args) -> Tuple[np.ndarray, Any]:
+        """
+        Renders an image in one of the worker processes and waits for the result.
+
+        :param shape: the shape of the uint8 array of the rendered image
+        :type shape: tuple
+        :param func_name: the name of the function in the interface module
+        :type func_name: str
+        :param args: the arguments for the function, need to be picklable
+        :return: the image array and the additional information returned by the function
+        :rtype: tuple
+        """
+        return self.submit(shape, func_name, *args).result()
+
+    def close(self):
+        """
+        Shuts down the worker processes.
+        """
+        self._executor.shutdown(wait=True)
+
+
+def image_shape(size: Tuple[int, int], mode: str) -> Tuple[int, ...]:
+    """
+    Returns the shape of the uint8 array of an image.
+
+    :param size: the width and height of the image
+    :type size: tuple
+    :param mode: the image mode (L, RGB or RGBA)
+    :type mode: str
+    :return: the shape
+    :rtype: tuple
+    """
+    width, height = size
+    if mode == "L":
+        return height, width
+    if mode == "RGB":
+        return height, width, 3
+    if mode == "RGBA":
+        return height, width, 4
+    raise Exception("Unsupported image mode: %s" % mode)
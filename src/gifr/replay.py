@@ -0,0 +1,321 @@
+import argparse
+import json
+import logging
+import math
+import threading
+import time
+import traceback
+
+import numpy as np
+import redis
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+from gifr.common import init_logging, set_logging_level, State, make_prediction, LOGGING_LEVELS, LOGGING_WARN
+from gifr.priority import request_priority, PRIORITY_INTERACTIVE
+from gifr.record import read_traffic, load_blob, RECORD_TIME, RECORD_CHANNEL_IN, RECORD_CHANNEL_OUT, RECORD_PRIORITY, \
+    RECORD_REQUEST, RECORD_RESPONSE, RECORD_LATENCY
+
+PROG: str = "gifr-replay"
+
+_logger = logging.getLogger(PROG)
+
+OUTPUT_IDENTICAL = "identical"
+""" the replayed output is byte-identical to the recorded one. """
+
+OUTPUT_EQUIVALENT = "equivalent"
+""" the replayed output is JSON that equals the recorded one (within the tolerance for numbers). """
+
+OUTPUT_DIFFERENT = "different"
+""" the replayed output differs from the recorded one. """
+
+OUTPUT_MISSING = "missing"
+""" no output received when replaying, but one was recorded. """
+
+OUTPUT_UNKNOWN = "unknown"
+""" no output was recorded, nothing to compare against. """
+
+
+def equal_json(recorded: Any, replayed: Any, tolerance: float) -> bool:
+    """
+    Compares the parsed JSON structures, allowing numbers to differ by the tolerance.
+
+    :param recorded: the recorded structure
+    :param replayed: the replayed structure
+    :param tolerance: the maximum absolute difference between numbers
+    :type tolerance: float
+    :return: whether equal
+    :rtype: bool
+    """
+    if isinstance(recorded, bool) or isinstance(replayed, bool):
+        return recorded == replayed
+    if isinstance(recorded, (int, float)) and isinstance(replayed, (int, float)):
+        return math.isclose(recorded, replayed, rel_tol=0.0, abs_tol=tolerance)
+    if isinstance(recorded, dict) and isinstance(replayed, dict):
+        if recorded.keys() != replayed.keys():
+            return False
+        return all(equal_json(recorded[k], replayed[k], tolerance) for k in recorded)
+    if isinstance(recorded, list) and isinstance(replayed, list):
+        if len(recorded) != len(replayed):
+            return False
+        return all(equal_json(a, b, tolerance) for a, b in zip(recorded, replayed))
+    return recorded == replayed
+
+
+def compare_outputs(recorded: Optional[bytes], replayed: Optional[bytes], tolerance: float) -> str:
+    """
+    Compares the replayed output with the recorded one.
+
+    :param recorded: the recorded output, None if none recorded
+    :type recorded: bytes
+    :param replayed: the replayed output, None if none received
+    :type replayed: bytes
+    :param tolerance: the maximum absolute difference between numbers in JSON outputs
+    :type tolerance: float
+    :return: the outcome, see OUTPUT_* constants
+    :rtype: str
+    """
+    if recorded is None:
+        return OUTPUT_UNKNOWN
+    if replayed is None:
+        return OUTPUT_MISSING
+    if recorded == replayed:
+        return OUTPUT_IDENTICAL
+    try:
+        if equal_json(json.loads(recorded.decode()), json.loads(replayed.decode()), tolerance):
+            return OUTPUT_EQUIVALENT
+    except Exception:
+        pass
+    return OUTPUT_DIFFERENT
+
+
+def percentiles(latencies: List[float]) -> str:
+    """
+    Formats the p50/p95/p99 of the latencies.
+
+    :param latencies: the latencies to summarize
+    :type latencies: list
+    :return: the summary
+    :rtype: str
+    """
+    if len(latencies) == 0:
+        return "-"
+    p = np.percentile(latencies, [50, 95, 99])
+    return "p50=%0.3fs, p95=%0.3fs, p99=%0.3fs" % (p[0], p[1], p[2])
+
+
+def replay_request(state: State, record: dict, directory: str, tolerance: float) -> dict:
+    """
+    Re-issues the recorded request and compares latency and output.
+
+    :param state: the state to use for sending the request
+    :type state: State
+    :param record: the recorded request
+    :type record: dict
+    :param directory: the recording directory
+    :type directory: str
+    :param tolerance: the maximum absolute difference between numbers in JSON outputs
+    :type tolerance: float
+    :return: the result (recorded/replayed latency, output comparison)
+    :rtype: dict
+    """
+    channel_in = state.channel_in if state.channel_in is not None else record[RECORD_CHANNEL_IN]
+    channel_out = state.channel_out if state.channel_out is not None else record[RECORD_CHANNEL_OUT]
+    request = load_blob(directory, record[RECORD_REQUEST])
+    with request_priority(record.get(RECORD_PRIORITY, None) or PRIORITY_INTERACTIVE):
+        start = time.perf_counter()
+        try:
+            output = make_prediction(state, request, channel_out=channel_out, channel_in=channel_in)
+        except Exception:
+            _logger.exception("Failed to replay request")
+            output = None
+        latency = time.perf_counter() - start
+    return {
+        RECORD_TIME: record[RECORD_TIME],
+        RECORD_CHANNEL_IN: channel_in,
+        RECORD_CHANNEL_OUT: channel_out,
+        "recorded_latency": record[RECORD_LATENCY] if record[RECORD_RESPONSE] is not None else None,
+        "replayed_latency": latency if output is not None else None,
+        "output": compare_outputs(load_blob(directory, record[RECORD_RESPONSE]), output, tolerance),
+    }
+
+
+def replay(state: State, directory: str, speed: float = 1.0, workers: int = 4, limit: int = 0,
+           tolerance: float = 1e-4, output_file: str = None) -> List[dict]:
+    """
+    Re-issues the recorded traffic, keeping the original timing between requests (scaled by the speed).
+
+    :param state: the state to use for sending the requests
+    :type state: State
+    :param directory: the recording directory
+    :type directory: str
+    :param speed: the factor for the original rate (2.0 = twice as fast), <=0 for sending as fast as possible
+    :type speed: float
+    :param workers: the maximum number of requests in flight
+    :type workers: int
+    :param limit: the maximum number of requests to replay, <1 for all
+    :type limit: int
+    :param tolerance: the maximum absolute difference between numbers in JSON outputs
+    :type tolerance: float
+    :param output_file: the JSON lines file to write the results per request to, None to not write any
+    :type output_file: str
+    :return: the results per request
+    :rtype: list
+    """
+    results = []
+    lock = threading.Lock()
+    out = open(output_file, "w") if output_file is not None else None
+
+    def process(record: dict):
+        result = replay_request(state, record, directory, tolerance)
+        with lock:
+            results.append(result)
+            if out is not None:
+                out.write(json.dumps(result) + "\n")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            first = None
+            start = time.monotonic()
+            for i, record in enumerate(read_traffic(directory)):
+                if (limit > 0) and (i >= limit):
+                    break
+                if first is None:
+                    first = record[RECORD_TIME]
+                if speed > 0:
+                    delay = start + (record[RECORD_TIME] - first) / speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                executor.submit(process, record)
+    finally:
+        if out is not None:
+            out.close()
+    return results
+
+
+def summarize(results: List[dict], seconds: float) -> dict:
+    """
+    Summarizes the results of the replay.
+
+    :param results: the results per request
+    :type results: list
+    :param seconds: the duration of the replay
+    :type seconds: float
+    :return: the summary
+    :rtype: dict
+    """
+    recorded = [x["recorded_latency"] for x in results if x["recorded_latency"] is not None]
+    replayed = [x["replayed_latency"] for x in results if x["replayed_latency"] is not None]
+    outputs = dict()
+    for x in results:
+        outputs[x["output"]] = outputs.get(x["output"], 0) + 1
+    comparable = len(results) - outputs.get(OUTPUT_UNKNOWN, 0)
+    matching = outputs.get(OUTPUT_IDENTICAL, 0) + outputs.get(OUTPUT_EQUIVALENT, 0)
+    return {
+        "requests": len(results),
+        "throughput": len(results) / seconds if seconds > 0 else 0.0,
+        "recorded_failures": len(results) - len(recorded),
+        "replayed_failures": len(results) - len(replayed),
+        "recorded_latency": recorded,
+        "replayed_latency": replayed,
+        "outputs": outputs,
+        "match": matching / comparable if comparable > 0 else 1.0,
+    }
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """
+    Creates the parser for the command-line options.
+
+    :return: the parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(
+        description="Re-issues traffic recorded with --record_dir, at the original, a scaled or the maximum rate, "
+                    + "and compares latencies and outputs with the recorded ones.",
+        prog=PROG,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--redis_host", metavar="HOST", help="The host with the redis server.", default="localhost", type=str, required=False)
+    parser.add_argument("--redis_port", metavar="PORT", help="The port of the redis server.", default=6379, type=int, required=False)
+    parser.add_argument("--redis_db", metavar="DB", help="The redis database to use.", default=0, type=int, required=False)
+    parser.add_argument("--record_dir", metavar="DIR", help="The directory with the recorded traffic.", type=str, required=True)
+    parser.add_argument("--model_channel_in", metavar="CHANNEL", help="The channel to send the requests to, uses the recorded channel if not provided.", default=None, type=str, required=False)
+    parser.add_argument("--model_channel_out", metavar="CHANNEL", help="The channel to receive the responses on, uses the recorded channel if not provided.", default=None, type=str, required=False)
+    parser.add_argument("--envelope", action="store_true", help="Whether to wrap the requests in envelopes (see gifr.envelope).")
+    parser.add_argument("--speed", metavar="FACTOR", help="The factor for the recorded rate (1 = original rate, 2 = twice as fast), <=0 for sending the requests as fast as possible.", default=1.0, type=float, required=False)
+    parser.add_argument("--workers", metavar="NUM", help="The maximum number of requests in flight.", default=4, type=int, required=False)
+    parser.add_argument("--limit", metavar="NUM", help="The maximum number of requests to replay, <1 for all.", default=0, type=int, required=False)
+    parser.add_argument("--tolerance", metavar="NUM", help="The maximum absolute difference between numbers in JSON outputs for them to be considered equivalent.", default=1e-4, type=float, required=False)
+    parser.add_argument("--output_file", metavar="FILE", help="The JSON lines file to write the results per request to.", default=None, type=str, required=False)
+    parser.add_argument("--max_latency_ratio", metavar="NUM", help="Fails if the 95th percentile of the replayed latencies exceeds the recorded one by more than this factor, <=0 for no check.", default=0.0, type=float, required=False)
+    parser.add_argument("--min_match", metavar="NUM", help="Fails if the fraction of outputs identical/equivalent to the recorded ones is below this value (0-1).", default=0.0, type=float, required=False)
+    parser.add_argument("--sleep_time", metavar="SECONDS", help="The sleep time in seconds for the pub-sub thread.", default=0.01, type=float, required=False)
+    parser.add_argument("--timeout", metavar="SECONDS", help="The number of seconds to wait for a response.", default=5.0, type=float, required=False)
+    parser.add_argument("--logging_level", choices=LOGGING_LEVELS, default=LOGGING_WARN, help="The logging level to use")
+    return parser
+
+
+def main(args=None) -> bool:
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    :return: whether the replay passed the checks
+    :rtype: bool
+    """
+    init_logging()
+    parser = create_argparser()
+    parsed = parser.parse_args(args=args)
+    set_logging_level(_logger, parsed.logging_level)
+    state = State(
+        connection=redis.Redis(host=parsed.redis_host, port=parsed.redis_port, db=parsed.redis_db),
+        channel_in=parsed.model_channel_in,
+        channel_out=parsed.model_channel_out,
+        timeout=parsed.timeout,
+        sleep_time=parsed.sleep_time,
+        logger=_logger,
+    )
+    state.params["envelope"] = parsed.envelope
+
+    start = time.monotonic()
+    results = replay(state, parsed.record_dir, speed=parsed.speed, workers=parsed.workers, limit=parsed.limit,
+                     tolerance=parsed.tolerance, output_file=parsed.output_file)
+    summary = summarize(results, time.monotonic() - start)
+
+    print("Requests: %d (%0.1f/s)" % (summary["requests"], summary["throughput"]))
+    print("Failures: recorded=%d, replayed=%d" % (summary["recorded_failures"], summary["replayed_failures"]))
+    print("Latency recorded: %s" % percentiles(summary["recorded_latency"]))
+    print("Latency replayed: %s" % percentiles(summary["replayed_latency"]))
+    print("Outputs: %s (match: %0.1f%%)" % (", ".join("%s=%d" % (k, summary["outputs"][k]) for k in sorted(summary["outputs"])),
+                                            100.0 * summary["match"]))
+
+    passed = True
+    if (parsed.max_latency_ratio > 0) and (len(summary["recorded_latency"]) > 0) and (len(summary["replayed_latency"]) > 0):
+        ratio = np.percentile(summary["replayed_latency"], 95) / max(np.percentile(summary["recorded_latency"], 95), 1e-9)
+        if ratio > parsed.max_latency_ratio:
+            print("FAILED: p95 latency ratio %0.2f exceeds %0.2f" % (ratio, parsed.max_latency_ratio))
+            passed = False
+    if summary["match"] < parsed.min_match:
+        print("FAILED: output match %0.3f below %0.3f" % (summary["match"], parsed.min_match))
+        passed = False
+    return passed
+
+
+def sys_main() -> int:
+    """
+    Runs the main function using the system cli arguments, and
+    returns a system error code.
+
+    :return: 0 for success, 1 for failure.
+    """
+    try:
+        return 0 if main() else 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import threading
+
+from dataclasses import dataclass
+from time import monotonic
+from typing import List, Optional, Tuple
+
+
+STRATEGY_ROUND_ROBIN = "round-robin"
+STRATEGY_LEAST_OUTSTANDING = "least-outstanding"
+STRATEGY_LATENCY_EWMA = "latency-ewma"
+STRATEGIES = [
+    STRATEGY_ROUND_ROBIN,
+    STRATEGY_LEAST_OUTSTANDING,
+    STRATEGY_LATENCY_EWMA,
+]
+
+
+@dataclass(eq=False)
+class Replica:
+    channel_in: str
+    channel_out: str
+    in_flight: int = 0
+    requests: int = 0
+    failures: int = 0
+    ewma: Optional[float] = None
+    ejected_until: float = 0.0
+
+    def __str__(self) -> str:
+        """
+        Returns a short summary of the replica's statistics.
+
+        :return: the summary
+        :rtype: str
+        """
+        return "%s:%s (in-flight=%d, requests=%d, failures=%d, latency=%s)" % (
+            self.channel_in, self.channel_out, self.in_flight, self.requests, self.failures,
+            "-" if self.ewma is None else ("%0.3fs" % self.ewma))
+
+
+class ReplicaPool:
+    """
+    Spreads the requests across several replicas of a model, each listening on its
+    own pair of channels. Replicas that fail to respond get ejected temporarily.
+    """
+
+    def __init__(self, channels: List[Tuple[str, str]], strategy: str = STRATEGY_ROUND_ROBIN,
+                 eject_time: float = 30.0, alpha: float = 0.3):
+        """
+        Initializes the pool.
+
+        :param channels: the list of (channel_in, channel_out) tuples of the replicas
+        :type channels: list
+        :param strategy: how to pick a replica, see STRATEGIES
+        :type strategy: str
+        :param eject_time: the number of seconds to skip a replica after it failed to respond, <=0 to never eject
+        :type eject_time: float
+        :param alpha: the smoothing factor for the exponentially weighted moving average of the latency
+        :type alpha: float
+        """
+        if len(channels) == 0:
+            raise Exception("No replicas provided!")
+        if strategy not in STRATEGIES:
+            raise Exception("Invalid balancing strategy (%s): %s" % ("|".join(STRATEGIES), strategy))
+        self.replicas = [Replica(channel_in=x[0], channel_out=x[1]) for x in channels]
+        self.strategy = strategy
+        self.eject_time = eject_time
+        self.alpha = alpha
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _candidates(self, exclude: List[Replica]) -> List[Replica]:
+        """
+        Returns the replicas that can be used, i.e., not excluded and not ejected.
+        If all the remaining replicas are ejected, these get returned instead.
+
+        :param exclude: the replicas to ignore
+        :type exclude: list
+        :return: the candidates
+        :rtype: list
+        """
+        now = monotonic()
+        result = [x for x in self.replicas if x not in exclude]
+        available = [x for x in result if x.ejected_until <= now]
+        if len(available) > 0:
+            return available
+        return result
+
+    def acquire(self, exclude: List[Replica] = None) -> Optional[Replica]:
+        """
+        Picks a replica and marks the request as in flight. Call release once the request is done.
+
+        :param exclude: the replicas to ignore, e.g., when sending a duplicate request
+        :type exclude: list
+        :return: the replica, None if no replica left
+        :rtype: Replica
+        """
+        if exclude is None:
+            exclude = []
+        with self._lock:
+            candidates = self._candidates(exclude)
+            if len(candidates) == 0:
+                return None
+            if self.strategy == STRATEGY_ROUND_ROBIN:
+                result = None
+                for i in range(len(self.replicas)):
+                    replica = self.replicas[(self._next + i) % len(self.replicas)]
+                    if replica in candidates:
+                        result = replica
+                        self._next = (self._next + i + 1) % len(self.replicas)
+                        break
+            elif self.strategy == STRATEGY_LEAST_OUTSTANDING:
+                result = min(candidates, key=lambda x: (x.in_flight, x.requests))
+            elif self.strategy == STRATEGY_LATENCY_EWMA:
+                # replicas without latency get probed first
+                result = min(candidates, key=lambda x: (0.0 if x.ewma is None else x.ewma) * (x.in_flight + 1))
+            else:
+                raise Exception("Unhandled balancing strategy: %s" % self.strategy)
+            result.in_flight += 1
+            result.requests += 1
+            return result
+
+    def release(self, replica: Replica, latency: Optional[float]) -> bool:
+        """
+        Marks the request as done and updates the statistics of the replica.
+
+        :param replica: the replica that processed the request
+        :type replica: Replica
+        :param latency: the time in seconds it took, None if it failed/timed out
+        :type latency: float
+        :return: whether the replica got ejected
+        :rtype: bool
+        """
+        with self._lock:
+            replica.in_flight -= 1
+            if latency is None:
+                replica.failures += 1
+                if self.eject_time > 0:
+                    replica.ejected_until = monotonic() + self.eject_time
+                    return True
+            else:
+                replica.ejected_until = 0.0
+                if replica.ewma is None:
+                    replica.ewma = latency
+                else:
+                    replica.ewma = self.alpha * latency + (1.0 - self.alpha) * replica.ewma
+            return False
+
+    def discard(self, replica: Replica):
+        """
+        Marks the request as not sent, without updating the statistics of the replica.
+
+        :param replica: the replica that was acquired
+        :type replica: Replica
+        """
+        with self._lock:
+            replica.in_flight -= 1
+            replica.requests -= 1
+
+    def stats(self) -> str:
+        """
+        Returns the statistics of all replicas.
+
+        :return: the statistics
+        :rtype: str
+        """
+        with self._lock:
+            return ", ".join([str(x) for x in self.replicas])
@@ -0,0 +1,180 @@
+import logging
+import threading
+import uuid
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Any, Optional
+
+
+DEFAULT_SESSION = "default"
+""" the session ID to use if the request does not have one. """
+
+
+@dataclass
+class Session:
+    session_id: str
+    history: Any = ""
+    turns: int = 0
+    last_access: float = 0.0
+    conversation_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+def session_id(request) -> str:
+    """
+    Determines the session ID from the gradio request.
+
+    :param request: the gradio request, can be None
+    :return: the session ID, DEFAULT_SESSION if none available
+    :rtype: str
+    """
+    result = getattr(request, "session_hash", None)
+    if result is None:
+        result = DEFAULT_SESSION
+    return result
+
+
+def truncate_history(history: Any, max_size: int) -> Any:
+    """
+    Drops the oldest parts of the history if it exceeds the maximum size.
+    For lists, the size is the number of entries. For strings, it is the number
+    of characters, with the cut moved to the next line break if there is one,
+    to avoid keeping a partial turn. Other types are returned as is.
+
+    :param history: the history to truncate
+    :param max_size: the maximum size, <1 for unlimited
+    :type max_size: int
+    :return: the (potentially) truncated history
+    """
+    if max_size < 1:
+        return history
+    if isinstance(history, list):
+        if len(history) > max_size:
+            return history[-max_size:]
+    elif isinstance(history, str):
+        if len(history) > max_size:
+            result = history[-max_size:]
+            pos = result.find("\n")
+            if (pos > -1) and (pos < len(result) - 1):
+                result = result[pos + 1:]
+            return result
+    return history
+
+
+class SessionStore:
+    """
+    Thread-safe container for the sessions, with least-recently-used eviction
+    once the maximum number of sessions is reached and removal of idle sessions.
+    """
+
+    def __init__(self, max_sessions: int = 100, ttl: float = 3600.0, max_history: int = 0,
+                 logger: Optional[logging.Logger] = None):
+        """
+        Initializes the store.
+
+        :param max_sessions: the maximum number of sessions to keep, <1 for unlimited
+        :type max_sessions: int
+        :param ttl: the number of seconds after which an idle session gets removed, <=0 for no expiry
+        :type ttl: float
+        :param max_history: the maximum size of the history, <1 for unlimited (see truncate_history)
+        :type max_history: int
+        :param logger: the logger to use, can be None
+        :type logger: logging.Logger
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_history = max_history
+        self.logger = logger
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, key: str, reason: str):
+        """
+        Removes the session.
+
+        :param key: the session to remove
+        :type key: str
+        :param reason: the reason for the removal, for logging
+        :type reason: str
+        """
+        del self._sessions[key]
+        self.evictions += 1
+        if self.logger is not None:
+            self.logger.debug("Evicted session (%s): %s" % (reason, key))
+
+    def _expire(self, now: float):
+        """
+        Removes all sessions that have been idle for too long.
+
+        :param now: the current time (monotonic)
+        :type now: float
+        """
+        if self.ttl <= 0:
+            return
+        while len(self._sessions) > 0:
+            key, session = next(iter(self._sessions.items()))
+            if now - session.last_access < self.ttl:
+                break
+            self._evict(key, "idle")
+
+    def get(self, key: str) -> Session:
+        """
+        Returns the session, creates it if necessary.
+
+        :param key: the session ID
+        :type key: str
+        :return: the session
+        :rtype: Session
+        """
+        now = monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._sessions:
+                self._sessions.move_to_end(key)
+                result = self._sessions[key]
+            else:
+                if (self.max_sessions > 0) and (len(self._sessions) >= self.max_sessions):
+                    self._evict(next(iter(self._sessions)), "lru")
+                result = Session(session_id=key)
+                self._sessions[key] = result
+            result.last_access = now
+        return result
+
+    def update(self, session: Session, history: Any = None, turns: int = None):
+        """
+        Updates history and/or turns of the session, truncating the history if necessary.
+
+        :param session: the session to update
+        :type session: Session
+        :param history: the new history, ignored if None
+        :param turns: the new number of turns, ignored if None
+        :type turns: int
+        """
+        if history is not None:
+            history = truncate_history(history, self.max_history)
+        with self._lock:
+            if history is not None:
+                session.history = history
+            if turns is not None:
+                session.turns = turns
+
+    def remove(self, key: str):
+        """
+        Removes the session, if present.
+
+        :param key: the session ID
+        :type key: str
+        """
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def __len__(self) -> int:
+        """
+        Returns the number of sessions currently stored.
+
+        :return: the number of sessions
+        :rtype: int
+        """
+        return len(self._sessions)
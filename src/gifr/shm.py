@@ -0,0 +1,113 @@
+import mmap
+import os
+import uuid
+import zlib
+
+from typing import Optional, Union
+
+
+INFO_PATH = "path"
+""" the file containing the payload. """
+
+INFO_SIZE = "size"
+""" the size of the payload in bytes. """
+
+INFO_CHECKSUM = "checksum"
+""" the CRC32 checksum of the payload. """
+
+
+class SharedMemoryTransport:
+    """
+    Hands over payloads to co-located processes via memory-mapped files in a shared
+    directory, ideally a tmpfs like /dev/shm (mounted into all containers involved).
+    Only the path, size and checksum get sent over redis. The sender of a request
+    removes its file once the request is done, the receiver of a reply removes the
+    file after reading it.
+    """
+
+    def __init__(self, directory: str, threshold: int = 65536):
+        """
+        Initializes the transport.
+
+        :param directory: the shared directory to store the payloads in
+        :type directory: str
+        :param threshold: the size in bytes above which to use shared memory
+        :type threshold: int
+        """
+        self.directory = os.path.abspath(directory)
+        self.threshold = threshold
+
+    def applies(self, payload: Union[bytes, str]) -> bool:
+        """
+        Checks whether the payload should be handed over via shared memory.
+
+        :param payload: the payload to check
+        :return: whether to use shared memory
+        :rtype: bool
+        """
+        return isinstance(payload, bytes) and (len(payload) > self.threshold)
+
+    def write(self, payload: bytes) -> dict:
+        """
+        Writes the payload to a new file.
+
+        :param payload: the payload to write
+        :type payload: bytes
+        :return: the information about the file (path, size, checksum)
+        :rtype: dict
+        """
+        path = os.path.join(self.directory, "gifr-%s.bin" % uuid.uuid4().hex)
+        with open(path, "xb") as f:
+            f.write(payload)
+        return {
+            INFO_PATH: path,
+            INFO_SIZE: len(payload),
+            INFO_CHECKSUM: zlib.crc32(payload),
+        }
+
+    def read(self, info: dict, remove: bool = False) -> bytes:
+        """
+        Reads the payload from the file described by the information, verifying size and checksum.
+
+        :param info: the information about the file (path, size, checksum)
+        :type info: dict
+        :param remove: whether to remove the file after reading it
+        :type remove: bool
+        :return: the payload
+        :rtype: bytes
+        """
+        path = os.path.abspath(info[INFO_PATH])
+        if os.path.dirname(path) != self.directory:
+            raise Exception("Shared memory file outside of %s: %s" % (self.directory, path))
+        try:
+            with open(path, "rb") as f:
+                if info[INFO_SIZE] == 0:
+                    result = b""
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        result = mm[:]
+        finally:
+            if remove:
+                self.remove(info)
+        if len(result) != info[INFO_SIZE]:
+            raise Exception("Expected %d bytes, but read %d: %s" % (info[INFO_SIZE], len(result), path))
+        if zlib.crc32(result) != info[INFO_CHECKSUM]:
+            raise Exception("Checksum mismatch: %s" % path)
+        return result
+
+    def remove(self, info: Optional[dict]):
+        """
+        Removes the file described by the information, if it still exists.
+
+        :param info: the information about the file, ignored if None
+        :type info: dict
+        """
+        if info is None:
+            return
+        path = os.path.abspath(info[INFO_PATH])
+        if os.path.dirname(path) != self.directory:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
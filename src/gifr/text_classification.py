@@ -1,3 +1,4 @@
+import argparse
 import json
 import logging
 import sys
@@ -5,9 +6,8 @@ import traceback
 
 from typing import Tuple
 
-import gradio as gr
-
 from gifr.common import init_logging, set_logging_level, create_parser, init_state, State, make_prediction
+from gifr.trace import traced
 
 PROG: str = "gifr-textclass"
 
@@ -16,16 +16,17 @@ _logger = logging.getLogger(PROG)
 state: State = None
 
 
-def predict(text: str) -> Tuple[str, float]:
+def classify(state: State, text: str) -> Tuple[str, float]:
     """
     Sends the text to the model and returns the label and score.
 
+    :param state: the state
+    :type state: State
     :param text: the text to send
     :type text: str
     :return: the prediction result
-    :rtype: str
+    :rtype: tuple
     """
-    global state
     state.logger.info("Classifying: %s" % text)
     d = {"text": text}
     prediction = make_prediction(state, json.dumps(d))
@@ -45,13 +46,28 @@ def predict(text: str) -> Tuple[str, float]:
     return label, score
 
 
-def create_interface(state: State) -> gr.Interface:
+@traced(PROG)
+def predict(text: str) -> Tuple[str, float]:
+    """
+    Sends the text to the model and returns the label and score.
+
+    :param text: the text to send
+    :type text: str
+    :return: the prediction result
+    :rtype: tuple
+    """
+    global state
+    return classify(state, text)
+
+
+def create_interface(state: State) -> "gr.Interface":
     """
     Generates the interface.
 
     :param state: the state to use
     :type state: State
     """
+    import gradio as gr
     return gr.Interface(
         title=state.title,
         description=state.description,
@@ -76,6 +92,21 @@ def post_init_state(state: State):
     state.logger = _logger
 
 
+def create_argparser() -> argparse.ArgumentParser:
+    """
+    Creates the parser for the command-line options.
+
+    :return: the parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = create_parser("Text classification interface. Allows the user to enter text "
+                           + "and display the predicted label and score returned by the model.",
+                           PROG, model_channel_in="text", model_channel_out="prediction",
+                           timeout=1.0, ui_title="Text classification",
+                           ui_desc="Sends the entered text to the model to complete and displays the predicted label and score.")
+    return parser
+
+
 def main(args=None):
     """
     The main method for parsing command-line arguments.
@@ -85,11 +116,7 @@ def main(args=None):
     """
     global state
     init_logging()
-    parser = create_parser("Text classification interface. Allows the user to enter text "
-                           + "and display the predicted label and score returned by the model.",
-                           PROG, model_channel_in="text", model_channel_out="prediction",
-                           timeout=1.0, ui_title="Text classification",
-                           ui_desc="Sends the entered text to the model to complete and displays the predicted label and score.")
+    parser = create_argparser()
     parsed = parser.parse_args(args=args)
     set_logging_level(_logger, parsed.logging_level)
     state = init_state(parsed)
@@ -1,3 +1,4 @@
+import argparse
 import json
 import logging
 import sys
@@ -5,7 +6,12 @@ import traceback
 
 import gradio as gr
 
-from gifr.common import init_logging, set_logging_level, create_parser, init_state, State, make_prediction
+from typing import Iterator
+
+from gifr.common import init_logging, set_logging_level, create_parser, init_state, State, make_prediction, \
+    stream_prediction, ordered_chunks, add_stream_arguments
+from gifr.sessions import Session, SessionStore, session_id
+from gifr.trace import traced
 
 PROG: str = "gifr-textgen"
 
@@ -14,32 +20,126 @@ _logger = logging.getLogger(PROG)
 state: State = None
 
 
-def predict(text: str, channel_out: str = None, channel_in: str = None) -> str:
+def get_session(state: State, request: gr.Request = None) -> Session:
+    """
+    Returns the conversation session associated with the gradio request.
+
+    :param state: the state
+    :type state: State
+    :param request: the gradio request, uses the default session if None
+    :type request: gr.Request
+    :return: the session
+    :rtype: Session
+    """
+    return state.params["sessions"].get(session_id(request))
+
+
+def build_query(state: State, text: str, session: Session, full: bool = True) -> str:
+    """
+    Generates the JSON query to send to the model. In incremental mode, the
+    conversation ID always gets sent along, the history only when requesting
+    a full query.
+
+    :param state: the state
+    :type state: State
+    :param text: the text to send
+    :type text: str
+    :param session: the session with the history
+    :type session: Session
+    :param full: whether to include the history in incremental mode
+    :type full: bool
+    :return: the JSON string
+    :rtype: str
+    """
+    d = {state.params["send_text"]: text}
+    if state.params["history_on"]:
+        if state.params["incremental_history"]:
+            d[state.params["send_conversation_id"]] = session.conversation_id
+        if (state.params["send_history"] is not None) and (full or not state.params["incremental_history"]):
+            d[state.params["send_history"]] = session.history
+        if state.params["send_turns"] is not None:
+            d[state.params["send_turns"]] = session.turns
+    return json.dumps(d)
+
+
+def is_cache_miss(state: State, d: dict) -> bool:
+    """
+    Checks whether the JSON response reports that the model no longer has the
+    conversation cached (incremental history only).
+
+    :param state: the state
+    :type state: State
+    :param d: the JSON response
+    :type d: dict
+    :return: True if a cache miss
+    :rtype: bool
+    """
+    return state.params["history_on"] and state.params["incremental_history"] \
+        and bool(d.get(state.params["receive_cache_miss"], False))
+
+
+def update_history(state: State, d: dict, session: Session):
+    """
+    Updates history and turns of the session from the JSON response, if history is turned on.
+
+    :param state: the state
+    :type state: State
+    :param d: the JSON response
+    :type d: dict
+    :param session: the session to update
+    :type session: Session
+    """
+    if state.params["history_on"]:
+        if state.params["receive_history"] in d:
+            state.params["sessions"].update(session, history=d[state.params["receive_history"]])
+            state.logger.info("History: %s" % str(session.history))
+        if state.params["receive_turns"] in d:
+            state.params["sessions"].update(session, turns=d[state.params["receive_turns"]])
+            state.logger.info("Turns: %s" % str(session.turns))
+
+
+def clean_response(state: State, result: str) -> str:
+    """
+    Cleans up the response, if enabled.
+
+    :param state: the state
+    :type state: State
+    :param result: the response to clean
+    :type result: str
+    :return: the (potentially) cleaned response
+    :rtype: str
+    """
+    if state.params["clean_response"]:
+        result = result.strip()
+        if result.endswith("</s>"):
+            result = result[0:-4]
+            result = result.strip()
+    return result
+
+
+def generate(state: State, text: str, channel_out: str = None, channel_in: str = None, request: gr.Request = None) -> str:
     """
     Sends the text to the model and returns the completed text.
 
+    :param state: the state
+    :type state: State
     :param text: the text to send
     :type text: str
     :param channel_out: for overriding the state's out channel
     :type channel_out: str
     :param channel_in: for overriding the state's in channel
     :type channel_in: str
+    :param request: the gradio request, used for determining the session
+    :type request: gr.Request
     :return: the prediction result
     :rtype: str
     """
-    global state
     state.logger.info("Completing: %s" % text)
-
-    # build query
-    d = {state.params["send_text"]: text}
-    if state.params["history_on"]:
-        if state.params["send_history"] is not None:
-            d[state.params["send_history"]] = state.history
-        if state.params["send_turns"] is not None:
-            d[state.params["send_turns"]] = state.turns
+    session = get_session(state, request)
 
     # perform query
-    result = make_prediction(state, json.dumps(d), channel_in=channel_in, channel_out=channel_out)
+    query = build_query(state, text, session, full=False)
+    result = make_prediction(state, query, channel_in=channel_in, channel_out=channel_out)
 
     # parse response
     if result is None:
@@ -48,15 +148,18 @@ def predict(text: str, channel_out: str = None, channel_in: str = None) -> str:
         if state.params["json_response"]:
             try:
                 d = json.loads(result.decode())
-                result = d[state.params["receive_prediction"]]
-                if state.params["history_on"]:
-                    if state.params["receive_history"] in d:
-                        state.history = d[state.params["receive_history"]]
-                        _logger.info("History: %s" % str(state.history))
-                    if state.params["receive_turns"] in d:
-                        state.turns = d[state.params["receive_turns"]]
-                        _logger.info("Turns: %s" % str(state.turns))
-            except:
+                if is_cache_miss(state, d):
+                    state.logger.info("Cache miss for conversation %s, resending history" % session.conversation_id)
+                    result = make_prediction(state, build_query(state, text, session, full=True), channel_in=channel_in, channel_out=channel_out)
+                    if result is not None:
+                        d = json.loads(result.decode())
+                if result is None:
+                    state.logger.error("No response after resending history for conversation %s" % session.conversation_id)
+                    result = "no result"
+                else:
+                    result = d[state.params["receive_prediction"]]
+                    update_history(state, d, session)
+            except Exception:
                 result = "Failed to parse: %s" % str(result)
         else:
             try:
@@ -65,13 +168,96 @@ def predict(text: str, channel_out: str = None, channel_in: str = None) -> str:
                 result = "Failed to parse: %s" % str(result)
 
     state.logger.info("Prediction: %s" % result)
-    if state.params["clean_response"]:
-        result = result.strip()
-        if result.endswith("</s>"):
-            result = result[0:-4]
-            result = result.strip()
 
-    return result
+    return clean_response(state, result)
+
+
+def generate_stream(state: State, text: str, channel_out: str = None, channel_in: str = None, request: gr.Request = None) -> Iterator[str]:
+    """
+    Sends the text to the model and yields the growing completed text as the model
+    streams its response. Each message from the model is a JSON object containing
+    the text chunk, its sequence number and whether it is the last chunk.
+
+    :param state: the state
+    :type state: State
+    :param text: the text to send
+    :type text: str
+    :param channel_out: for overriding the state's out channel
+    :type channel_out: str
+    :param channel_in: for overriding the state's in channel
+    :type channel_in: str
+    :param request: the gradio request, used for determining the session
+    :type request: gr.Request
+    :return: the iterator over the prediction so far
+    """
+    state.logger.info("Completing (streaming): %s" % text)
+    session = get_session(state, request)
+
+    full = False
+    while True:
+        result = ""
+        count = 0
+        cache_miss = False
+        messages = stream_prediction(state, build_query(state, text, session, full=full), channel_in=channel_in, channel_out=channel_out)
+        chunks = ordered_chunks(state, messages, seq_field=state.params["receive_seq"], end_field=state.params["receive_end"])
+        for d in chunks:
+            if not full and is_cache_miss(state, d):
+                cache_miss = True
+                break
+            count += 1
+            result += d.get(state.params["receive_prediction"], "")
+            update_history(state, d, session)
+            yield clean_response(state, result)
+        chunks.close()
+        if not cache_miss:
+            break
+        state.logger.info("Cache miss for conversation %s, resending history" % session.conversation_id)
+        full = True
+
+    if count == 0:
+        result = "no result"
+        yield result
+
+    state.logger.info("Prediction: %s" % result)
+
+
+@traced(PROG)
+def predict(text: str, channel_out: str = None, channel_in: str = None, request: gr.Request = None) -> str:
+    """
+    Sends the text to the model and returns the completed text.
+
+    :param text: the text to send
+    :type text: str
+    :param channel_out: for overriding the state's out channel
+    :type channel_out: str
+    :param channel_in: for overriding the state's in channel
+    :type channel_in: str
+    :param request: the gradio request, used for determining the session
+    :type request: gr.Request
+    :return: the prediction result
+    :rtype: str
+    """
+    global state
+    return generate(state, text, channel_out=channel_out, channel_in=channel_in, request=request)
+
+
+@traced(PROG)
+def predict_stream(text: str, channel_out: str = None, channel_in: str = None, request: gr.Request = None) -> Iterator[str]:
+    """
+    Sends the text to the model and yields the growing completed text as the model streams its response.
+
+    :param text: the text to send
+    :type text: str
+    :param channel_out: for overriding the state's out channel
+    :type channel_out: str
+    :param channel_in: for overriding the state's in channel
+    :type channel_in: str
+    :param request: the gradio request, used for determining the session
+    :type request: gr.Request
+    :return: the iterator over the prediction so far
+    """
+    global state
+    yield from generate_stream(state, text, channel_out=channel_out, channel_in=channel_in, request=request)
 
 
 def create_interface(state: State) -> gr.Interface:
@@ -84,7 +270,7 @@ def create_interface(state: State) -> gr.Interface:
     return gr.Interface(
         title=state.title,
         description=state.description,
-        fn=predict,
+        fn=predict_stream if state.params["stream"] else predict,
         inputs=[
             gr.Textbox(label="Input"),
         ],
@@ -102,24 +288,21 @@ def post_init_state(state: State):
     :type state: State
     """
     state.logger = _logger
-    state.history = ""
-    state.turns = 0
+    if state.params.get("stream", False) and not state.params["json_response"]:
+        raise Exception("Streaming requires --json_response!")
+    if state.params["incremental_history"] and not state.params["json_response"]:
+        raise Exception("Incremental history requires --json_response!")
+    state.params["sessions"] = SessionStore(max_sessions=state.params["max_sessions"], ttl=state.params["session_timeout"],
+                                            max_history=state.params["max_history"], logger=_logger)
 
 
-def main(args=None):
+def add_text_generation_arguments(parser: argparse.ArgumentParser):
     """
-    The main method for parsing command-line arguments.
+    Adds the options for the text generation (query/response fields, history) to the parser.
 
-    :param args: the commandline arguments, uses sys.argv if not supplied
-    :type args: list
+    :param parser: the parser to extend
+    :type parser: argparse.ArgumentParser
     """
-    global state
-    init_logging()
-    parser = create_parser("Text generation interface. Allows the user to enter text "
-                           + "and display the text generated by the model.",
-                           PROG, model_channel_in="text", model_channel_out="prediction",
-                           timeout=1.0, ui_title="Text generation",
-                           ui_desc="Sends the entered text to the model to complete and displays the result.")
     parser.add_argument("--send_text", metavar="FIELD", help="The field name in the JSON prompt used for sending the text, ignored if not provided.", default="prompt", type=str, required=False)
     parser.add_argument("--json_response", action="store_true", help="Whether the reponse is a JSON object.")
     parser.add_argument("--receive_prediction", metavar="FIELD", help="The field name in the JSON response used for receiving the predicted text, ignored if not provided.", default="text", type=str, required=False)
@@ -129,6 +312,41 @@ def main(args=None):
     parser.add_argument("--receive_history", metavar="FIELD", help="The field name in the JSON response used for receiving the input history, ignored if not provided.", default=None, type=str, required=False)
     parser.add_argument("--receive_turns", metavar="FIELD", help="The field name in the JSON response used for receiving the number of turns in the interaction, ignored if not provided.", default=None, type=str, required=False)
     parser.add_argument("--clean_response", action="store_true", help="Whether to clean up the response.")
+    parser.add_argument("--max_sessions", metavar="NUM", help="The maximum number of user sessions to keep the history for, the least recently used session gets evicted; <1 for unlimited.", default=100, type=int, required=False)
+    parser.add_argument("--session_timeout", metavar="SECONDS", help="The number of seconds after which the history of an idle session gets discarded; <=0 for no timeout.", default=3600.0, type=float, required=False)
+    parser.add_argument("--incremental_history", action="store_true", help="Whether to send only the conversation ID and the new input instead of the full history, which gets resent only when the model reports a cache miss (requires --json_response).")
+    parser.add_argument("--send_conversation_id", metavar="FIELD", help="The field name in the JSON query to use for sending the conversation ID in incremental mode.", default="conversation_id", type=str, required=False)
+    parser.add_argument("--receive_cache_miss", metavar="FIELD", help="The field name in the JSON response that flags that the model does not have the conversation cached (incremental mode).", default="cache_miss", type=str, required=False)
+    parser.add_argument("--max_history", metavar="NUM", help="The maximum size of the history per session (list: number of entries, string: number of characters), the oldest parts get dropped; <1 for unlimited.", default=0, type=int, required=False)
+
+
+def create_argparser() -> argparse.ArgumentParser:
+    """
+    Creates the parser for the command-line options.
+
+    :return: the parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = create_parser("Text generation interface. Allows the user to enter text "
+                           + "and display the text generated by the model.",
+                           PROG, model_channel_in="text", model_channel_out="prediction",
+                           timeout=1.0, ui_title="Text generation",
+                           ui_desc="Sends the entered text to the model to complete and displays the result.")
+    add_text_generation_arguments(parser)
+    add_stream_arguments(parser)
+    return parser
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    global state
+    init_logging()
+    parser = create_argparser()
     parsed = parser.parse_args(args=args)
     set_logging_level(_logger, parsed.logging_level)
     state = init_state(parsed)
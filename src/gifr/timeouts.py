@@ -0,0 +1,137 @@
+import threading
+
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+DEFAULT_WINDOW = 500
+""" the default number of latencies to keep per channel pair. """
+
+DEFAULT_MIN_SAMPLES = 20
+""" the default number of latencies required before estimates get made. """
+
+
+class ChannelLatencies:
+    """
+    Keeps track of the latency distribution per channel pair, for deriving timeouts
+    and the delay for hedged requests from a percentile. The latencies can be scaled
+    by payload size, using a linear fit of latency over size and the percentile of
+    the residuals.
+    """
+
+    def __init__(self, scale_by_size: bool = False, window: int = DEFAULT_WINDOW,
+                 min_samples: int = DEFAULT_MIN_SAMPLES):
+        """
+        Initializes the tracker.
+
+        :param scale_by_size: whether to scale the latencies by payload size
+        :type scale_by_size: bool
+        :param window: the number of latencies to keep per channel pair
+        :type window: int
+        :param min_samples: the number of latencies required before estimates get made
+        :type min_samples: int
+        """
+        self.scale_by_size = scale_by_size
+        self.window = window
+        self.min_samples = max(2, min_samples)
+        self._samples: Dict[Tuple[str, str], deque] = dict()
+        self._lock = threading.Lock()
+
+    def record(self, channel_in: str, channel_out: str, size: int, seconds: float):
+        """
+        Records the latency of a successful request.
+
+        :param channel_in: the channel the request was sent to
+        :type channel_in: str
+        :param channel_out: the channel the reply was received on
+        :type channel_out: str
+        :param size: the size of the payload in bytes
+        :type size: int
+        :param seconds: the latency in seconds
+        :type seconds: float
+        """
+        key = (channel_in, channel_out)
+        with self._lock:
+            if key not in self._samples:
+                self._samples[key] = deque(maxlen=self.window)
+            self._samples[key].append((size, seconds))
+
+    def estimate(self, channel_in: str, channel_out: str, size: int, q: float) -> Optional[float]:
+        """
+        Estimates the percentile of the latency for a payload of the given size.
+
+        :param channel_in: the channel the request gets sent to
+        :type channel_in: str
+        :param channel_out: the channel the reply gets received on
+        :type channel_out: str
+        :param size: the size of the payload in bytes
+        :type size: int
+        :param q: the percentile (0-100)
+        :type q: float
+        :return: the latency in seconds, None if not enough latencies recorded yet
+        :rtype: float
+        """
+        with self._lock:
+            samples = self._samples.get((channel_in, channel_out), None)
+            if (samples is None) or (len(samples) < self.min_samples):
+                return None
+            samples = np.asarray(samples, dtype=np.float64)
+        sizes = samples[:, 0]
+        latencies = samples[:, 1]
+        if self.scale_by_size and (np.ptp(sizes) > 0):
+            slope, intercept = np.polyfit(sizes, latencies, 1)
+            residuals = latencies - (slope * sizes + intercept)
+            return max(0.0, float(slope * size + intercept + np.percentile(residuals, q)))
+        return float(np.percentile(latencies, q))
+
+
+class AdaptiveTimeout:
+    """
+    Derives the timeout for a request from the observed latencies: the percentile
+    multiplied by a safety factor, limited to a range. Falls back on the static
+    timeout while not enough latencies have been observed.
+    """
+
+    def __init__(self, latencies: ChannelLatencies, percentile: float = 99.0, factor: float = 1.5,
+                 min_timeout: float = 0.1, max_timeout: float = 60.0):
+        """
+        Initializes the adaptive timeout.
+
+        :param latencies: the latencies to derive the timeouts from
+        :type latencies: ChannelLatencies
+        :param percentile: the percentile of the latencies to use (0-100)
+        :type percentile: float
+        :param factor: the factor to multiply the percentile with
+        :type factor: float
+        :param min_timeout: the smallest timeout to use, in seconds
+        :type min_timeout: float
+        :param max_timeout: the largest timeout to use, in seconds
+        :type max_timeout: float
+        """
+        self.latencies = latencies
+        self.percentile = percentile
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+
+    def timeout(self, channel_in: str, channel_out: str, size: int, default: float) -> float:
+        """
+        Determines the timeout for the request.
+
+        :param channel_in: the channel the request gets sent to
+        :type channel_in: str
+        :param channel_out: the channel the reply gets received on
+        :type channel_out: str
+        :param size: the size of the payload in bytes
+        :type size: int
+        :param default: the timeout to use if not enough latencies recorded yet
+        :type default: float
+        :return: the timeout in seconds
+        :rtype: float
+        """
+        estimate = self.latencies.estimate(channel_in, channel_out, size, self.percentile)
+        if estimate is None:
+            return default
+        return min(self.max_timeout, max(self.min_timeout, estimate * self.factor))
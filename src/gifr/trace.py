@@ -0,0 +1,226 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from gifr.priority import LatencyWindow
+from gifr.profiler import profiling, request_started, request_finished
+
+
+_tracer = None
+""" the active tracer, None if tracing is off. """
+
+_spans = contextvars.ContextVar("gifr_spans", default=None)
+""" the (name, seconds) tuples of the spans of the request being processed in the current context. """
+
+
+class Tracer:
+    """
+    Records timing spans, writes them as Chrome trace events (viewable with chrome://tracing
+    or https://ui.perfetto.dev/) and keeps rolling per-stage statistics of the requests.
+    """
+
+    def __init__(self, trace_file: str = None, summary_interval: int = 0):
+        """
+        Initializes the tracer.
+
+        :param trace_file: the file to write the trace events to, None to not write any
+        :type trace_file: str
+        :param summary_interval: the number of requests after which to log the per-stage summary, <1 to never log
+        :type summary_interval: int
+        """
+        self.trace_file = trace_file
+        self.summary_interval = summary_interval
+        self.requests = 0
+        self.stages: Dict[str, LatencyWindow] = dict()
+        self._origin = perf_counter()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._file = None
+        if trace_file is not None:
+            # the JSON array of events gets left open, which the trace viewers accept
+            self._file = open(trace_file, "w")
+            self._file.write("[\n")
+
+    def add(self, name: str, start: float, end: float, category: str = "stage", args: dict = None):
+        """
+        Records the span in the trace file.
+
+        :param name: the name of the span
+        :type name: str
+        :param start: the start time (perf_counter)
+        :type start: float
+        :param end: the end time (perf_counter)
+        :type end: float
+        :param category: the category of the span
+        :type category: str
+        :param args: additional information to store with the span
+        :type args: dict
+        """
+        if self._file is None:
+            return
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self._origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self._file.write(json.dumps(event) + ",\n")
+
+    def finish_request(self, name: str, seconds: float, spans: List[Tuple[str, float]]):
+        """
+        Updates the per-stage statistics with the spans of the request and logs the summary if due.
+
+        :param name: the name of the request, i.e., the name of the logger to log the summary with
+        :type name: str
+        :param seconds: the duration of the whole request
+        :type seconds: float
+        :param spans: the (name, seconds) tuples of the request
+        :type spans: list
+        """
+        totals = {"total": seconds}
+        for stage, duration in spans:
+            totals[stage] = totals.get(stage, 0.0) + duration
+        with self._lock:
+            for stage, duration in totals.items():
+                if stage not in self.stages:
+                    self.stages[stage] = LatencyWindow()
+                self.stages[stage].add(duration)
+            self.requests += 1
+            due = (self.summary_interval > 0) and (self.requests % self.summary_interval == 0)
+            if self._file is not None:
+                self._file.flush()
+        if due:
+            logging.getLogger(name).info("Stages after %d request(s): %s" % (self.requests, self.summary()))
+
+    def summary(self) -> str:
+        """
+        Returns the per-stage summary (median and 95th percentile).
+
+        :return: the summary
+        :rtype: str
+        """
+        result = []
+        for stage in sorted(self.stages.keys(), key=lambda x: (x != "total", x)):
+            window = self.stages[stage]
+            result.append("%s: p50=%0.3fs, p95=%0.3fs" % (stage, window.percentile(50), window.percentile(95)))
+        return ", ".join(result)
+
+    def close(self):
+        """
+        Closes the trace file.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def init_tracing(trace_file: Optional[str], summary_interval: int) -> Optional[Tracer]:
+    """
+    Turns on tracing, if a trace file or a summary interval is specified.
+
+    :param trace_file: the file to write the trace events to, None to not write any
+    :type trace_file: str
+    :param summary_interval: the number of requests after which to log the per-stage summary, <1 to never log
+    :type summary_interval: int
+    :return: the tracer, None if tracing stays off
+    :rtype: Tracer
+    """
+    global _tracer
+    if (trace_file is None) and (summary_interval < 1):
+        return None
+    if _tracer is None:
+        _tracer = Tracer(trace_file=trace_file, summary_interval=summary_interval)
+    return _tracer
+
+
+@contextmanager
+def span(name: str, **kwargs):
+    """
+    Context manager for timing a stage of the request. Does nothing if tracing is off.
+
+    :param name: the name of the stage, e.g., "publish"
+    :type name: str
+    :param kwargs: additional information to store with the span in the trace file
+    """
+    if _tracer is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        end = perf_counter()
+        _tracer.add(name, start, end, args=kwargs)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((name, end - start))
+
+
+def traced(name: str):
+    """
+    Decorator for the functions that process a request, e.g., the predict functions of
+    the interfaces. Collects the spans of the request (generators until exhausted or closed)
+    and notifies the profiler (see gifr.profiler) about the request.
+
+    :param name: the name of the request, also the name of the logger to log the summary with
+    :type name: str
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if (_tracer is None) and not profiling():
+                    yield from func(*args, **kwargs)
+                    return
+                spans = []
+                _spans.set(spans)
+                request_started()
+                start = perf_counter()
+                try:
+                    for item in func(*args, **kwargs):
+                        # the caller may resume the generator in another context
+                        _spans.set(None)
+                        yield item
+                        _spans.set(spans)
+                finally:
+                    _spans.set(None)
+                    end = perf_counter()
+                    request_finished(end - start)
+                    if _tracer is not None:
+                        _tracer.add(name, start, end, category="request")
+                        _tracer.finish_request(name, end - start, spans)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if (_tracer is None) and not profiling():
+                    return func(*args, **kwargs)
+                spans = []
+                token = _spans.set(spans)
+                request_started()
+                start = perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    _spans.reset(token)
+                    end = perf_counter()
+                    request_finished(end - start)
+                    if _tracer is not None:
+                        _tracer.add(name, start, end, category="request")
+                        _tracer.finish_request(name, end - start, spans)
+        return wrapper
+    return decorator
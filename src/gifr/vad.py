@@ -0,0 +1,128 @@
+import numpy as np
+
+from typing import List, Tuple
+
+
+DEFAULT_THRESHOLD = -40.0
+""" the default energy threshold in dB, relative to the loudest frame. """
+
+DEFAULT_FRAME_LENGTH = 30
+""" the default frame length in milliseconds. """
+
+DEFAULT_PADDING = 100
+""" the default padding in milliseconds to keep around speech. """
+
+MIN_RMS = 1e-10
+""" the RMS below which a frame is considered digital silence. """
+
+
+def to_mono(y: np.ndarray) -> np.ndarray:
+    """
+    Turns multi-channel audio into mono by averaging the channels.
+
+    :param y: the audio samples, either (n,) or (n, channels)
+    :type y: np.ndarray
+    :return: the mono samples
+    :rtype: np.ndarray
+    """
+    if y.ndim > 1:
+        return y.mean(axis=1)
+    return y
+
+
+def frame_energies(y: np.ndarray, frame_length: int) -> np.ndarray:
+    """
+    Computes the RMS energy in dB for consecutive, non-overlapping frames.
+    The last frame gets zero-padded if necessary.
+
+    :param y: the mono audio samples
+    :type y: np.ndarray
+    :param frame_length: the number of samples per frame
+    :type frame_length: int
+    :return: the energy per frame in dB
+    :rtype: np.ndarray
+    """
+    num_frames = -(-len(y) // frame_length)
+    if num_frames == 0:
+        return np.empty(0, dtype=np.float64)
+    frames = np.zeros(num_frames * frame_length, dtype=np.float64)
+    frames[:len(y)] = y
+    frames = frames.reshape(num_frames, frame_length)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return 20.0 * np.log10(np.maximum(rms, MIN_RMS))
+
+
+def detect_speech(y: np.ndarray, sr: int, threshold: float = DEFAULT_THRESHOLD,
+                  frame_length: int = DEFAULT_FRAME_LENGTH) -> Tuple[np.ndarray, int]:
+    """
+    Determines which frames contain speech, i.e., which frames have an energy
+    above the threshold (relative to the loudest frame). Digital silence never
+    counts as speech.
+
+    :param y: the audio samples, either (n,) or (n, channels)
+    :type y: np.ndarray
+    :param sr: the sample rate
+    :type sr: int
+    :param threshold: the threshold in dB relative to the loudest frame (eg -40)
+    :type threshold: float
+    :param frame_length: the length of a frame in milliseconds
+    :type frame_length: int
+    :return: the boolean mask (one per frame) and the number of samples per frame
+    :rtype: tuple
+    """
+    num_samples = max(1, int(sr * frame_length / 1000))
+    db = frame_energies(to_mono(y), num_samples)
+    if len(db) == 0:
+        return np.zeros(0, dtype=bool), num_samples
+    return (db >= (db.max() + threshold)) & (db > 20.0 * np.log10(MIN_RMS)), num_samples
+
+
+def speech_segments(y: np.ndarray, sr: int, threshold: float = DEFAULT_THRESHOLD,
+                    frame_length: int = DEFAULT_FRAME_LENGTH, padding: int = DEFAULT_PADDING,
+                    min_pause: float = 0.0) -> List[Tuple[int, int]]:
+    """
+    Determines the segments that contain speech. Leading and trailing silence
+    is always removed. If min_pause is positive, the audio gets split wherever
+    the silence lasts at least that long.
+
+    :param y: the audio samples, either (n,) or (n, channels)
+    :type y: np.ndarray
+    :param sr: the sample rate
+    :type sr: int
+    :param threshold: the threshold in dB relative to the loudest frame (eg -40)
+    :type threshold: float
+    :param frame_length: the length of a frame in milliseconds
+    :type frame_length: int
+    :param padding: the silence in milliseconds to keep around the speech
+    :type padding: int
+    :param min_pause: the minimum length of silence in seconds to split on, <=0 for no splitting
+    :type min_pause: float
+    :return: the list of (start, end) sample indices (end is exclusive), empty if no speech detected
+    :rtype: list
+    """
+    mask, num_samples = detect_speech(y, sr, threshold=threshold, frame_length=frame_length)
+    if not mask.any():
+        return []
+
+    # start/end frames of the runs of speech
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    # merge runs that are separated by short pauses
+    if min_pause > 0:
+        min_gap = int(np.ceil(min_pause * sr / num_samples))
+        keep = (starts[1:] - ends[:-1]) >= min_gap
+        starts = np.concatenate([starts[:1], starts[1:][keep]])
+        ends = np.concatenate([ends[:-1][keep], ends[-1:]])
+    else:
+        starts = starts[:1]
+        ends = ends[-1:]
+
+    # frames -> samples, including padding
+    pad = int(round(padding * sr / 1000))
+    starts = np.maximum(starts * num_samples - pad, 0)
+    ends = np.minimum(ends * num_samples + pad, len(y))
+    starts[1:] = np.maximum(starts[1:], ends[:-1])
+
+    return list(zip(starts.tolist(), ends.tolist()))
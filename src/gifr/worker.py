@@ -0,0 +1,277 @@
+import logging
+import threading
+import time
+
+from typing import Callable, Iterator, Optional, Union
+
+import redis
+
+from gifr.envelope import unpack, is_expired, cancel_channel, HEADER_ID, HEADER_CANCEL, HEADER_END, HEADER_SHM, \
+    HEADER_CODEC, HEADER_ACCEPT
+from gifr.compression import Compressor, decompress
+from gifr.offload import Offloader
+from gifr.shm import SharedMemoryTransport
+
+
+CANCEL_TTL = 300.0
+""" the number of seconds to remember cancel notices for requests without deadline. """
+
+
+class Worker:
+    """
+    Helper for model processes that receive their requests via gifr (see the --envelope option).
+    Requests whose deadline has passed or that got cancelled get dropped before processing,
+    streamed responses get stopped once the request gets cancelled. Messages that are
+    not wrapped in envelopes get processed as is.
+
+    The prediction function receives the payload (bytes) and returns either the result
+    (bytes/str) or, for streamed responses, an iterator over the results.
+    Offloaded payloads (see gifr.offload) and payloads in shared memory (see gifr.shm)
+    get retrieved automatically and compressed payloads get decompressed. Large results
+    get compressed (if the request accepts the codec), offloaded or handed over via
+    shared memory if configured.
+    """
+
+    def __init__(self, connection: redis.Redis, channel_in: str, channel_out: str,
+                 predict: Callable[[bytes], Union[bytes, str, Iterator]],
+                 logger: Optional[logging.Logger] = None, sleep_time: float = 0.01,
+                 offload_threshold: int = 0, offload_ttl: int = 300,
+                 shm_dir: str = None, shm_threshold: int = 65536,
+                 compression: str = None, compression_threshold: int = 16384):
+        """
+        Initializes the worker.
+
+        :param connection: the redis connection to use
+        :type connection: redis.Redis
+        :param channel_in: the channel to receive the requests on
+        :type channel_in: str
+        :param channel_out: the channel to send the results to
+        :type channel_out: str
+        :param predict: the prediction function
+        :type predict: callable
+        :param logger: the logger to use, can be None
+        :type logger: logging.Logger
+        :param sleep_time: the sleep time for the pub-sub thread listening for cancel notices
+        :type sleep_time: float
+        :param offload_threshold: the size in bytes above which to offload results, <1 to never offload
+        :type offload_threshold: int
+        :param offload_ttl: the number of seconds to keep offloaded results
+        :type offload_ttl: int
+        :param shm_dir: the directory shared with gifr for handing over payloads via memory-mapped files, None to turn off
+        :type shm_dir: str
+        :param shm_threshold: the size in bytes above which to hand over results via shared memory
+        :type shm_threshold: int
+        :param compression: the codec to compress results with (see gifr.compression.CODECS), None to turn off
+        :type compression: str
+        :param compression_threshold: the size in bytes above which to compress results
+        :type compression_threshold: int
+        """
+        self.connection = connection
+        self.channel_in = channel_in
+        self.channel_out = channel_out
+        self.predict = predict
+        self.logger = logger
+        self.sleep_time = sleep_time
+        self.offloader = Offloader(connection, offload_threshold, ttl=offload_ttl)
+        self.shm = None if shm_dir is None else SharedMemoryTransport(shm_dir, threshold=shm_threshold)
+        self.compressor = None if compression is None else Compressor(compression, threshold=compression_threshold)
+        self.processed = 0
+        self.expired = 0
+        self.cancelled = 0
+        self._cancelled = dict()
+        self._lock = threading.Lock()
+
+    def _log(self, msg: str):
+        """
+        Outputs a debug message if a logger is available.
+
+        :param msg: the message to output
+        :type msg: str
+        """
+        if self.logger is not None:
+            self.logger.debug(msg)
+
+    def _on_cancel(self, message):
+        """
+        Records the request ID of the cancel notice.
+
+        :param message: the pub-sub message
+        """
+        envelope = unpack(message["data"])
+        if envelope is None:
+            return
+        header = envelope[0]
+        if not header.get(HEADER_CANCEL, False) or (HEADER_ID not in header):
+            return
+        now = time.time()
+        with self._lock:
+            # forget about old notices
+            for key in [k for k, v in self._cancelled.items() if v < now]:
+                del self._cancelled[key]
+            self._cancelled[header[HEADER_ID]] = now + CANCEL_TTL
+        self._log("Cancel notice: %s" % header[HEADER_ID])
+
+    def is_cancelled(self, request_id: str) -> bool:
+        """
+        Checks whether the request got cancelled.
+
+        :param request_id: the ID of the request
+        :type request_id: str
+        :return: whether cancelled
+        :rtype: bool
+        """
+        with self._lock:
+            return request_id in self._cancelled
+
+    def should_drop(self, header: dict) -> bool:
+        """
+        Checks whether the request should get dropped, i.e., whether it expired or got cancelled.
+
+        :param header: the header of the request
+        :type header: dict
+        :return: whether to drop the request
+        :rtype: bool
+        """
+        if is_expired(header):
+            self.expired += 1
+            self._log("Dropping expired request: %s" % header.get(HEADER_ID))
+            return True
+        if self.is_cancelled(header.get(HEADER_ID)):
+            self.cancelled += 1
+            self._log("Dropping cancelled request: %s" % header.get(HEADER_ID))
+            return True
+        return False
+
+    def _receive(self, header: dict, payload: bytes) -> Optional[bytes]:
+        """
+        Returns the actual payload of the request, retrieving offloaded payloads,
+        reading shared memory files and decompressing the payload.
+
+        :param header: the header of the request
+        :type header: dict
+        :param payload: the payload of the envelope
+        :type payload: bytes
+        :return: the payload, None if not available
+        :rtype: bytes
+        """
+        if HEADER_SHM in header:
+            if self.shm is None:
+                self._log("Received payload via shared memory, but no directory specified: %s" % header.get(HEADER_ID))
+                return None
+            try:
+                result = self.shm.read(header[HEADER_SHM])
+            except Exception as e:
+                self._log("Failed to read payload from shared memory: %s" % str(e))
+                return None
+        else:
+            result = self.offloader.resolve(header, payload)
+            if result is None:
+                return None
+        if HEADER_CODEC in header:
+            if self.compressor is not None:
+                result = self.compressor.decompress(header[HEADER_CODEC], result)
+            else:
+                result = decompress(header[HEADER_CODEC], result)
+        return result
+
+    def _publish(self, header: dict, payload: Union[bytes, str], accept: list):
+        """
+        Publishes the reply, using compression, shared memory or offloading for large payloads if configured.
+
+        :param header: the header of the reply
+        :type header: dict
+        :param payload: the payload of the reply
+        :param accept: the codecs that the reply can be compressed with
+        :type accept: list
+        """
+        if (self.compressor is not None) and (self.compressor.codec in accept):
+            codec, payload = self.compressor.compress(payload)
+            if codec is not None:
+                header = dict(header)
+                header[HEADER_CODEC] = codec
+        if (self.shm is not None) and self.shm.applies(payload):
+            try:
+                header = dict(header)
+                header[HEADER_SHM] = self.shm.write(payload)
+                payload = b""
+            except Exception as e:
+                self._log("Failed to use shared memory, sending via redis: %s" % str(e))
+        self.offloader.publish(self.channel_out, header, payload)
+
+    def process(self, data: bytes):
+        """
+        Processes the request and publishes the result(s).
+
+        :param data: the request data
+        :type data: bytes
+        """
+        envelope = unpack(data)
+        if envelope is None:
+            result = self.predict(data)
+            if isinstance(result, (bytes, str)):
+                self.connection.publish(self.channel_out, result)
+            else:
+                for item in result:
+                    self.connection.publish(self.channel_out, item)
+            self.processed += 1
+            return
+
+        header, payload = envelope
+        if header.get(HEADER_CANCEL, False) or self.should_drop(header):
+            return
+        payload = self._receive(header, payload)
+        if payload is None:
+            self._log("Dropping request with unavailable payload: %s" % header.get(HEADER_ID))
+            return
+        reply = {HEADER_ID: header[HEADER_ID]}
+        accept = header.get(HEADER_ACCEPT, [])
+        result = self.predict(payload)
+        if isinstance(result, (bytes, str)):
+            self._publish(reply, result, accept)
+        else:
+            # hold back one item to flag the last one
+            last = None
+            for item in result:
+                if last is not None:
+                    self._publish(reply, last, accept)
+                if self.is_cancelled(header[HEADER_ID]):
+                    self.cancelled += 1
+                    self._log("Stopped cancelled request: %s" % header[HEADER_ID])
+                    return
+                last = item
+            end = dict(reply)
+            end[HEADER_END] = True
+            self._publish(end, b"" if last is None else last, accept)
+        self.processed += 1
+
+    def stats(self) -> str:
+        """
+        Returns the statistics.
+
+        :return: the statistics
+        :rtype: str
+        """
+        result = "processed=%d, expired=%d, cancelled=%d" % (self.processed, self.expired, self.cancelled)
+        if self.compressor is not None:
+            result += ", " + self.compressor.stats()
+        return result
+
+    def run(self):
+        """
+        Processes requests until interrupted.
+        """
+        cancel_pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+        cancel_pubsub.subscribe(**{cancel_channel(self.channel_in): self._on_cancel})
+        cancel_thread = cancel_pubsub.run_in_thread(sleep_time=self.sleep_time, daemon=True)
+        pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel_in)
+        try:
+            for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                self.process(message["data"])
+                self._log(self.stats())
+        finally:
+            pubsub.close()
+            cancel_thread.stop()
+            cancel_pubsub.close()
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from gifr.admission import AdmissionController, Rejected
+from gifr.priority import PriorityLanes, PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+
+def test_admits_up_to_limit():
+    controller = AdmissionController(2)
+    controller.acquire()
+    controller.acquire()
+    with pytest.raises(Rejected):
+        controller.acquire()
+    assert (controller.in_flight, controller.admitted, controller.rejected) == (2, 2, 1)
+    controller.release()
+    controller.acquire()
+    assert controller.in_flight == 2
+
+
+def test_invalid_limit():
+    with pytest.raises(Exception):
+        AdmissionController(0)
+
+
+def test_queued_request_gets_slot():
+    controller = AdmissionController(1, max_queue=1, max_queue_time=5.0)
+    controller.acquire()
+    admitted = threading.Event()
+
+    def wait():
+        controller.acquire()
+        admitted.set()
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    time.sleep(0.05)
+    assert controller.depth == 1
+    with pytest.raises(Rejected):
+        controller.acquire()
+    controller.release()
+    thread.join(5.0)
+    assert admitted.is_set()
+    assert (controller.in_flight, controller.depth) == (1, 0)
+
+
+def test_queue_timeout():
+    controller = AdmissionController(1, max_queue=1, max_queue_time=0.05)
+    controller.acquire()
+    with pytest.raises(Rejected):
+        controller.acquire()
+    assert (controller.depth, controller.rejected) == (0, 1)
+
+
+def test_weighted_hand_over():
+    controller = AdmissionController(1, max_queue=10, max_queue_time=5.0,
+                                     weights={PRIORITY_INTERACTIVE: 3, PRIORITY_BULK: 1})
+    controller.acquire()
+    order = []
+    lock = threading.Lock()
+
+    def wait(priority):
+        controller.acquire(priority)
+        with lock:
+            order.append(priority)
+
+    threads = []
+    for priority in [PRIORITY_BULK] * 4 + [PRIORITY_INTERACTIVE] * 4:
+        threads.append(threading.Thread(target=wait, args=(priority,)))
+        threads[-1].start()
+    while controller.depth < 8:
+        time.sleep(0.01)
+    for i in range(8):
+        controller.release()
+        while len(order) < i + 1:
+            time.sleep(0.01)
+    for thread in threads:
+        thread.join(5.0)
+    # three interactive requests for every bulk one, while both are waiting
+    assert order[:4] == [PRIORITY_INTERACTIVE, PRIORITY_INTERACTIVE, PRIORITY_BULK, PRIORITY_INTERACTIVE]
+    assert sorted(order) == sorted([PRIORITY_BULK] * 4 + [PRIORITY_INTERACTIVE] * 4)
+
+
+def test_lanes():
+    lanes = PriorityLanes(channels={PRIORITY_BULK: ("bulk_in", "bulk_out")})
+    assert lanes.channels_for(PRIORITY_BULK) == ("bulk_in", "bulk_out")
+    assert lanes.channels_for(PRIORITY_INTERACTIVE) is None
+    with pytest.raises(Exception):
+        PriorityLanes(weights={PRIORITY_BULK: 0})
@@ -0,0 +1,70 @@
+import logging
+import threading
+
+import pytest
+
+import gifr.asr_text_generation as pipeline
+from gifr.common import State
+from gifr.priority import PRIORITY_BULK, current_priority, request_priority
+
+
+@pytest.fixture
+def state():
+    result = State(logger=logging.getLogger("test"))
+    for prefix, channel in [("audio_", "asr"), ("text_", "textgen")]:
+        result.params[prefix + "channel_in"] = channel + "_in"
+        result.params[prefix + "channel_out"] = channel + "_out"
+        result.params[prefix + "timeout"] = None
+        result.params[prefix + "stream"] = False
+    return result
+
+
+def test_stage_state(state):
+    state.params["text_timeout"] = 10.0
+    stage = pipeline.stage_state(state, "text_")
+    assert (stage.channel_in, stage.channel_out, stage.timeout) == ("textgen_in", "textgen_out", 10.0)
+    assert stage.logger is state.logger
+    assert pipeline.stage_state(state, "audio_").timeout == state.timeout
+
+
+def test_generation_overlaps_display(state, monkeypatch):
+    generating = threading.Event()
+    priorities = []
+
+    def transcribe_audio(stage, audio):
+        priorities.append(current_priority())
+        return "hello"
+
+    def generate(stage, transcript, request=None):
+        generating.set()
+        return transcript.upper()
+
+    monkeypatch.setattr(pipeline, "transcribe_audio", transcribe_audio)
+    monkeypatch.setattr(pipeline, "generate", generate)
+    with request_priority(PRIORITY_BULK):
+        outputs = pipeline.Pipeline(state).run(b"")
+        assert next(outputs) == ("hello", "")
+        # the generation starts without the caller asking for the next output
+        assert generating.wait(5.0)
+        assert list(outputs) == [("hello", "HELLO")]
+    assert priorities == [PRIORITY_BULK]
+
+
+def test_stage_error(state, monkeypatch):
+    def transcribe_audio(stage, audio):
+        raise Exception("no model")
+
+    monkeypatch.setattr(pipeline, "transcribe_audio", transcribe_audio)
+    with pytest.raises(Exception, match="no model"):
+        list(pipeline.Pipeline(state).run(b""))
+
+
+def test_stage_metrics():
+    metrics = pipeline.StageMetrics("ASR")
+    threads = [threading.Thread(target=lambda: [metrics.add(0.5) for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (metrics.count, metrics.total_time, metrics.max_time) == (4000, 2000.0, 0.5)
+    assert str(metrics) == "ASR: n=4000, last=0.500s, avg=0.500s, max=0.500s"
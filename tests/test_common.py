@@ -0,0 +1,18 @@
+from datetime import datetime, timedelta
+
+from gifr.common import State, uses_envelope, remaining_time
+
+
+def test_uses_envelope_default():
+    assert uses_envelope(State()) is False
+
+
+def test_uses_envelope_enabled():
+    assert uses_envelope(State(params={"envelope": True})) is True
+    assert uses_envelope(State(params={"envelope": False})) is False
+
+
+def test_remaining_time():
+    assert remaining_time(datetime.now(), 0) is None
+    assert remaining_time(datetime.now() - timedelta(seconds=10), 5.0) == 0.0
+    assert 4.0 < remaining_time(datetime.now(), 5.0) <= 5.0
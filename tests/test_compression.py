@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from gifr.compression import compress, decompress, Compressor, CODEC_ZLIB, CODEC_ZSTD, CODEC_LZ4
+
+
+DATA = b"gifr compresses repetitive payloads " * 1000
+
+
+def test_zlib_roundtrip():
+    compressed = compress(CODEC_ZLIB, DATA)
+    assert len(compressed) < len(DATA)
+    assert decompress(CODEC_ZLIB, compressed) == DATA
+
+
+@pytest.mark.parametrize("codec,module", [(CODEC_ZSTD, "zstandard"), (CODEC_LZ4, "lz4")])
+def test_optional_codec_roundtrip(codec, module):
+    pytest.importorskip(module)
+    assert decompress(codec, compress(codec, DATA)) == DATA
+
+
+def test_invalid_codec():
+    with pytest.raises(Exception):
+        Compressor("bzip2")
+
+
+def test_compressor_threshold():
+    compressor = Compressor(CODEC_ZLIB, threshold=len(DATA))
+    assert compressor.compress(DATA) == (None, DATA)
+    assert compressor.compress(DATA.decode()) == (None, DATA)
+    assert compressor.compressed == 0
+
+
+def test_compressor_roundtrip():
+    compressor = Compressor(CODEC_ZLIB, threshold=1024)
+    codec, payload = compressor.compress(DATA)
+    assert codec == CODEC_ZLIB
+    assert compressor.decompress(codec, payload) == DATA
+    assert (compressor.compressed, compressor.decompressed) == (1, 1)
+    assert (compressor.bytes_in, compressor.bytes_out) == (len(DATA), len(payload))
+
+
+def test_compressor_incompressible():
+    data = os.urandom(4096)
+    compressor = Compressor(CODEC_ZLIB, threshold=1024)
+    assert compressor.compress(data) == (None, data)
+    assert compressor.compressed == 0
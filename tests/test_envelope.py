@@ -0,0 +1,46 @@
+import time
+
+from gifr.envelope import pack, unpack, request_header, is_expired, cancel_notice, cancel_channel, \
+    HEADER_ID, HEADER_DEADLINE, HEADER_CANCEL
+
+
+def test_roundtrip():
+    header = {HEADER_ID: "abc", "end": True}
+    assert unpack(pack(header, b"\x00\x01payload")) == (header, b"\x00\x01payload")
+
+
+def test_string_payload():
+    assert unpack(pack({HEADER_ID: "abc"}, "text")) == ({HEADER_ID: "abc"}, b"text")
+
+
+def test_empty_payload():
+    assert unpack(pack({HEADER_ID: "abc"})) == ({HEADER_ID: "abc"}, b"")
+
+
+def test_not_an_envelope():
+    assert unpack(b"raw payload") is None
+    assert unpack("GIFR\x01") is None
+    assert unpack(b"GIFR\x01\x00") is None
+    assert unpack(pack({HEADER_ID: "abc"})[:-3]) is None
+
+
+def test_request_header():
+    header = request_header(5.0)
+    assert len(header[HEADER_ID]) == 32
+    assert time.time() < header[HEADER_DEADLINE] <= time.time() + 5.0
+    assert HEADER_DEADLINE not in request_header(None)
+    assert HEADER_DEADLINE not in request_header(0)
+    assert request_header(1.0)[HEADER_ID] != header[HEADER_ID]
+
+
+def test_is_expired():
+    assert not is_expired({HEADER_ID: "abc"})
+    assert not is_expired({HEADER_DEADLINE: 100.0}, now=99.0)
+    assert is_expired({HEADER_DEADLINE: 100.0}, now=101.0)
+
+
+def test_cancel_notice():
+    header, payload = unpack(cancel_notice("abc"))
+    assert header == {HEADER_ID: "abc", HEADER_CANCEL: True}
+    assert payload == b""
+    assert cancel_channel("images") == "images_cancel"
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from gifr.evaluate import word_errors, normalize_text, wer_metrics, classification_metrics, box_iou, \
+    detection_metrics, confusion_counts, segmentation_metrics
+
+
+@pytest.mark.parametrize("reference,hypothesis,errors", [
+    ("the cat sat", "the cat sat", 0),
+    ("the cat sat", "the dog sat", 1),
+    ("the cat sat", "the sat", 1),
+    ("the cat sat", "the cat sat down", 1),
+    ("the cat sat", "", 3),
+    ("", "hello there", 2),
+    ("a b c d", "b c d e", 2),
+    ("kitten sitting on the mat", "sitting kitten on mat the", 4),
+])
+def test_word_errors(reference, hypothesis, errors):
+    assert word_errors(reference.split(), hypothesis.split()) == errors
+
+
+def test_word_errors_matches_reference_implementation():
+    def levenshtein(ref, hyp):
+        d = list(range(len(ref) + 1))
+        for i, h in enumerate(hyp, start=1):
+            prev, d[0] = d[0], i
+            for j, r in enumerate(ref, start=1):
+                prev, d[j] = d[j], min(d[j] + 1, d[j - 1] + 1, prev + (r != h))
+        return d[-1]
+
+    rng = np.random.default_rng(1)
+    vocab = ["a", "b", "c", "d"]
+    for _ in range(200):
+        ref = list(rng.choice(vocab, rng.integers(0, 8)))
+        hyp = list(rng.choice(vocab, rng.integers(0, 8)))
+        assert word_errors(ref, hyp) == levenshtein(ref, hyp)
+
+
+def test_normalize_text():
+    assert normalize_text("Hello, World! It's me.") == ["hello", "world", "it's", "me"]
+
+
+def test_wer_metrics():
+    records = [{"errors": 1, "words": 4}, {"errors": 0, "words": 6}]
+    assert wer_metrics(records) == {"WER": 0.1, "sentence error rate": 0.5}
+
+
+def test_classification_metrics():
+    records = [
+        {"label": "cat", "prediction": "cat"},
+        {"label": "cat", "prediction": "dog"},
+        {"label": "dog", "prediction": "dog"},
+        {"label": "dog", "prediction": "dog"},
+    ]
+    metrics = classification_metrics(records)
+    assert metrics["accuracy"] == 0.75
+    # cat: F1=2/3, dog: F1=0.8
+    assert metrics["macro F1"] == pytest.approx((2 / 3 + 0.8) / 2)
+
+
+def test_box_iou():
+    a = np.array([[0, 0, 10, 10]], dtype=float)
+    b = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]], dtype=float)
+    assert box_iou(a, b).tolist() == [[1.0, pytest.approx(1 / 3), 0.0]]
+
+
+def test_detection_metrics():
+    gt = [["cat", 0, 0, 10, 10], ["dog", 20, 20, 40, 40]]
+    perfect = [{"pred": [[x[0], 0.9] + x[1:] for x in gt], "gt": gt}]
+    metrics = detection_metrics(perfect, 0.5)
+    assert metrics["mAP@0.50"] == 1.0
+    assert metrics["mAP@[0.50:0.95]"] == 1.0
+    assert metrics["mean IoU (TP)"] == 1.0
+
+    missed = [{"pred": [["cat", 0.9, 0, 0, 10, 10]], "gt": gt}]
+    assert detection_metrics(missed, 0.5)["mAP@0.50"] == 0.5
+
+
+def test_segmentation_metrics():
+    gt = np.array([[0, 0], [1, 1]])
+    pred = np.array([[0, 1], [1, 1]])
+    metrics = segmentation_metrics([{"counts": confusion_counts(gt, pred)}])
+    assert metrics["pixel accuracy"] == 0.75
+    # class 0: 1/2, class 1: 2/3
+    assert metrics["mean IoU"] == pytest.approx((0.5 + 2 / 3) / 2)
+    assert confusion_counts(gt, pred, ignore_index=0) == [[1, 1, 2]]
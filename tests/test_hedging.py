@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import gifr.common
+from gifr.common import State, make_prediction
+from gifr.replicas import ReplicaPool
+from gifr.timeouts import ChannelLatencies
+from gifr.worker import Worker
+
+
+def replica_state(connection):
+    state = State(connection=connection, timeout=2.0, params={"envelope": True, "hedge": True, "hedge_percentile": 95.0})
+    state.replicas = ReplicaPool([("a_in", "a_out"), ("b_in", "b_out")])
+    state.latencies = ChannelLatencies()
+    for i in range(state.latencies.min_samples):
+        state.latencies.record("a_in", "a_out", 5, 0.05)
+    return state
+
+
+def start_worker(connection, channel_in, channel_out, reply, delay):
+    def predict(data):
+        time.sleep(delay)
+        return reply
+
+    worker = Worker(connection, channel_in, channel_out, predict)
+    threading.Thread(target=worker.run, daemon=True).start()
+
+
+@pytest.fixture
+def connection():
+    result = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    start_worker(result, "a_in", "a_out", b"a", 0.5)
+    start_worker(result, "b_in", "b_out", b"b", 0.0)
+    time.sleep(0.1)
+    return result
+
+
+def test_hedge_wins(connection):
+    state = replica_state(connection)
+    assert make_prediction(state, b"hello") == b"b"
+    primary, hedge = state.replicas.replicas
+    assert (primary.in_flight, primary.failures) == (0, 1)
+    assert (hedge.in_flight, hedge.failures) == (0, 0)
+    assert hedge.ewma is not None
+
+
+def test_hedge_send_fails(connection, monkeypatch):
+    publish_envelope = gifr.common.publish_envelope
+
+    def failing_publish(state, channel_in, header, data):
+        if channel_in == "b_in":
+            raise Exception("publish failed")
+        publish_envelope(state, channel_in, header, data)
+
+    monkeypatch.setattr(gifr.common, "publish_envelope", failing_publish)
+    state = replica_state(connection)
+    with pytest.raises(Exception, match="publish failed"):
+        make_prediction(state, b"hello")
+    primary, hedge = state.replicas.replicas
+    assert (primary.in_flight, primary.failures) == (0, 1)
+    assert (hedge.in_flight, hedge.requests, hedge.failures) == (0, 0, 0)
@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import gifr.object_detection_video as video
+from gifr.common import State
+from gifr.object_detection_video import FrameScheduler, FrameStats
+
+
+@pytest.fixture
+def frames(monkeypatch):
+    """
+    Replaces the model/rendering with a function that blocks until the frame gets released.
+    """
+    gates = dict()
+
+    def process_frame(state, frame, frame_id, overlay):
+        gates.setdefault(frame_id, threading.Event()).wait(5.0)
+        return frame, overlay
+
+    def release(seq):
+        gates.setdefault("frame-%d" % seq, threading.Event()).set()
+
+    monkeypatch.setattr(video, "process_frame", process_frame)
+    return release
+
+
+def scheduler(frames_in_flight: int) -> FrameScheduler:
+    return FrameScheduler(State(params={"stats_interval": 0}, logger=logging.getLogger("test")), frames_in_flight)
+
+
+def wait_until(condition, timeout: float = 5.0):
+    end = time.time() + timeout
+    while not condition():
+        assert time.time() < end, "timed out"
+        time.sleep(0.01)
+
+
+def frame(value: int) -> np.ndarray:
+    return np.full((2, 2, 3), value, dtype=np.uint8)
+
+
+def test_latest_frame_wins(frames):
+    s = scheduler(1)
+    for i in range(1, 5):
+        s.submit(frame(i))
+    # frame 1 in flight, frame 4 replaced 2 and 3 while waiting
+    assert s.stats.dropped == 2
+    frames(1)
+    frames(4)
+    wait_until(lambda: s.idle)
+    latest, seq = s.latest()
+    assert (seq, int(latest[0, 0, 0])) == (4, 4)
+    summary = s.stats.summary()
+    assert (summary["frames"], summary["shown"], summary["dropped"], summary["late"]) == (4, 2, 2, 0)
+
+
+def test_late_frames_discarded(frames):
+    s = scheduler(2)
+    s.submit(frame(1))
+    s.submit(frame(2))
+    frames(2)
+    wait_until(lambda: s.latest()[1] == 2)
+    frames(1)
+    wait_until(lambda: s.idle)
+    assert s.latest()[1] == 2
+    assert (s.stats.shown, s.stats.late, s.stats.dropped) == (1, 1, 0)
+
+
+def test_failed_frames(monkeypatch):
+    def process_frame(state, frame, frame_id, overlay):
+        raise Exception("model unavailable")
+
+    monkeypatch.setattr(video, "process_frame", process_frame)
+    s = scheduler(1)
+    s.submit(frame(1))
+    wait_until(lambda: s.idle)
+    assert (s.stats.failed, s.stats.shown) == (1, 0)
+    assert s.latest() == (None, 0)
+
+
+def test_stats_summary():
+    stats = FrameStats()
+    assert stats.summary()["latency_mean"] is None
+    for latency in [0.1, 0.2, 0.3]:
+        stats.frame_shown(latency)
+    summary = stats.summary()
+    assert summary["shown"] == 3
+    assert summary["latency_mean"] == 0.2
+    assert summary["fps"] > 0
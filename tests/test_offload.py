@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from gifr.envelope import HEADER_ID, HEADER_REF, unpack
+from gifr.offload import Offloader, content_key
+
+
+@pytest.fixture
+def connection():
+    return fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+
+def published(connection, offloader, payload):
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe("in")
+    offloader.publish("in", {HEADER_ID: "abc"}, payload)
+    message = None
+    end = time.time() + 1.0
+    while (message is None) and (time.time() < end):
+        message = pubsub.get_message(timeout=0.05)
+    pubsub.close()
+    return unpack(message["data"])
+
+
+def test_below_threshold(connection):
+    offloader = Offloader(connection, 100)
+    header, payload = published(connection, offloader, b"x" * 10)
+    assert HEADER_REF not in header
+    assert payload == b"x" * 10
+    assert offloader.offloaded == 0
+
+
+def test_offload_and_resolve(connection):
+    offloader = Offloader(connection, 100, ttl=60)
+    data = b"x" * 1000
+    header, payload = published(connection, offloader, data)
+    assert header[HEADER_REF] == content_key(data)
+    assert payload == b""
+    assert offloader.resolve(header, payload) == data
+    assert 0 < connection.ttl(header[HEADER_REF]) <= 60
+    assert (offloader.offloaded, offloader.bytes_offloaded, offloader.deduplicated) == (1, 1000, 0)
+
+
+def test_dedupe(connection):
+    offloader = Offloader(connection, 100)
+    data = b"x" * 1000
+    published(connection, offloader, data)
+    published(connection, offloader, data)
+    assert (offloader.offloaded, offloader.deduplicated) == (1, 1)
+
+
+def test_evicted_key_gets_stored_again(connection):
+    offloader = Offloader(connection, 100)
+    data = b"x" * 1000
+    header, payload = published(connection, offloader, data)
+    connection.delete(header[HEADER_REF])
+    header, payload = published(connection, offloader, data)
+    assert offloader.resolve(header, payload) == data
+    assert offloader.offloaded == 2
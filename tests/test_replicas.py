@@ -0,0 +1,73 @@
+import pytest
+
+from gifr.replicas import ReplicaPool, STRATEGY_ROUND_ROBIN, STRATEGY_LEAST_OUTSTANDING, STRATEGY_LATENCY_EWMA
+
+
+CHANNELS = [("in1", "out1"), ("in2", "out2"), ("in3", "out3")]
+
+
+def test_invalid():
+    with pytest.raises(Exception):
+        ReplicaPool([])
+    with pytest.raises(Exception):
+        ReplicaPool(CHANNELS, strategy="random")
+
+
+def test_round_robin():
+    pool = ReplicaPool(CHANNELS, strategy=STRATEGY_ROUND_ROBIN)
+    picked = []
+    for _ in range(6):
+        replica = pool.acquire()
+        picked.append(replica.channel_in)
+        pool.release(replica, 0.1)
+    assert picked == ["in1", "in2", "in3", "in1", "in2", "in3"]
+
+
+def test_least_outstanding():
+    pool = ReplicaPool(CHANNELS, strategy=STRATEGY_LEAST_OUTSTANDING)
+    first = pool.acquire()
+    second = pool.acquire()
+    third = pool.acquire()
+    assert len({first.channel_in, second.channel_in, third.channel_in}) == 3
+    pool.release(second, 0.1)
+    assert pool.acquire() is second
+
+
+def test_latency_ewma():
+    pool = ReplicaPool(CHANNELS, strategy=STRATEGY_LATENCY_EWMA, alpha=0.5)
+    # replicas without latency get probed first
+    for latency in [0.3, 0.1, 0.2]:
+        pool.release(pool.acquire(), latency)
+    assert [x.ewma for x in pool.replicas] == [0.3, 0.1, 0.2]
+    fastest = pool.acquire()
+    assert fastest.channel_in == "in2"
+    pool.release(fastest, 0.5)
+    assert fastest.ewma == pytest.approx(0.3)
+    assert pool.acquire().channel_in == "in3"
+
+
+def test_ejection():
+    pool = ReplicaPool(CHANNELS[:2], strategy=STRATEGY_ROUND_ROBIN, eject_time=60.0)
+    failed = pool.acquire()
+    assert pool.release(failed, None)
+    assert failed.failures == 1
+    for _ in range(4):
+        replica = pool.acquire()
+        assert replica is not failed
+        pool.release(replica, 0.1)
+    # all other replicas excluded: ejected ones are used rather than none
+    assert pool.acquire(exclude=[pool.replicas[1]]) is failed
+
+
+def test_no_ejection():
+    pool = ReplicaPool(CHANNELS[:1], eject_time=0)
+    replica = pool.acquire()
+    assert not pool.release(replica, None)
+    assert pool.acquire(exclude=[replica]) is None
+
+
+def test_discard():
+    pool = ReplicaPool(CHANNELS[:1])
+    replica = pool.acquire()
+    pool.discard(replica)
+    assert (replica.in_flight, replica.requests, replica.failures) == (0, 0, 0)
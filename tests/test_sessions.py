@@ -0,0 +1,50 @@
+import threading
+
+from gifr.sessions import SessionStore, session_id, truncate_history, DEFAULT_SESSION
+
+
+def test_session_id():
+    assert session_id(None) == DEFAULT_SESSION
+
+
+def test_truncate_history():
+    assert truncate_history([1, 2, 3], 2) == [2, 3]
+    assert truncate_history("turn1\nturn2\nturn3", 10) == "turn3"
+    assert truncate_history("abc", 0) == "abc"
+
+
+def test_lru_eviction():
+    store = SessionStore(max_sessions=2)
+    first = store.get("a")
+    store.get("b")
+    assert store.get("a") is first
+    store.get("c")
+    assert len(store) == 2
+    assert store.evictions == 1
+    assert store.get("a") is first
+
+
+def test_update():
+    store = SessionStore(max_history=2)
+    session = store.get("a")
+    store.update(session, history=[1, 2, 3], turns=3)
+    assert (session.history, session.turns) == ([2, 3], 3)
+    store.update(session, turns=4)
+    assert (session.history, session.turns) == ([2, 3], 4)
+
+
+def test_concurrent_updates():
+    store = SessionStore()
+    session = store.get("a")
+
+    def anon_update(offset):
+        for i in range(1000):
+            store.update(session, history=[offset, i], turns=i)
+
+    threads = [threading.Thread(target=anon_update, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert session.turns == 999
+    assert session.history[1] == 999
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import gifr.text_generation as text_generation
+from gifr.common import init_state
+
+
+@pytest.fixture
+def state():
+    ns = text_generation.create_argparser().parse_args([
+        "--json_response", "--history_on", "--incremental_history", "--send_history", "history",
+        "--receive_history", "history"])
+    result = init_state(ns)
+    text_generation.post_init_state(result)
+    return result
+
+
+def replies(monkeypatch, responses):
+    queries = []
+
+    def make_prediction(state, data, channel_in=None, channel_out=None):
+        queries.append(json.loads(data))
+        return responses.pop(0)
+
+    monkeypatch.setattr(text_generation, "make_prediction", make_prediction)
+    return queries
+
+
+def test_incremental(state, monkeypatch):
+    queries = replies(monkeypatch, [json.dumps({"text": "hi", "history": "hello hi"}).encode()])
+    assert text_generation.generate(state, "hello") == "hi"
+    assert "history" not in queries[0]
+    assert "conversation_id" in queries[0]
+
+
+def test_cache_miss_resends_history(state, monkeypatch):
+    queries = replies(monkeypatch, [
+        json.dumps({"cache_miss": True}).encode(),
+        json.dumps({"text": "hi", "history": "hello hi"}).encode()])
+    assert text_generation.generate(state, "hello") == "hi"
+    assert len(queries) == 2
+    assert "history" in queries[1]
+
+
+def test_cache_miss_no_response(state, monkeypatch):
+    replies(monkeypatch, [json.dumps({"cache_miss": True}).encode(), None])
+    assert text_generation.generate(state, "hello") == "no result"
+
+
+def test_unparseable(state, monkeypatch):
+    replies(monkeypatch, [b"not json"])
+    assert text_generation.generate(state, "hello") == "Failed to parse: b'not json'"
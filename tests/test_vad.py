@@ -0,0 +1,60 @@
+import numpy as np
+
+from gifr.vad import speech_segments, detect_speech
+
+
+SR = 16000
+
+
+def noise(seconds: float, seed: int = 1) -> np.ndarray:
+    return np.random.default_rng(seed).normal(0, 0.5, int(seconds * SR))
+
+
+def silence(seconds: float) -> np.ndarray:
+    return np.zeros(int(seconds * SR))
+
+
+def test_silence_only():
+    assert speech_segments(silence(1.0), SR) == []
+    assert speech_segments(silence(0.0), SR) == []
+
+
+def test_trims_leading_and_trailing_silence():
+    y = np.concatenate([silence(1.0), noise(0.5), silence(1.0)])
+    segments = speech_segments(y, SR, padding=0)
+    assert len(segments) == 1
+    start, end = segments[0]
+    # frames are 30ms, so the boundaries are accurate to one frame
+    assert abs(start - SR) <= 0.03 * SR
+    assert abs(end - 1.5 * SR) <= 0.03 * SR
+
+
+def test_padding():
+    y = np.concatenate([silence(1.0), noise(0.5), silence(1.0)])
+    unpadded = speech_segments(y, SR, padding=0)[0]
+    padded = speech_segments(y, SR, padding=100)[0]
+    assert padded[0] == max(0, unpadded[0] - int(0.1 * SR))
+    assert padded[1] == min(len(y), unpadded[1] + int(0.1 * SR))
+
+
+def test_split_on_pauses():
+    y = np.concatenate([noise(0.5), silence(1.0), noise(0.5), silence(0.2), noise(0.5)])
+    assert len(speech_segments(y, SR)) == 1
+    segments = speech_segments(y, SR, min_pause=0.5)
+    assert len(segments) == 2
+    assert segments[0][1] <= segments[1][0]
+    assert len(speech_segments(y, SR, min_pause=0.1)) == 3
+
+
+def test_multichannel():
+    y = np.concatenate([silence(0.5), noise(0.5), silence(0.5)])
+    stereo = np.stack([y, y], axis=1)
+    assert speech_segments(stereo, SR) == speech_segments(y, SR)
+
+
+def test_threshold_relative_to_loudest_frame():
+    y = np.concatenate([noise(0.5) * 0.001, silence(0.5), noise(0.5)])
+    mask, _ = detect_speech(y, SR, threshold=-40.0)
+    assert not mask[:10].any()
+    mask, _ = detect_speech(y, SR, threshold=-80.0)
+    assert mask[:10].all()
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from gifr.common import State, make_prediction
+from gifr.envelope import MAGIC, HEADER_ID, HEADER_DEADLINE, HEADER_END, pack, unpack
+from gifr.worker import Worker
+
+
+@pytest.fixture
+def connection():
+    return fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+
+def upper(data):
+    return bytes(data).upper()
+
+
+def received(connection, channel, data_fn, wait=0.5):
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(channel)
+    data_fn()
+    result = []
+    end = time.time() + wait
+    while time.time() < end:
+        message = pubsub.get_message(timeout=0.05)
+        if message is not None:
+            result.append(message["data"])
+    pubsub.close()
+    return result
+
+
+def test_worker_envelope_reply(connection):
+    worker = Worker(connection, "in", "out", upper)
+    request = pack({HEADER_ID: "abc"}, b"hello")
+    replies = received(connection, "out", lambda: worker.process(request))
+    assert len(replies) == 1
+    header, payload = unpack(replies[0])
+    assert header[HEADER_ID] == "abc"
+    assert payload == b"HELLO"
+
+
+def test_worker_stream_reply(connection):
+    worker = Worker(connection, "in", "out", lambda data: iter([b"a", b"b"]))
+    replies = received(connection, "out", lambda: worker.process(pack({HEADER_ID: "abc"}, b"hello")))
+    replies = [unpack(x) for x in replies]
+    assert [x[1] for x in replies] == [b"a", b"b"]
+    assert not replies[0][0].get(HEADER_END, False)
+    assert replies[1][0][HEADER_END]
+
+
+def test_worker_raw_reply(connection):
+    worker = Worker(connection, "in", "out", upper)
+    replies = received(connection, "out", lambda: worker.process(b"hello"))
+    assert replies == [b"HELLO"]
+
+
+def test_worker_drops_expired(connection):
+    worker = Worker(connection, "in", "out", upper)
+    request = pack({HEADER_ID: "abc", HEADER_DEADLINE: time.time() - 1}, b"hello")
+    replies = received(connection, "out", lambda: worker.process(request))
+    assert replies == []
+    assert worker.expired == 1
+    assert worker.processed == 0
+
+
+@pytest.mark.parametrize("envelope", [False, True])
+def test_make_prediction_envelope_switch(connection, envelope):
+    worker = Worker(connection, "in", "out", upper)
+    threading.Thread(target=worker.run, daemon=True).start()
+    sent = []
+    spy = connection.pubsub(ignore_subscribe_messages=True)
+    spy.subscribe(**{"in": lambda m: sent.append(m["data"])})
+    spy_thread = spy.run_in_thread(sleep_time=0.01, daemon=True)
+    time.sleep(0.1)
+    try:
+        state = State(connection=connection, channel_in="in", channel_out="out", timeout=2.0,
+                      params={"envelope": envelope})
+        assert make_prediction(state, b"hello") == b"HELLO"
+    finally:
+        spy_thread.stop()
+        spy.close()
+    assert len(sent) == 1
+    assert sent[0].startswith(MAGIC) == envelope